@@ -7,17 +7,20 @@ class ApiService {
         this.baseUrl = '/api'; // Update with your API base URL
     }
 
+    // The server identifies the player only by the signed Telegram initData
+    authHeaders() {
+        return { 'X-Telegram-Init-Data': window.Telegram?.WebApp?.initData || '' };
+    }
+
     // Get data with caching
     async get(endpoint, useCache = true) {
         const cacheKey = `GET:${endpoint}`;
         const now = Date.now();
         
         // Return cached data if available and fresh
-        if (useCache && this.cache.has(cacheKey)) {
-            const { data, timestamp } = this.cache.get(cacheKey);
-            if (now - timestamp < this.cacheTTL) {
-                return data;
-            }
+        const cached = useCache ? this.cache.get(cacheKey) : undefined;
+        if (cached && now - cached.timestamp < this.cacheTTL) {
+            return cached.data;
         }
 
         // Return pending promise if request is in progress
@@ -26,20 +29,29 @@ class ApiService {
         }
 
         try {
-            const request = fetch(`${this.baseUrl}${endpoint}`)
+            // Stale entry with an ETag: revalidate, the server answers 304 without a body
+            const headers = this.authHeaders();
+            if (cached && cached.etag) {
+                headers['If-None-Match'] = cached.etag;
+            }
+            const request = fetch(`${this.baseUrl}${endpoint}`, { headers })
                 .then(response => {
+                    if (response.status === 304 && cached) {
+                        cached.timestamp = now;
+                        return cached.data;
+                    }
                     if (!response.ok) {
                         throw new Error(`HTTP error! status: ${response.status}`);
                     }
-                    return response.json();
-                })
-                .then(data => {
-                    // Cache the response
-                    this.cache.set(cacheKey, {
-                        data,
-                        timestamp: now
+                    return response.json().then(data => {
+                        // Cache the response
+                        this.cache.set(cacheKey, {
+                            data,
+                            etag: response.headers.get('ETag'),
+                            timestamp: now
+                        });
+                        return data;
                     });
-                    return data;
                 })
                 .finally(() => {
                     // Clean up pending request
@@ -63,6 +75,7 @@ class ApiService {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    ...this.authHeaders(),
                 },
                 body: JSON.stringify(data)
             });
@@ -78,6 +91,18 @@ class ApiService {
         }
     }
 
+    // Server-Sent Events stream; the browser reconnects by itself and resumes from Last-Event-ID.
+    // EventSource cannot send headers, so initData goes in the query string
+    subscribe(endpoint, handlers) {
+        const initData = encodeURIComponent(this.authHeaders()['X-Telegram-Init-Data']);
+        const separator = endpoint.includes('?') ? '&' : '?';
+        const source = new EventSource(`${this.baseUrl}${endpoint}${separator}initData=${initData}`);
+        Object.entries(handlers).forEach(([event, handler]) => {
+            source.addEventListener(event, message => handler(JSON.parse(message.data)));
+        });
+        return source;
+    }
+
     // Clear specific cache entry
     clearCache(endpoint) {
         const cacheKey = `GET:${endpoint}`;
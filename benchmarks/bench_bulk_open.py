@@ -0,0 +1,47 @@
+# benchmarks/bench_bulk_open.py
+# Открытий кейсов в секунду: N одиночных open_case против одного open_cases(N).
+#
+#   python benchmarks/bench_bulk_open.py --opens 2000
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench_bulk_open.db")
+
+import database as db  # noqa: E402
+
+
+async def main(args):
+    await db.init_db()
+    await db.populate_initial_data()
+    user = await db.create_user_if_not_exists(1)
+    pool = await db.get_pool()
+    async with pool.transaction() as conn:
+        await conn.execute("UPDATE users SET signals = ? WHERE id = ?", (10 ** 12, user["id"]))
+
+    started = time.perf_counter()
+    for _ in range(args.opens):
+        await db.open_case(user["id"], 1)
+    single_rate = args.opens / (time.perf_counter() - started)
+    print(f"open_case x1:       {single_rate:10.0f} opens/s")
+
+    for batch in (10, 100):
+        batches = max(1, args.opens // batch)
+        started = time.perf_counter()
+        for _ in range(batches):
+            await db.open_cases(user["id"], 1, batch)
+        rate = batches * batch / (time.perf_counter() - started)
+        print(f"open_cases x{batch:<3}:    {rate:10.0f} opens/s  (x{rate / single_rate:.1f})")
+
+    await db.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--opens", type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
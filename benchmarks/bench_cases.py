@@ -0,0 +1,109 @@
+# benchmarks/bench_cases.py
+# Скорость розыгрыша alias-таблицей против линейного прохода по шансам
+# и проверка распределения (хи-квадрат) на содержимом "Базового кейса".
+# Если статистика выше критического значения уровня 99%, скрипт завершается
+# с кодом 1 (для CI).
+#
+#   python benchmarks/bench_cases.py --draws 1000000 --outcomes 200
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.case_engine import AliasTable  # noqa: E402
+
+
+def linear_pick(outcomes, weights, total, rng):
+    # Наивный вариант: O(n) проход по накопленным шансам на каждое открытие
+    x = rng.random() * total
+    for outcome, weight in zip(outcomes, weights):
+        x -= weight
+        if x < 0:
+            return outcome
+    return outcomes[-1]
+
+
+# Квантиль 0.99 стандартного нормального распределения
+Z_99 = 2.3263
+
+
+def chi_square_critical(df, z=Z_99):
+    """Критическое значение хи-квадрат (аппроксимация Уилсона-Хилферти, без scipy).
+
+    Для df=1 даёт 6.59 против точных 6.63, дальше ошибка меньше 0.5%.
+    """
+    h = 2 / (9 * df)
+    return df * (1 - h + z * math.sqrt(h)) ** 3
+
+
+def chi_square(table, weights, draws, rng):
+    total = sum(weights)
+    counts = Counter(table.draw_many(draws, rng))
+    stat = 0.0
+    for outcome, weight in zip(table.outcomes, weights):
+        expected = draws * weight / total
+        stat += (counts[outcome] - expected) ** 2 / expected
+    return stat, counts
+
+
+def main(args):
+    rng = random.Random(args.seed)
+
+    # Шансы сидированного "Базового кейса" (в сумме 0.85)
+    basic = AliasTable(["Samsung Galaxy A01", "Google Pixel 8 Pro"], [0.8, 0.05])
+    stat, counts = chi_square(basic, [0.8, 0.05], args.draws, rng)
+    critical = chi_square_critical(1)
+    failed = []
+    if stat > critical:
+        failed.append("basic case")
+    print(f"basic case: {dict(counts)}  chi2={stat:.2f} (df=1, 99% critical {critical:.2f})")
+
+    outcomes = list(range(args.outcomes))
+    weights = [rng.random() for _ in outcomes]
+    total = sum(weights)
+    started = time.perf_counter()
+    table = AliasTable(outcomes, weights)
+    build_ms = (time.perf_counter() - started) * 1000
+    stat, _ = chi_square(table, weights, args.draws, rng)
+    critical = chi_square_critical(args.outcomes - 1)
+    if stat > critical:
+        failed.append(f"{args.outcomes} outcomes")
+    print(f"{args.outcomes} outcomes: build {build_ms:.2f} ms, chi2={stat:.1f} "
+          f"(df={args.outcomes - 1}, 99% critical {critical:.1f})")
+
+    started = time.perf_counter()
+    for _ in range(args.draws):
+        table.draw(rng)
+    alias_rate = args.draws / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    table.draw_many(args.draws, rng)
+    batch_rate = args.draws / (time.perf_counter() - started)
+
+    linear_draws = max(1, args.draws // 10)
+    started = time.perf_counter()
+    for _ in range(linear_draws):
+        linear_pick(outcomes, weights, total, rng)
+    linear_rate = linear_draws / (time.perf_counter() - started)
+
+    print(f"alias draw():      {alias_rate:12.0f} draws/s")
+    print(f"alias draw_many(): {batch_rate:12.0f} draws/s")
+    print(f"linear scan:       {linear_rate:12.0f} draws/s")
+
+    if failed:
+        print(f"FAIL: распределение не сходится с шансами ({', '.join(failed)})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--draws", type=int, default=1_000_000)
+    parser.add_argument("--outcomes", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    sys.exit(main(parser.parse_args()))
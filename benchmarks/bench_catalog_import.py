@@ -0,0 +1,67 @@
+# benchmarks/bench_catalog_import.py
+# Импорт каталога из файлов (utils/catalog_import.py): первый импорт в пустую БД,
+# повторный импорт тех же файлов (ничего не меняется) и импорт с 1% изменённых строк.
+#
+#   python benchmarks/bench_catalog_import.py --phones 50000 --cases 1000 --per-case 30
+import argparse
+import csv
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.catalog_import import RARITIES, import_catalog_files  # noqa: E402
+from utils.schema import CREATE_INDEXES_SQL, CREATE_TABLES_SQL, CREATE_TRIGGERS_SQL  # noqa: E402
+
+
+def write_files(directory, rng, phones, cases, per_case, changed=0.0):
+    """phones.csv, cases.csv и contents.jsonl; changed — доля строк с другой ценой/шансом."""
+    paths = {name: os.path.join(directory, name) for name in ("phones.csv", "cases.csv", "contents.jsonl")}
+    with open(paths["phones.csv"], "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        writer.writerow(("name", "brand", "model_code", "rarity", "value", "image_filename"))
+        for n in range(1, phones + 1):
+            value = n % 3000 + 5 + (1 if rng.random() < changed else 0)
+            writer.writerow((f"Phone {n}", f"Brand {n % 50}", f"M-{n}", RARITIES[n % len(RARITIES)], value,
+                             f"phone_{n}.jpg"))
+    with open(paths["cases.csv"], "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        writer.writerow(("name", "price_signals"))
+        writer.writerows((f"Case {n}", 10 * (n % 25 + 1)) for n in range(1, cases + 1))
+    with open(paths["contents.jsonl"], "w", encoding="utf-8") as out:
+        for n in range(1, cases + 1):
+            # Состав кейса не зависит от rng, меняются только шансы
+            members = random.Random(n).sample(range(1, phones + 1), per_case)
+            weights = [1 + (rng.random() < changed) for _ in members]
+            total = sum(weights)
+            for phone, weight in zip(members, weights):
+                out.write(json.dumps({"case": f"Case {n}", "phone": f"Phone {phone}", "chance": weight / total}) + "\n")
+    return paths
+
+
+def main(args):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "bench_catalog_import.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(CREATE_TABLES_SQL)
+    conn.executescript(CREATE_INDEXES_SQL)
+    conn.executescript(CREATE_TRIGGERS_SQL)
+    conn.close()
+
+    runs = (("первый импорт", 0.0, 1), ("повторный", 0.0, 1), ("1% изменений", 0.01, 2))
+    for label, changed, seed in runs:
+        files = write_files(directory, random.Random(seed), args.phones, args.cases, args.per_case, changed)
+        report = import_catalog_files(path, files["phones.csv"], files["cases.csv"], files["contents.jsonl"])
+        print(f"{label:<15} {report.seconds:6.2f} s   {report.summary()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--phones", type=int, default=50_000)
+    parser.add_argument("--cases", type=int, default=1000)
+    parser.add_argument("--per-case", type=int, default=30)
+    main(parser.parse_args())
@@ -0,0 +1,75 @@
+# benchmarks/bench_order_book.py
+# "Самый дешёвый лот модели": книга заявок в памяти против JOIN + сортировки в SQL.
+#
+#   python benchmarks/bench_order_book.py --listings 100000 --models 500
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.order_book import ORDER_BOOK_SQL, OrderBook  # noqa: E402
+from utils.schema import CREATE_TABLES_SQL, CREATE_INDEXES_SQL  # noqa: E402
+
+# Так на вопрос отвечали бы без книги: через инвентарь к телефонам и сортировка
+CHEAPEST_SQL = """
+    SELECT ml.id, ml.price_signals
+    FROM market_listings ml
+    JOIN user_inventory ui ON ml.inventory_item_id = ui.id
+    JOIN phones p ON ui.phone_id = p.id
+    WHERE p.id = ?
+    ORDER BY ml.price_signals
+    LIMIT 1
+"""
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    conn = sqlite3.connect(os.path.join(tempfile.mkdtemp(), "bench_order_book.db"))
+    conn.row_factory = sqlite3.Row
+    conn.executescript(CREATE_TABLES_SQL)
+    conn.executescript(CREATE_INDEXES_SQL)
+    conn.executemany("INSERT INTO phones (id, name, brand) VALUES (?, ?, 'Bench')",
+                     [(i, f"Phone {i}") for i in range(1, args.models + 1)])
+    conn.execute("INSERT INTO users (id, telegram_id) VALUES (1, 1)")
+    phones = [rng.randint(1, args.models) for _ in range(args.listings)]
+    conn.executemany("INSERT INTO user_inventory (id, user_id, phone_id) VALUES (?, 1, ?)",
+                     [(i, phone_id) for i, phone_id in enumerate(phones, 1)])
+    conn.executemany(
+        "INSERT INTO market_listings (id, seller_user_id, inventory_item_id, phone_id, price_signals)"
+        " VALUES (?, 1, ?, ?, ?)",
+        [(i, i, phone_id, rng.randint(1, 10000)) for i, phone_id in enumerate(phones, 1)])
+    conn.commit()
+
+    book = OrderBook()
+    started = time.perf_counter()
+    book.load(conn.execute(ORDER_BOOK_SQL).fetchall())
+    print(f"warm-up: {(time.perf_counter() - started) * 1000:.0f} ms for {args.listings} listings")
+
+    queries = [rng.randint(1, args.models) for _ in range(args.queries)]
+    started = time.perf_counter()
+    for phone_id in queries:
+        book.best_ask(phone_id)
+    book_us = (time.perf_counter() - started) / len(queries) * 1e6
+
+    sql_queries = queries[: max(1, len(queries) // 20)]
+    started = time.perf_counter()
+    for phone_id in sql_queries:
+        conn.execute(CHEAPEST_SQL, (phone_id,)).fetchone()
+    sql_us = (time.perf_counter() - started) / len(sql_queries) * 1e6
+
+    print(f"order book best_ask: {book_us:10.2f} us/query")
+    print(f"SQL join + sort:     {sql_us:10.2f} us/query")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--listings", type=int, default=100_000)
+    parser.add_argument("--models", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
@@ -0,0 +1,65 @@
+# benchmarks/bench_pool.py
+# Сравнение запросов/сек: соединение на каждый вызов против общего пула.
+#
+#   python benchmarks/bench_pool.py --requests 5000 --concurrency 50
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench_pool.db")
+
+import aiosqlite  # noqa: E402
+import database as db  # noqa: E402
+
+USERS = 1000
+
+
+async def connect_per_call(telegram_id):
+    # Поведение до введения пула: новое соединение (и поток) на каждый запрос
+    async with aiosqlite.connect(db.DATABASE_PATH) as conn:
+        cursor = await conn.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
+        row = await cursor.fetchone()
+        if row:
+            return dict(zip([d[0] for d in cursor.description], row))
+        return None
+
+
+async def run(fn, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await fn(i % USERS + 1)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return requests / (time.perf_counter() - started)
+
+
+async def main(args):
+    await db.init_db()
+    pool = await db.get_pool()
+    async with pool.transaction() as conn:
+        await conn.executemany(
+            "INSERT OR IGNORE INTO users (telegram_id) VALUES (?)",
+            [(i,) for i in range(1, USERS + 1)],
+        )
+
+    baseline = await run(connect_per_call, args.requests, args.concurrency)
+    pooled = await run(db.get_user_by_telegram_id, args.requests, args.concurrency)
+    await db.close_pool()
+
+    print(f"connect-per-call: {baseline:10.0f} req/s")
+    print(f"pooled:           {pooled:10.0f} req/s  (x{pooled / baseline:.1f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
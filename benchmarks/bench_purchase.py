@@ -0,0 +1,152 @@
+# benchmarks/bench_purchase.py
+# Стресс-тест покупок: несколько потоков со своими соединениями гоняются за
+# одними и теми же лотами. Проверяет отсутствие двойных продаж и сохранение
+# суммы сигналов, сравнивает покупки/сек с прежним путём (deferred BEGIN,
+# чтение, арифметика в Python, запись). Прежний путь под гонкой может их не
+# пройти и только показывается; если их не прошёл текущий путь, код выхода 1.
+# Те же инварианты в малом масштабе проверяет pytest (tests/test_purchase.py).
+#
+#   python benchmarks/bench_purchase.py --listings 2000 --threads 8
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.database import GameDatabase  # noqa: E402
+from utils.market import PurchaseStatus  # noqa: E402
+
+START_SIGNALS = 10 ** 9
+
+
+def legacy_buy(conn, listing_id, buyer_id):
+    # Прежняя реализация GameDatabase.buy_item_from_market
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN")
+        cursor.execute("SELECT * FROM market_listings WHERE id = ?", (listing_id,))
+        listing = cursor.fetchone()
+        if not listing:
+            raise Exception("Listing not found")
+        cursor.execute("SELECT * FROM users WHERE id = ?", (buyer_id,))
+        buyer = cursor.fetchone()
+        if buyer['signals'] < listing['price_signals']:
+            raise Exception("Not enough signals")
+        new_balance = buyer['signals'] - listing['price_signals']
+        cursor.execute("UPDATE users SET signals = ? WHERE id = ?", (new_balance, buyer_id))
+        cursor.execute("UPDATE users SET signals = signals + ? WHERE id = ?",
+                       (listing['price_signals'], listing['seller_user_id']))
+        cursor.execute("UPDATE user_inventory SET user_id = ? WHERE id = ?",
+                       (buyer_id, listing['inventory_item_id']))
+        cursor.execute("DELETE FROM market_listings WHERE id = ?", (listing_id,))
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        return False
+
+
+def prepare(path, listings, buyers):
+    os.environ["DATABASE_PATH"] = path
+    game_db = GameDatabase()
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("INSERT INTO phones (name, brand) VALUES ('Bench Phone', 'Bench')")
+    conn.executemany("INSERT INTO users (id, telegram_id, signals) VALUES (?, ?, ?)",
+                     [(i, i, START_SIGNALS) for i in range(1, buyers + 2)])
+    conn.executemany("INSERT INTO user_inventory (id, user_id, phone_id) VALUES (?, 1, 1)",
+                     [(i,) for i in range(1, listings + 1)])
+    conn.executemany(
+        "INSERT INTO market_listings (id, seller_user_id, inventory_item_id, phone_id, price_signals)"
+        " VALUES (?, 1, ?, 1, ?)",
+        [(i, i, random.randint(1, 100)) for i in range(1, listings + 1)])
+    conn.commit()
+    conn.close()
+    return game_db
+
+
+def run(label, path, listings, threads, buy):
+    outcomes = Counter()
+    winners = Counter()
+    lock = threading.Lock()
+
+    def worker(buyer_id):
+        # Все потоки идут по лотам в одном порядке, чтобы гоняться за одними и теми же
+        local, local_winners = Counter(), []
+        for listing_id in range(1, listings + 1):
+            status = buy(listing_id, buyer_id)
+            local[status] += 1
+            if status == "ok":
+                local_winners.append(listing_id)
+        with lock:
+            outcomes.update(local)
+            winners.update(local_winners)
+
+    workers = [threading.Thread(target=worker, args=(buyer_id,)) for buyer_id in range(2, threads + 2)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    conn = sqlite3.connect(path)
+    remaining = conn.execute("SELECT COUNT(*) FROM market_listings").fetchone()[0]
+    total = conn.execute("SELECT SUM(signals) FROM users").fetchone()[0]
+    conn.close()
+    double_sold = sum(1 for count in winners.values() if count > 1)
+    conserved = total == START_SIGNALS * (threads + 1)
+    print(f"{label}: {outcomes['ok'] / elapsed:8.0f} purchases/s, outcomes={dict(outcomes)}, "
+          f"remaining={remaining}, double-sold={double_sold}, signals conserved={conserved}")
+    # Каждый лот продан ровно один раз, и сигналы только переходили между игроками
+    return double_sold == 0 and remaining == 0 and len(winners) == listings and conserved
+
+
+def main(args):
+    workdir = tempfile.mkdtemp()
+
+    local = threading.local()
+
+    def thread_connection(path):
+        # Прежний путь тоже получает постоянные соединения (по одному на поток),
+        # чтобы сравнивался путь покупки, а не стоимость открытия соединения
+        conn = getattr(local, path, None)
+        if conn is None:
+            conn = sqlite3.connect(path, timeout=5)
+            conn.row_factory = sqlite3.Row
+            setattr(local, path, conn)
+        return conn
+
+    path = os.path.join(workdir, "legacy.db")
+    prepare(path, args.listings, args.threads)
+    legacy_path = path
+
+    def legacy(listing_id, buyer_id):
+        return "ok" if legacy_buy(thread_connection(legacy_path), listing_id, buyer_id) else "failed"
+
+    run("legacy ", path, args.listings, args.threads, legacy)
+
+    path = os.path.join(workdir, "atomic.db")
+    game_db = prepare(path, args.listings, args.threads)
+
+    def atomic(listing_id, buyer_id):
+        result = game_db.buy_item_from_market(listing_id, buyer_id)
+        return "ok" if result.status is PurchaseStatus.OK else result.status.value
+
+    if not run("atomic ", path, args.listings, args.threads, atomic):
+        print("FAIL: двойные продажи, непроданные лоты или потерянные сигналы")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--listings", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    sys.exit(main(parser.parse_args()))
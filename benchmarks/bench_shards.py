@@ -0,0 +1,111 @@
+# benchmarks/bench_shards.py
+# Пропускная способность записи в зависимости от DB_SHARDS. Несколько процессов бота
+# параллельно создают игроков, выдают им стартовые наборы и открывают кейсы — записи
+# только в данные игроков. Без шардов все процессы делят одну блокировку записи
+# общего файла, с шардами у каждого файла своя. Выигрыш бывает только при
+# нескольких ядрах: на одном CPU шарды медленнее (x0.54 с 2, x0.68 с 4).
+#
+#   python benchmarks/bench_shards.py --shards 1 2 4 --processes 4
+#   python benchmarks/bench_shards.py --synchronous FULL   # fsync на каждый коммит
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_database(shards, path):
+    # config читает окружение при импорте, поэтому модуль импортируется уже в процессе
+    os.environ.update(
+        TELEGRAM_BOT_TOKEN="benchmark", DATABASE_PATH=path, DB_SHARDS=str(shards), DB_SHARDS_BOT_ONLY="1",
+    )
+    sys.path.insert(0, ROOT)
+    logging.basicConfig(level=logging.ERROR)
+    import database
+    return database
+
+
+async def player(db, telegram_id, case_id, rounds):
+    user = await db.create_user_if_not_exists(telegram_id)
+    for _ in range(rounds):
+        await db.give_starting_items(user)  # +STARTING_SIGNALS, хватает на один кейс
+        await db.open_case(user["id"], case_id)
+    return 1 + 2 * rounds
+
+
+async def work(db, synchronous, telegram_ids, rounds, barrier):
+    await db.init_db()
+    for shard in range(db.DB_SHARDS) if db.SHARDED else [None]:
+        pool = await db.get_shard_pool(shard)
+        async with pool.write() as conn:
+            await conn.execute(f"PRAGMA synchronous = {synchronous}")
+    case_id = (await db.get_catalog()).cases[0]["id"]
+    barrier.wait()
+    started = time.perf_counter()
+    writes = await asyncio.gather(*(player(db, telegram_id, case_id, rounds) for telegram_id in telegram_ids))
+    elapsed = time.perf_counter() - started
+    await db.close_pool()
+    return sum(writes), elapsed
+
+
+def worker(shards, path, synchronous, telegram_ids, rounds, barrier, results):
+    db = import_database(shards, path)
+    results.put(asyncio.run(work(db, synchronous, telegram_ids, rounds, barrier)))
+
+
+def prepare(shards, path):
+    db = import_database(shards, path)
+
+    async def main():
+        await db.init_db()
+        await db.populate_initial_data()
+        await db.close_pool()
+    asyncio.run(main())
+
+
+def run(context, shards, args):
+    path = os.path.join(tempfile.mkdtemp(), "bench_shards.db")
+    setup = context.Process(target=prepare, args=(shards, path))
+    setup.start()
+    setup.join()
+
+    barrier, results = context.Barrier(args.processes), context.Queue()
+    workers = []
+    for index in range(args.processes):
+        first = 10 ** 6 * (index + 1)
+        telegram_ids = range(first, first + args.players)
+        workers.append(context.Process(
+            target=worker, args=(shards, path, args.synchronous, telegram_ids, args.rounds, barrier, results),
+        ))
+    for process in workers:
+        process.start()
+    totals = [results.get() for _ in workers]
+    for process in workers:
+        process.join()
+    writes = sum(count for count, _ in totals)
+    return writes / max(elapsed for _, elapsed in totals)
+
+
+def main(args):
+    context = multiprocessing.get_context("spawn")
+    print(f"CPU: {os.cpu_count()}, процессов: {args.processes}, synchronous={args.synchronous}")
+    baseline = None
+    for shards in args.shards:
+        throughput = run(context, shards, args)
+        baseline = baseline or throughput
+        print(f"DB_SHARDS={shards:<3} {throughput:8.0f} writes/s   x{throughput / baseline:4.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--processes", type=int, default=4, help="процессов бота")
+    parser.add_argument("--players", type=int, default=100, help="параллельных игроков на процесс")
+    parser.add_argument("--rounds", type=int, default=10, help="стартовых наборов и кейсов на игрока")
+    parser.add_argument("--synchronous", default="NORMAL", choices=["OFF", "NORMAL", "FULL"])
+    main(parser.parse_args())
@@ -0,0 +1,117 @@
+# benchmarks/bench_users.py
+# Обращения к БД на апдейт Telegram: /start и кнопка "Мой инвентарь".
+# Старый путь (SELECT, INSERT, SELECT, выдача предметов отдельной транзакцией,
+# чтение пользователя на каждое нажатие) против upsert + LRU-кэша пользователей.
+# Считаются все выражения SQL на всех соединениях пула, включая BEGIN/COMMIT.
+#
+#   python benchmarks/bench_users.py --users 500 --presses 5
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from contextlib import AsyncExitStack
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench_users.db")
+
+import database as db  # noqa: E402
+
+statements = 0
+
+
+def count_statement(_sql):
+    global statements
+    statements += 1
+
+
+async def trace_pool(pool):
+    # Берём у пула все соединения сразу, чтобы повесить на них счётчик
+    async with AsyncExitStack() as stack:
+        connections = [await stack.enter_async_context(pool.write())]
+        for _ in range(pool.readers):
+            connections.append(await stack.enter_async_context(pool.read()))
+        for conn in connections:
+            await conn.set_trace_callback(count_statement)
+
+
+# --- Как было до upsert и кэша ---
+async def legacy_get_user(pool, telegram_id):
+    async with pool.read() as conn:
+        async with conn.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,)) as cursor:
+            row = await cursor.fetchone()
+    return dict(row) if row else None
+
+
+async def legacy_start(pool, telegram_id):
+    user = await legacy_get_user(pool, telegram_id)
+    if user:
+        return user
+    async with pool.transaction() as conn:
+        await conn.execute("INSERT INTO users (telegram_id) VALUES (?)", (telegram_id,))
+    user = await legacy_get_user(pool, telegram_id)
+    async with pool.transaction() as conn:
+        async with conn.execute("SELECT id FROM phones WHERE name = ?", ("Samsung Galaxy A01",)) as cursor:
+            phone_id = (await cursor.fetchone())[0]
+        await conn.execute("INSERT INTO user_inventory (user_id, phone_id) VALUES (?, ?)", (user["id"], phone_id))
+        await conn.execute("UPDATE users SET signals = signals + 50 WHERE telegram_id = ?", (telegram_id,))
+    return user
+
+
+async def legacy_inventory(pool, telegram_id):
+    user = await legacy_get_user(pool, telegram_id)
+    return await db.get_inventory_summary(user["id"])
+
+
+# --- Текущий путь ---
+async def current_start(pool, telegram_id):
+    return await db.create_user_if_not_exists(telegram_id)
+
+
+async def current_inventory(pool, telegram_id):
+    user = await db.get_user_by_telegram_id(telegram_id)
+    return await db.get_inventory_summary(user["id"])
+
+
+async def run(label, pool, start, inventory, telegram_ids, presses):
+    global statements
+    statements = 0
+    started = time.perf_counter()
+    for telegram_id in telegram_ids:
+        await start(pool, telegram_id)  # новый игрок
+    new_statements = statements
+
+    statements = 0
+    updates = 0
+    for telegram_id in telegram_ids:
+        await start(pool, telegram_id)  # повторный /start
+        updates += 1
+        for _ in range(presses):
+            await inventory(pool, telegram_id)
+            updates += 1
+    elapsed = time.perf_counter() - started
+    print(f"{label:<10} new user: {new_statements / len(telegram_ids):5.1f} stmt   "
+          f"known user update: {statements / updates:5.2f} stmt   "
+          f"{(len(telegram_ids) + updates) / elapsed:8.0f} updates/s")
+
+
+async def main(args):
+    await db.init_db()
+    await db.populate_initial_data()
+    pool = await db.get_pool()
+    await db.get_catalog()
+    await trace_pool(pool)
+
+    await run("legacy", pool, legacy_start, legacy_inventory, range(1, args.users + 1), args.presses)
+    await run("current", pool, current_start, current_inventory,
+              range(10 ** 6, 10 ** 6 + args.users), args.presses)
+    await db.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--presses", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
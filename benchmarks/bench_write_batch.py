@@ -0,0 +1,92 @@
+# benchmarks/bench_write_batch.py
+# Групповой коммит против транзакции на каждый вызов. Параллельные игроки
+# создаются (/start со стартовым телефоном) и затем выставляют и снимают
+# свой телефон с рынка. Оба режима выполняют одни и те же операции database.py,
+# отличается только submit_write. Коммиты считаются на соединении-писателе.
+#
+#   python benchmarks/bench_write_batch.py --users 200 --cycles 20
+#   python benchmarks/bench_write_batch.py --synchronous FULL   # fsync на каждый коммит
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench_write_batch.db")
+
+import database as db  # noqa: E402
+
+commits = 0
+
+
+def count_commit(sql):
+    global commits
+    if sql == "COMMIT":
+        commits += 1
+
+
+async def per_call_submit(op):
+    # Как было: своя транзакция BEGIN IMMEDIATE ... COMMIT на каждую запись
+    pool = await db.get_pool()
+    async with pool.transaction() as conn:
+        return await op(conn)
+
+
+async def player(telegram_id, cycles, latencies):
+    started = time.perf_counter()
+    user = await db.create_user_if_not_exists(telegram_id)
+    latencies.append(time.perf_counter() - started)
+    item = (await db.get_inventory_summary(user["id"]))["models"][0]
+    for _ in range(cycles):
+        started = time.perf_counter()
+        listing_id = (await db.list_item_on_market(user["id"], item["id"], 100)).listing_id
+        latencies.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        await db.remove_item_from_market(listing_id)
+        latencies.append(time.perf_counter() - started)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(label, telegram_ids, cycles):
+    global commits
+    commits = 0
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*(player(telegram_id, cycles, latencies) for telegram_id in telegram_ids))
+    elapsed = time.perf_counter() - started
+    latencies_ms = [latency * 1000 for latency in latencies]
+    print(f"{label:<10} {len(latencies) / elapsed:8.0f} writes/s   {commits / elapsed:7.0f} commits/s   "
+          f"{len(latencies) / max(commits, 1):5.1f} writes/commit   "
+          f"p50 {percentile(latencies_ms, 0.5):6.2f} ms   p99 {percentile(latencies_ms, 0.99):6.2f} ms")
+
+
+async def main(args):
+    await db.init_db()
+    await db.populate_initial_data()
+    pool = await db.get_pool()
+    async with pool.write() as conn:
+        await conn.execute(f"PRAGMA synchronous = {args.synchronous}")
+        await conn.set_trace_callback(count_commit)
+    await db.get_catalog()
+
+    batched_submit = db.submit_write
+    db.submit_write = per_call_submit
+    await run("per-call", range(1, args.users + 1), args.cycles)
+    db.submit_write = batched_submit
+    await run("batched", range(10 ** 6, 10 ** 6 + args.users), args.cycles)
+    await db.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200, help="параллельных игроков")
+    parser.add_argument("--cycles", type=int, default=20, help="выставлений и снятий лота на игрока")
+    parser.add_argument("--synchronous", default="NORMAL", choices=["OFF", "NORMAL", "FULL"])
+    asyncio.run(main(parser.parse_args()))
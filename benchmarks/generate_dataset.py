@@ -0,0 +1,201 @@
+# benchmarks/generate_dataset.py
+# Воспроизводимый синтетический датасет "как в проде" для прогонов слоя данных:
+# каталог, игроки, инвентарь с перекосом (у немногих игроков очень много телефонов)
+# рынок и история сделок. Строки вставляются executemany пачками, индексы и триггеры
+# создаются после загрузки, как и ANALYZE; users.inventory_value и свечи сделок
+# пересчитываются одним проходом.
+#
+#   python benchmarks/generate_dataset.py --output /tmp/dataset.db
+#   python benchmarks/generate_dataset.py --output /tmp/small.db --users 10000 --inventory 100000 --listings 5000
+import argparse
+import datetime
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.schema import (  # noqa: E402
+    CREATE_INDEXES_SQL, CREATE_TABLES_SQL, CREATE_TRIGGERS_SQL, INVENTORY_VALUE_BACKFILL_SQL,
+    TRADE_ROLLUPS_BACKFILL_SQL,
+)
+from utils.users import STARTER_PHONE_NAME  # noqa: E402
+
+CHUNK_SIZE = 50_000
+# telegram_id игрока с users.id = n — TELEGRAM_ID_OFFSET + n
+TELEGRAM_ID_OFFSET = 10_000_000
+BRANDS = ("Apple", "Samsung", "Google", "Xiaomi", "OnePlus", "Nothing", "Sony", "Motorola")
+# (редкость, доля моделей, стоимость от и до)
+RARITIES = (
+    ("Common", 0.55, 5, 50),
+    ("Rare", 0.25, 50, 200),
+    ("Epic", 0.15, 200, 800),
+    ("Legendary", 0.05, 800, 3000),
+)
+# Лоты выставлены, а сделки прошли за последние 30 дней от этой даты
+LISTED_UNTIL = datetime.datetime(2026, 1, 1)
+HISTORY_SECONDS = 30 * 86400
+
+
+def chunked(rows, size=CHUNK_SIZE):
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+
+def generate_phones(rng, count):
+    rarities = [rarity for rarity, share, _low, _high in RARITIES for _ in range(round(count * share))]
+    rarities += ["Common"] * (count - len(rarities))
+    values = {rarity: (low, high) for rarity, _share, low, high in RARITIES}
+    phones = []
+    for phone_id in range(1, count + 1):
+        rarity = rarities[phone_id - 1]
+        brand = BRANDS[phone_id % len(BRANDS)]
+        phones.append((
+            phone_id, f"{brand} Phone {phone_id}", brand, f"SYN-{phone_id:05d}", rarity,
+            rng.randint(*values[rarity]), f"synthetic_{phone_id}.jpg",
+        ))
+    # Первая модель — стартовый телефон, его получает каждый новый игрок
+    phones[0] = (1, STARTER_PHONE_NAME, "Samsung", "SM-A015F", "Common", 10, "galaxy_a01.jpg")
+    return phones
+
+
+def generate_cases(rng, count, phones):
+    cases, contents = [], []
+    for case_id in range(1, count + 1):
+        cases.append((case_id, f"Синтетический кейс {case_id}", rng.choice((10, 25, 50, 100, 250))))
+        members = rng.sample(phones, min(len(phones), rng.randint(10, 30)))
+        # Дешёвые модели выпадают чаще, шансы в сумме дают 1
+        weights = [1 / phone[5] for phone in members]
+        total = sum(weights)
+        contents.extend((case_id, phone[0], weight / total) for phone, weight in zip(members, weights))
+    return cases, contents
+
+
+def inventory_owner(rng, users):
+    # Квадрат равномерного распределения: игроки с малыми id — "киты" с тысячами телефонов
+    return int(users * rng.random() ** 2) + 1
+
+
+def generate_trades(rng, count, users, phone_rows):
+    """Сделки по времени (id растут вместе с traded_at), цена — стоимость модели ×0.5..3."""
+    phone_ids = [phone[0] for phone in phone_rows]
+    phone_weights = list(itertools.accumulate(1 / phone[5] for phone in phone_rows))
+    values = {phone[0]: phone[5] for phone in phone_rows}
+    started = LISTED_UNTIL - datetime.timedelta(seconds=HISTORY_SECONDS)
+    offsets = sorted(rng.randrange(HISTORY_SECONDS) for _ in range(count))
+    for trade_id, offset in enumerate(offsets, 1):
+        phone_id = rng.choices(phone_ids, cum_weights=phone_weights)[0]
+        yield (
+            trade_id, trade_id, phone_id, rng.randint(1, users), rng.randint(1, users),
+            max(1, int(values[phone_id] * rng.uniform(0.5, 3.0))),
+            (started + datetime.timedelta(seconds=offset)).strftime("%Y-%m-%d %H:%M:%S"),
+        )
+
+
+def generate(path, users, inventory, listings, phones=200, cases=20, seed=42, trades=1_000_000, log=print):
+    """Создаёт БД path с нуля; возвращает число строк по таблицам."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path, isolation_level=None)
+    # Журнал и fsync на время загрузки не нужны: при сбое датасет просто генерируется заново
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")
+    conn.executescript(CREATE_TABLES_SQL)
+    started = time.perf_counter()
+
+    conn.execute("BEGIN")
+    phone_rows = generate_phones(rng, phones)
+    conn.executemany(
+        "INSERT INTO phones (id, name, brand, model_code, rarity, value, image_filename)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?)", phone_rows)
+    case_rows, content_rows = generate_cases(rng, cases, phone_rows)
+    conn.executemany("INSERT INTO cases (id, name, price_signals) VALUES (?, ?, ?)", case_rows)
+    conn.executemany("INSERT INTO case_contents (case_id, phone_id, chance) VALUES (?, ?, ?)", content_rows)
+
+    for chunk in chunked((n, TELEGRAM_ID_OFFSET + n, rng.randint(0, 5000)) for n in range(1, users + 1)):
+        conn.executemany("INSERT INTO users (id, telegram_id, signals) VALUES (?, ?, ?)", chunk)
+    log(f"users: {users} ({time.perf_counter() - started:.1f} s)")
+
+    # Модели выпадают обратно пропорционально стоимости, как из кейсов
+    phone_ids = [phone[0] for phone in phone_rows]
+    phone_weights = list(itertools.accumulate(1 / phone[5] for phone in phone_rows))
+    inventory_rows = (
+        (item_id, inventory_owner(rng, users), phone_id)
+        for item_id, phone_id in zip(
+            range(1, inventory + 1),
+            itertools.chain.from_iterable(
+                rng.choices(phone_ids, cum_weights=phone_weights, k=CHUNK_SIZE)
+                for _ in range(0, inventory, CHUNK_SIZE)
+            ),
+        )
+    )
+    for chunk in chunked(inventory_rows):
+        conn.executemany("INSERT INTO user_inventory (id, user_id, phone_id) VALUES (?, ?, ?)", chunk)
+    log(f"user_inventory: {inventory} ({time.perf_counter() - started:.1f} s)")
+
+    # Лот — случайный предмет инвентаря, продавец и модель берутся из него
+    listed_items = sorted(rng.sample(range(1, inventory + 1), min(listings, inventory)))
+    listing_rows = (
+        (
+            listing_id, item_id, rng.uniform(0.5, 3.0),
+            (LISTED_UNTIL - datetime.timedelta(seconds=rng.randrange(30 * 86400))).strftime("%Y-%m-%d %H:%M:%S"),
+        )
+        for listing_id, item_id in enumerate(listed_items, 1)
+    )
+    for chunk in chunked(listing_rows):
+        conn.executemany(
+            """INSERT INTO market_listings (
+                   id, seller_user_id, inventory_item_id, phone_id, rarity, brand, price_signals, listed_at
+               )
+               SELECT ?, ui.user_id, ui.id, ui.phone_id, p.rarity, p.brand, MAX(1, CAST(p.value * ? AS INTEGER)), ?
+               FROM user_inventory ui JOIN phones p ON p.id = ui.phone_id
+               WHERE ui.id = ?""",
+            [(listing_id, multiplier, listed_at, item_id) for listing_id, item_id, multiplier, listed_at in chunk])
+    log(f"market_listings: {len(listed_items)} ({time.perf_counter() - started:.1f} s)")
+    # Триггеров ещё нет: стоимость инвентарей считается одним проходом
+    conn.execute(INVENTORY_VALUE_BACKFILL_SQL)
+    log(f"users.inventory_value ({time.perf_counter() - started:.1f} s)")
+
+    for chunk in chunked(generate_trades(rng, trades, users, phone_rows)):
+        conn.executemany(
+            """INSERT INTO trades (id, listing_id, phone_id, seller_user_id, buyer_user_id, price_signals, traded_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""", chunk)
+    conn.execute("COMMIT")
+    conn.executescript(TRADE_ROLLUPS_BACKFILL_SQL)
+    log(f"trades: {trades}, свечи ({time.perf_counter() - started:.1f} s)")
+
+    conn.executescript(CREATE_INDEXES_SQL)
+    conn.executescript(CREATE_TRIGGERS_SQL)
+    conn.execute("ANALYZE")
+    log(f"indexes, ANALYZE ({time.perf_counter() - started:.1f} s)")
+    conn.execute("PRAGMA journal_mode = WAL")
+    counts = {
+        table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ("phones", "cases", "case_contents", "users", "user_inventory", "market_listings",
+                      "trades", "trade_candles")
+    }
+    conn.close()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", required=True, help="путь к создаваемой БД (перезаписывается)")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--inventory", type=int, default=10_000_000)
+    parser.add_argument("--listings", type=int, default=200_000)
+    parser.add_argument("--phones", type=int, default=200)
+    parser.add_argument("--cases", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--trades", type=int, default=1_000_000)
+    args = parser.parse_args()
+    counts = generate(args.output, args.users, args.inventory, args.listings, args.phones, args.cases, args.seed,
+                      args.trades)
+    print(f"{args.output}: {os.path.getsize(args.output) / 2 ** 20:.0f} MiB, {counts}")
@@ -0,0 +1,132 @@
+# benchmarks/load_api.py
+# Нагрузочный прогон веб-API (index.py) через настоящий HTTP-сервер:
+# смесь запросов мини-приложения, p50/p99 по каждому эндпоинту.
+#
+#   python benchmarks/load_api.py --requests 5000 --concurrency 32
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "load_api.db")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "load-api")
+
+from werkzeug.serving import make_server  # noqa: E402
+
+import index  # noqa: E402
+from utils.webapp_auth import INIT_DATA_HEADER, sign_init_data  # noqa: E402
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def seed(users, listings):
+    with index.game_db.pool.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO phones (id, name, brand, rarity, value) VALUES (?, ?, ?, ?, ?)",
+            [(i, f"Phone {i}", f"Brand {i % 5}", "Common", 10 * i) for i in range(1, 51)])
+        conn.execute("INSERT INTO cases (id, name, price_signals) VALUES (1, 'Bench case', 5)")
+        conn.executemany("INSERT INTO case_contents (case_id, phone_id, chance) VALUES (1, ?, 0.02)",
+                         [(i,) for i in range(1, 51)])
+        conn.executemany("INSERT INTO users (id, telegram_id, signals) VALUES (?, ?, ?)",
+                         [(i, 1000 + i, 10 ** 9) for i in range(1, users + 1)])
+        conn.executemany("INSERT INTO user_inventory (id, user_id, phone_id) VALUES (?, ?, ?)",
+                         [(i, i % users + 1, i % 50 + 1) for i in range(1, listings * 2 + 1)])
+        conn.executemany(
+            "INSERT INTO market_listings (id, seller_user_id, inventory_item_id, phone_id, price_signals)"
+            " VALUES (?, ?, ?, ?, ?)",
+            [(i, i % users + 1, i, i % 50 + 1, random.randint(1, 1000)) for i in range(1, listings + 1)])
+    index.game_db.warm_order_book()
+
+
+def main(args):
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    seed(args.users, args.listings)
+    server = make_server("127.0.0.1", 0, index.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}/api"
+    rng = random.Random(args.seed)
+
+    # initData каждого игрока подписывается один раз, как её выдаёт Telegram
+    auth_date = str(int(time.time()))
+    init_data = {
+        telegram_id: sign_init_data(
+            {"auth_date": auth_date, "user": json.dumps({"id": telegram_id})}, index.TELEGRAM_BOT_TOKEN)
+        for telegram_id in range(1001, 1001 + args.users)
+    }
+
+    def request_plan():
+        telegram_id = 1000 + rng.randint(1, args.users)
+        roll = rng.random()
+        if roll < 0.35:
+            plan = "GET /market", f"{base}/market?excludeSeller={telegram_id}", None
+        elif roll < 0.60:
+            plan = "GET /inventory", f"{base}/inventory", None
+        elif roll < 0.75:
+            plan = "GET /cases", f"{base}/cases", None
+        elif roll < 0.85:
+            plan = "GET /market/depth", f"{base}/market/depth?phoneId={rng.randint(1, 50)}", None
+        elif roll < 0.95:
+            plan = "POST /cases/open", f"{base}/cases/open", {"caseId": 1, "count": 1}
+        else:
+            plan = "POST /market/buy", f"{base}/market/buy", {"listingId": rng.randint(1, args.listings)}
+        return (*plan, init_data[telegram_id])
+
+    plans = [request_plan() for _ in range(args.requests)]
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    lock = threading.Lock()
+
+    def fire(plan):
+        name, url, body, auth = plan
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json", INIT_DATA_HEADER: auth}
+        req = urllib.request.Request(url, data=data, headers=headers)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies[name].append(elapsed)
+            statuses[name][status] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(fire, plans))
+    wall = time.perf_counter() - started
+    server.shutdown()
+
+    everything = [sample for samples in latencies.values() for sample in samples]
+    print(f"{args.requests} requests, concurrency {args.concurrency}: {args.requests / wall:.0f} req/s")
+    print(f"{'endpoint':<20}{'count':>7}{'p50 ms':>9}{'p99 ms':>9}  statuses")
+    for name in sorted(latencies):
+        samples = latencies[name]
+        print(f"{name:<20}{len(samples):>7}{percentile(samples, 0.5):>9.2f}{percentile(samples, 0.99):>9.2f}"
+              f"  {dict(statuses[name])}")
+    print(f"{'all':<20}{len(everything):>7}{percentile(everything, 0.5):>9.2f}{percentile(everything, 0.99):>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--listings", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
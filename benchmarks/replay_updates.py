@@ -0,0 +1,291 @@
+# benchmarks/replay_updates.py
+# Прогон апдейтов через вебхук бота без сети Telegram. Бот запускается отдельным
+# процессом (python bot.py в режиме вебхука) и ходит в поддельный Bot API
+# (TELEGRAM_API_BASE_URL), апдейты отправляются на его локальный вебхук.
+# Задержка — от отправки апдейта до ответа бота (sendMessage / editMessageText).
+#
+#   python benchmarks/replay_updates.py --users 200 --updates-per-user 5 --api-latency-ms 30
+#   python benchmarks/replay_updates.py --record updates.jsonl   # сохранить сгенерированные апдейты
+#   python benchmarks/replay_updates.py --replay updates.jsonl   # прогнать записанные апдейты
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from urllib.parse import parse_qsl
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from webhook import read_http_request, wants_keep_alive, write_http_response  # noqa: E402
+
+WEBHOOK_SECRET = "replay-secret"
+# Ответ бота, завершающий обработку апдейта
+FINAL_METHODS = {"sendmessage", "editmessagetext"}
+
+
+class FakeBotApi:
+    """Поддельный Bot API: отвечает на вызовы бота с заданной задержкой
+    и отмечает, когда по каждому чату пришёл ответ."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.port = None
+        self._message_ids = itertools.count(1)
+        self._server = None
+        self.reset()
+
+    def reset(self, expected=0):
+        self.expected = expected
+        self.webhook_set = asyncio.Event()
+        self.done = asyncio.Event()
+        self.pending = defaultdict(deque)  # chat_id -> время отправки апдейтов по порядку
+        self.latencies = []
+        self.calls = defaultdict(int)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve_connection, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            while True:
+                request = await read_http_request(reader)
+                if request is None:
+                    break
+                _method, path, headers, body = request
+                api_method = path.rsplit("/", 1)[-1].lower()
+                params = dict(parse_qsl(body.decode())) if body else {}
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                result = self._answer(api_method, params)
+                keep_alive = wants_keep_alive(headers)
+                write_http_response(writer, 200, json.dumps({"ok": True, "result": result}).encode(), keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _answer(self, api_method, params):
+        self.calls[api_method] += 1
+        if api_method == "getme":
+            return {"id": 123456, "is_bot": True, "first_name": "Replay", "username": "replay_bot"}
+        if api_method == "setwebhook":
+            self.webhook_set.set()
+            return True
+        if api_method not in FINAL_METHODS:
+            return True
+        chat_id = int(params["chat_id"])
+        queue = self.pending.get(chat_id)
+        if queue:
+            self.latencies.append(time.perf_counter() - queue.popleft())
+            if len(self.latencies) == self.expected:
+                self.done.set()
+        return {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+
+def generate_updates(users, per_user, seed):
+    """Для каждого пользователя: /start, затем нажатия кнопок меню."""
+    rng = random.Random(seed)
+    update_ids = itertools.count(1)
+    now = int(time.time())
+    streams = []
+    for telegram_id in range(100_000, 100_000 + users):
+        sender = {"id": telegram_id, "is_bot": False, "first_name": f"User {telegram_id}"}
+        chat = {"id": telegram_id, "type": "private"}
+        stream = [{
+            "update_id": next(update_ids),
+            "message": {
+                "message_id": 1, "date": now, "chat": chat, "from": sender, "text": "/start",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            },
+        }]
+        for press in range(per_user - 1):
+            stream.append({
+                "update_id": next(update_ids),
+                "callback_query": {
+                    "id": f"{telegram_id}-{press}",
+                    "from": sender,
+                    "chat_instance": str(telegram_id),
+                    "data": rng.choice(["inventory", "inventory", "market", "shop_cases"]),
+                    "message": {"message_id": 2, "date": now, "chat": chat, "text": "menu"},
+                },
+            })
+        streams.append(stream)
+    return streams
+
+
+def chat_of(update):
+    message = update.get("message") or update["callback_query"]["message"]
+    return message["chat"]["id"]
+
+
+async def read_http_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Вебхук закрыл соединение")
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    if length:
+        await reader.readexactly(length)
+    return status
+
+
+async def replay(streams, connections, api, port, path):
+    """Апдейты одного чата отправляются по порядку, разные чаты — параллельно.
+
+    Как и Telegram, держим `connections` keep-alive соединений; каждое берёт
+    следующий чат из очереди, отправляет его очередной апдейт и возвращает чат в конец.
+    """
+    ready = asyncio.Queue()
+    for stream in streams:
+        ready.put_nowait(iter(stream))
+    remaining = [len(streams)]
+
+    async def connection_worker():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            while remaining[0]:
+                stream = await ready.get()
+                if stream is None:
+                    break
+                update = next(stream, None)
+                if update is None:
+                    remaining[0] -= 1
+                    if not remaining[0]:
+                        for _ in range(connections):
+                            ready.put_nowait(None)
+                    continue
+                body = json.dumps(update).encode()
+                api.pending[chat_of(update)].append(time.perf_counter())
+                writer.write(
+                    f"POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+                    f"X-Telegram-Bot-Api-Secret-Token: {WEBHOOK_SECRET}\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                status = await read_http_response(reader)
+                if status != 200:
+                    raise RuntimeError(f"Вебхук ответил {status}")
+                ready.put_nowait(stream)
+        finally:
+            writer.close()
+
+    await asyncio.gather(*(connection_worker() for _ in range(connections)))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_mode(api, streams, args, max_concurrent_updates):
+    api.reset(expected=sum(len(stream) for stream in streams))
+    port = free_port()
+    env = {
+        **os.environ,
+        "TELEGRAM_BOT_TOKEN": "123456:replay",
+        "TELEGRAM_API_BASE_URL": f"http://127.0.0.1:{api.port}/bot",
+        # Каждый прогон — с чистой БД и холодными кэшами
+        "DATABASE_PATH": os.path.join(tempfile.mkdtemp(), "replay_updates.db"),
+        "WEBHOOK_URL": "https://replay.invalid/telegram",
+        "WEBHOOK_LISTEN": "127.0.0.1",
+        "WEBHOOK_PORT": str(port),
+        "WEBHOOK_PATH": "/telegram",
+        "WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "MAX_CONCURRENT_UPDATES": str(max_concurrent_updates),
+    }
+    bot = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(ROOT, "bot.py"), cwd=ROOT, env=env,
+        stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+    try:
+        # setWebhook вызывается после запуска HTTP-сервера, значит вебхук уже слушает
+        await asyncio.wait_for(api.webhook_set.wait(), timeout=30)
+        started = time.perf_counter()
+        await replay(streams, args.connections, api, port, "/telegram")
+        await asyncio.wait_for(api.done.wait(), timeout=300)
+        elapsed = time.perf_counter() - started
+    finally:
+        bot.send_signal(signal.SIGTERM)
+        await bot.wait()
+
+    latencies_ms = [latency * 1000 for latency in api.latencies]
+    print(f"max_concurrent_updates={max_concurrent_updates:<4} {api.expected / elapsed:8.0f} updates/s   "
+          f"p50 {percentile(latencies_ms, 0.5):7.1f} ms   p99 {percentile(latencies_ms, 0.99):7.1f} ms")
+
+
+def load_streams(path):
+    streams = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                update = json.loads(line)
+                streams[chat_of(update)].append(update)
+    return list(streams.values())
+
+
+async def main(args):
+    logging.basicConfig(level=logging.WARNING)
+    if args.replay:
+        streams = load_streams(args.replay)
+    else:
+        streams = generate_updates(args.users, args.updates_per_user, args.seed)
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as f:
+            for update in sorted((u for s in streams for u in s), key=lambda u: u["update_id"]):
+                f.write(json.dumps(update, ensure_ascii=False) + "\n")
+
+    api = FakeBotApi(args.api_latency_ms / 1000)
+    await api.start()
+    for max_concurrent_updates in args.modes:
+        await run_mode(api, streams, args, max_concurrent_updates)
+    await api.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--updates-per-user", type=int, default=5)
+    parser.add_argument("--api-latency-ms", type=float, default=30.0, help="задержка ответа поддельного Bot API")
+    parser.add_argument("--connections", type=int, default=40, help="как max_connections вебхука в Telegram")
+    parser.add_argument("--modes", type=int, nargs="+", default=[1, 16],
+                        help="значения max_concurrent_updates для сравнения")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--record", help="записать апдейты в JSONL")
+    parser.add_argument("--replay", help="прогнать апдейты из JSONL")
+    parser.add_argument("--verbose", action="store_true", help="показывать лог бота")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,334 @@
+# benchmarks/run_suite.py
+# Прогон всех публичных функций database.py (бот) и GameDatabase (веб-API)
+# на датасете из generate_dataset.py. По каждой функции (и её вариантам) —
+# вызовов в секунду и p50/p95/p99 в одном клиенте; размер файла БД до и после.
+# Результат — JSON, чтобы сравнивать коммиты между собой.
+#
+#   python benchmarks/generate_dataset.py --output /tmp/dataset.db
+#   python benchmarks/run_suite.py --dataset /tmp/dataset.db --output before.json
+#   python benchmarks/run_suite.py --dataset /tmp/dataset.db --output after.json --compare before.json
+#
+# Пишущие функции меняют датасет, поэтому по умолчанию прогон идёт на копии.
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate_dataset import TELEGRAM_ID_OFFSET  # noqa: E402
+
+# Служебные функции, которые не имеет смысла мерить отдельно
+BOT_INFRASTRUCTURE = {"get_pool", "get_shard_pool", "close_pool", "get_write_batcher", "submit_write",
+                      "invalidate_catalog", "invalidate_users"}
+WEB_INFRASTRUCTURE = {"init_database", "close", "wake_market_feed"}
+# Покупателям и открывающим кейсы хватает сигналов на весь прогон
+RICH_BALANCE = 10 ** 12
+
+
+def call(*args, **kwargs):
+    return args, kwargs
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def db_size(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Fixtures:
+    """Идентификаторы из датасета для аргументов вызовов; выбираются до прогона."""
+
+    def __init__(self, path, iterations, seed):
+        self.rng = random.Random(seed)
+        self.n = iterations
+        conn = sqlite3.connect(path)
+        self.counts = {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("phones", "cases", "users", "user_inventory", "market_listings")
+        }
+        max_user = conn.execute("SELECT MAX(id) FROM users").fetchone()[0]
+        self.phone_ids = [row[0] for row in conn.execute("SELECT id FROM phones")]
+        self.case_ids = [row[0] for row in conn.execute("SELECT id FROM cases")]
+        self.user_ids = [self.rng.randint(1, max_user) for _ in range(iterations)]
+        # Игроки с самым большим инвентарём
+        self.whale_ids = [row[0] for row in conn.execute(
+            "SELECT user_id FROM user_inventory GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 10")]
+        self.new_telegram_id = TELEGRAM_ID_OFFSET + max_user + 1
+        # Разные лоты на каждую покупку в обоих слоях
+        listing_ids = [row[0] for row in conn.execute("SELECT id FROM market_listings")]
+        self.listing_ids = self.rng.sample(listing_ids, min(len(listing_ids), 4 * iterations))
+        self.free_items = conn.execute(
+            """SELECT ui.user_id, ui.id FROM user_inventory ui
+               WHERE ui.id IN (%s)
+                 AND NOT EXISTS (SELECT 1 FROM market_listings ml WHERE ml.inventory_item_id = ui.id)"""
+            % ",".join("?" * min(999, 4 * iterations)),
+            [self.rng.randint(1, self.counts["user_inventory"]) for _ in range(min(999, 4 * iterations))],
+        ).fetchall()
+        self.buyer_ids = self.rng.sample(range(1, max_user + 1), min(max_user, iterations))
+        conn.executemany("UPDATE users SET signals = ? WHERE id = ?",
+                         [(RICH_BALANCE, buyer_id) for buyer_id in self.buyer_ids])
+        conn.commit()
+        conn.close()
+
+    def pick(self, values):
+        return self.rng.choice(values)
+
+    def take(self, values, count):
+        taken, values[:] = values[:count], values[count:]
+        return taken
+
+
+def market_cursors(web, pages, **filters):
+    """Курсоры страниц рынка вглубь; формат курсора общий для обоих слоёв."""
+    cursors, cursor = [], None
+    for _ in range(pages):
+        page = web.get_market_listings(cursor=cursor, **filters)
+        if not page["next_cursor"]:
+            break
+        cursor = page["next_cursor"]
+        cursors.append(cursor)
+    return cursors or [None]
+
+
+def read_cases(f, web):
+    """(имя, [вызовы]) для функций чтения, общих для обоих слоёв."""
+    n = f.n
+    deep = market_cursors(web, 50)
+    rarities = ("Common", "Rare", "Epic", "Legendary")
+    return [
+        ("get_catalog", [call()] * n),
+        ("get_market_listings", [call()] * n),
+        ("get_market_listings[phone_id]", [call(phone_id=f.pick(f.phone_ids)) for _ in range(n)]),
+        ("get_market_listings[rarity,price]",
+         [call(rarity=f.pick(rarities), min_price=10, max_price=1000) for _ in range(n)]),
+        ("get_market_listings[page 50]", [call(cursor=deep[-1])] * n),
+        ("get_user_by_telegram_id", [call(TELEGRAM_ID_OFFSET + user_id) for user_id in f.user_ids]),
+        ("get_inventory_summary", [call(user_id) for user_id in f.user_ids]),
+        ("get_inventory_summary[whale]", [call(f.pick(f.whale_ids)) for _ in range(n)]),
+        ("get_inventory_items", [call(user_id) for user_id in f.user_ids]),
+        ("get_inventory_items[whale]", [call(f.pick(f.whale_ids)) for _ in range(n)]),
+        ("get_inventory_items[whale,phone_id]",
+         [call(f.pick(f.whale_ids), phone_id=f.pick(f.phone_ids)) for _ in range(n)]),
+        ("get_case_table", [call(f.pick(f.case_ids)) for _ in range(n)]),
+        ("get_leaderboard", [call()] * n),
+        ("get_player_rank", [call(user_id) for user_id in f.user_ids]),
+        ("get_player_rank[whale]", [call(f.pick(f.whale_ids)) for _ in range(n)]),
+        ("get_rank_snapshot", [call()] * n),
+        ("get_candles", [call(f.pick(f.phone_ids)) for _ in range(n)]),
+        ("get_candles[7d]", [call(f.pick(f.phone_ids), period="7d") for _ in range(n)]),
+        ("get_candles[24h,500]", [call(f.pick(f.phone_ids), period="24h", limit=500) for _ in range(n)]),
+        ("get_trade_stats", [call(f.pick(f.phone_ids)) for _ in range(n)]),
+    ]
+
+
+def write_cases(f):
+    """Пишущие функции, общие для обоих слоёв; лоты и предметы у слоёв не пересекаются."""
+    n = f.n
+    return [
+        ("list_item_on_market",
+         [call(user_id, item_id, 100) for user_id, item_id in f.take(f.free_items, n)]),
+        ("buy_item_from_market",
+         [call(listing_id, f.pick(f.buyer_ids)) for listing_id in f.take(f.listing_ids, n)]),
+        ("buy_cheapest", [call(f.pick(f.buyer_ids), f.pick(f.phone_ids), 3) for _ in range(n)]),
+        ("open_case", [call(f.pick(f.buyer_ids), f.pick(f.case_ids)) for _ in range(n)]),
+        ("open_cases", [call(f.pick(f.buyer_ids), f.pick(f.case_ids), 100) for _ in range(n)]),
+    ]
+
+
+async def measure(func, calls):
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for args, kwargs in calls:
+        call_started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    latencies_ms = [latency * 1000 for latency in latencies]
+    return {
+        "calls": len(calls),
+        "errors": errors,
+        "ops_per_sec": round(len(calls) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies_ms, 0.50), 3),
+        "p95_ms": round(percentile(latencies_ms, 0.95), 3),
+        "p99_ms": round(percentile(latencies_ms, 0.99), 3),
+    }
+
+
+async def run(args, path):
+    os.environ["DATABASE_PATH"] = path
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+    # Модули читают путь к БД из окружения при импорте / создании
+    import database as db
+    from utils.database import GameDatabase
+
+    f = Fixtures(path, args.iterations, args.seed)
+    results, covered = {}, set()
+
+    async def bench(layer, name, func, calls):
+        if not calls:
+            print(f"{layer}.{name}: нет данных для вызовов, пропущено", file=sys.stderr)
+            return
+        covered.add((layer, name.split("[")[0]))
+        stats = await measure(func, calls)
+        results[f"{layer}.{name}"] = stats
+        print(f"{layer}.{name:<38} {stats['ops_per_sec']:>10} ops/s   p50 {stats['p50_ms']:8.3f}   "
+              f"p95 {stats['p95_ms']:8.3f}   p99 {stats['p99_ms']:8.3f} ms"
+              + (f"   errors {stats['errors']}" if stats["errors"] else ""), file=sys.stderr)
+
+    started = time.perf_counter()
+    web = GameDatabase()
+    results["web.GameDatabase()"] = {"calls": 1, "seconds": round(time.perf_counter() - started, 3)}
+    try:
+        await run_web(f, web, bench)
+        await run_bot(f, web, db, bench)
+    finally:
+        # Потоки aiosqlite не дают процессу завершиться, пока пул открыт
+        await db.close_pool()
+        web.close()
+
+    public_bot = {name for name, obj in vars(db).items()
+                  if inspect.isfunction(obj) and obj.__module__ == db.__name__ and not name.startswith("_")}
+    public_web = {name for name, obj in vars(GameDatabase).items()
+                  if inspect.isfunction(obj) and not name.startswith("_")}
+    not_covered = sorted(
+        [f"bot.{name}" for name in public_bot - BOT_INFRASTRUCTURE if ("bot", name) not in covered]
+        + [f"web.{name}" for name in public_web - WEB_INFRASTRUCTURE if ("web", name) not in covered]
+    )
+    return f.counts, results, not_covered
+
+
+async def run_web(f, web, bench):
+    for name, calls in read_cases(f, web):
+        await bench("web", name, getattr(web, name.split("[")[0]), calls)
+    await bench("web", "get_cases", web.get_cases, [call()] * f.n)
+    await bench("web", "warm_order_book", web.warm_order_book, [call()] * 5)
+    for name, calls in write_cases(f):
+        await bench("web", name, getattr(web, name), calls)
+    # Первый вызов подгружает последние события (в том числе только что записанные), дальше — кэш
+    await bench("web", "get_market_feed", web.get_market_feed, [call()])
+    await bench("web", "poll_market_events", web.poll_market_events, [call(web.market_feed)] * f.n)
+
+
+async def run_bot(f, web, db, bench):
+    await bench("bot", "init_db", db.init_db, [call()] * 3)
+    for name, calls in read_cases(f, web):
+        await bench("bot", name, getattr(db, name.split("[")[0]), calls)
+    await bench("bot", "get_phone_names", db.get_phone_names, [call()] * f.n)
+    await bench("bot", "get_listing_by_id", db.get_listing_by_id, [call(i) for i in f.take(f.listing_ids, f.n)])
+    await bench("bot", "warm_order_book", db.warm_order_book, [call()] * 5)
+    await bench("bot", "get_best_ask", db.get_best_ask, [call(f.pick(f.phone_ids)) for _ in range(f.n)])
+    await bench("bot", "get_market_depth", db.get_market_depth, [call(f.pick(f.phone_ids)) for _ in range(f.n)])
+    await bench("bot", "get_market_summary", db.get_market_summary, [call()] * f.n)
+    listed_items = []
+    for name, calls in write_cases(f):
+        await bench("bot", name, getattr(db, name), calls)
+        if name == "list_item_on_market":
+            listed_items = [args[1] for args, _kwargs in calls]
+    # Снимаются лоты, выставленные только что
+    await bench("bot", "remove_item_from_market", db.remove_item_from_market,
+                [call(listing_id) for listing_id in await listing_ids_for(db, listed_items)])
+    # Книга догоняет события, только что записанные вебом и ботом
+    await bench("bot", "poll_order_book", db.poll_order_book, [call()] * f.n)
+    await bench("bot", "create_user_if_not_exists", db.create_user_if_not_exists,
+                [call(f.new_telegram_id + i) for i in range(f.n)])
+    await bench("bot", "give_starting_items", db.give_starting_items,
+                [call({"id": user_id, "telegram_id": TELEGRAM_ID_OFFSET + user_id}) for user_id in f.user_ids])
+    # Меняет каталог, поэтому последней
+    await bench("bot", "populate_initial_data", db.populate_initial_data, [call()] * 3)
+
+
+async def listing_ids_for(db, item_ids):
+    if not item_ids:
+        return []
+    pool = await db.get_pool()
+    async with pool.read() as conn:
+        rows = await conn.execute_fetchall(
+            f"SELECT id FROM market_listings WHERE inventory_item_id IN ({','.join('?' * len(item_ids))})",
+            item_ids,
+        )
+    return [row[0] for row in rows]
+
+
+def compare(current, baseline):
+    print(f"\nСравнение с {baseline.get('commit')}: ops/s и p99 (было -> стало)")
+    for name, stats in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old or "ops_per_sec" not in stats or not old.get("ops_per_sec"):
+            continue
+        ratio = stats["ops_per_sec"] / old["ops_per_sec"]
+        flag = "  <-- медленнее" if ratio < 0.9 else ""
+        print(f"{name:<45} {old['ops_per_sec']:>10} -> {stats['ops_per_sec']:>10} ({ratio:5.2f}x)   "
+              f"p99 {old['p99_ms']:8.3f} -> {stats['p99_ms']:8.3f} ms{flag}")
+
+
+def main(args):
+    logging.basicConfig(level=logging.WARNING)
+    if args.in_place:
+        path = args.dataset
+    else:
+        path = os.path.join(tempfile.mkdtemp(), os.path.basename(args.dataset))
+        shutil.copyfile(args.dataset, path)
+    size_before = db_size(path)
+    counts, results, not_covered = asyncio.run(run(args, path))
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "iterations": args.iterations,
+        "seed": args.seed,
+        "dataset": {"path": args.dataset, "rows": counts},
+        "db_size_bytes": {"before": size_before, "after": db_size(path)},
+        "results": results,
+        "not_covered": not_covered,
+    }
+    if not args.in_place:
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    if not_covered:
+        print(f"Не покрыты: {', '.join(not_covered)}", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            json.dump(report, out, indent=2, ensure_ascii=False)
+    else:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", required=True, help="БД из generate_dataset.py")
+    parser.add_argument("--iterations", type=int, default=200, help="вызовов на функцию")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--in-place", action="store_true", help="мерить прямо на датасете, без копии")
+    main(parser.parse_args())
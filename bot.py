@@ -1,17 +1,25 @@
 # bot.py
 import asyncio
 import logging
+import secrets
+import signal
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-import nest_asyncio # Если используете jupyter
-from config import TELEGRAM_BOT_TOKEN, MINI_APP_URL # Импортируем URL
+from config import (
+    TELEGRAM_BOT_TOKEN, MINI_APP_URL, MAX_CONCURRENT_UPDATES, TELEGRAM_API_BASE_URL,
+    WEBHOOK_LISTEN, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL,
+)
 import database as db
-
-# nest_asyncio.apply() # Раскомментируйте, если нужно
+from utils import metrics
+from webhook import ALLOWED_UPDATES, PerUserUpdateProcessor, WebhookServer
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Сколько моделей показывать в сводках рынка и инвентаря
+MARKET_SUMMARY_LIMIT = 15
+INVENTORY_SUMMARY_LIMIT = 15
+
 # --- Обработчики команд ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -38,10 +46,21 @@ async def inventory(update: Update, context: ContextTypes.DEFAULT_TYPE):
             text="Сначала зарегистрируйтесь с помощью /start, чтобы увидеть инвентарь."
         )
         return
-    # TODO: Получить список телефонов из инвентаря пользователя
-    # Пока просто сообщение
+    # Сводка по моделям: одна строка на модель, а не на каждый экземпляр
+    summary = await db.get_inventory_summary(user_info['id'])
+    lines = []
+    for model in summary['models'][:INVENTORY_SUMMARY_LIMIT]:
+        name = model['name'] or f"Телефон #{model['phone_id']}"
+        lines.append(f"{name} ×{model['count']} — {model['total_value']} сигналов")
+    hidden = len(summary['models']) - len(lines)
+    if hidden > 0:
+        lines.append(f"...и ещё моделей: {hidden}")
+    phones = "\n".join(lines) if lines else "Телефонов пока нет — откройте кейс!"
     await query.edit_message_text(
-        text=f"Ваш инвентарь:\nСигналов: {user_info['signals']}\n\n(Здесь будут ваши телефоны)"
+        text=(
+            f"Ваш инвентарь:\nСигналов: {user_info['signals']}\n"
+            f"Телефонов: {summary['total_count']} на {summary['total_value']} сигналов\n\n{phones}"
+        )
     )
 
 async def shop_cases(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -53,27 +72,110 @@ async def shop_cases(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def market(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    # TODO: Отправить список товаров на рынке
-    await query.edit_message_text(text="Рынок телефонов.\n\n(Здесь будет торговля)")
+    # Лучшие цены берутся из книги заявок в памяти, без запросов к рынку в БД
+    summary = db.get_market_summary()
+    if not summary:
+        await query.edit_message_text(text="Рынок телефонов.\n\nСейчас на продаже ничего нет.")
+        return
+    names = await db.get_phone_names()
+    lines = [
+        f"{names.get(phone_id, f'Телефон #{phone_id}')} — от {best_price} сигналов ({count} шт.)"
+        for phone_id, best_price, count in summary[:MARKET_SUMMARY_LIMIT]
+    ]
+    await query.edit_message_text(text="Рынок телефонов:\n\n" + "\n".join(lines))
+
+async def top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/top — самые богатые игроки и место самого игрока."""
+    players = await db.get_leaderboard()
+    lines = [f"{player['rank']}. Игрок {player['telegram_id']} — {player['net_worth']} сигналов"
+             for player in players]
+    text = "Рейтинг по состоянию (сигналы + телефоны):\n\n" + ("\n".join(lines) or "Игроков пока нет.")
+    user_info = await db.get_user_by_telegram_id(update.effective_user.id)
+    if user_info:
+        rank = await db.get_player_rank(user_info['id'])
+        place = rank['rank'] if rank['exact'] else f"~{rank['rank']}"
+        text += f"\n\nВаше место: {place} из {rank['total_players']} ({rank['net_worth']} сигналов)"
+    await update.message.reply_text(text)
+
+# --- Жизненный цикл БД ---
+async def on_startup(application: Application):
+    # Пул открывается в цикле событий бота и живёт до его остановки
+    await db.init_db()
+    # Заполняем начальные данные (в реальной системе это делается отдельно)
+    await db.populate_initial_data()
+    await db.warm_order_book()
+
+async def on_shutdown(application: Application):
+    await db.close_pool()
 
 # --- Запуск бота ---
-def main():
-    # Применяем nest_asyncio, чтобы избежать ошибки RuntimeError
-    nest_asyncio.apply()
-    
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+def build_application(webhook=False, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        # Разные пользователи обслуживаются параллельно, апдейты одного — по порядку
+        .concurrent_updates(PerUserUpdateProcessor(max_concurrent_updates))
+        # По соединению к Bot API на апдейт в работе: пул httpx перебирает все
+        # соединения и ожидающие запросы, так что лишние только тратят процессор
+        .connection_pool_size(max_concurrent_updates)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(TELEGRAM_API_BASE_URL)
+    if webhook:
+        # Апдейты приходят через WebhookServer, Updater с polling не нужен
+        builder = builder.updater(None)
+    application = builder.build()
+
+    timed = metrics.instrument_handler
+    application.add_handler(CommandHandler('start', timed(start)))
+    application.add_handler(CommandHandler('top', timed(top)))
+    application.add_handler(CallbackQueryHandler(timed(inventory), pattern='^inventory$'))
+    application.add_handler(CallbackQueryHandler(timed(shop_cases), pattern='^shop_cases$'))
+    application.add_handler(CallbackQueryHandler(timed(market), pattern='^market$'))
+    return application
 
-    application.add_handler(CommandHandler('start', start))
-    application.add_handler(CallbackQueryHandler(inventory, pattern='^inventory$'))
-    application.add_handler(CallbackQueryHandler(shop_cases, pattern='^shop_cases$'))
-    application.add_handler(CallbackQueryHandler(market, pattern='^market$'))
+async def run_webhook(stop_event=None, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+    """Режим вебхука: один цикл событий владеет и БД, и HTTP-сервером, и обработкой апдейтов."""
+    application = build_application(webhook=True, max_concurrent_updates=max_concurrent_updates)
+    # Без секрета апдейт мог бы прислать кто угодно: если WEBHOOK_SECRET не задан,
+    # он генерируется на запуск и тут же передаётся Telegram в set_webhook
+    secret_token = WEBHOOK_SECRET
+    if not secret_token:
+        secret_token = secrets.token_urlsafe(32)
+        logger.info("WEBHOOK_SECRET не задан: сгенерирован секрет на время работы процесса")
+    server = WebhookServer(application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, secret_token)
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
 
-    logger.info("Бот запущен...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    async with application:
+        await on_startup(application)
+        await application.start()
+        await server.start()
+        try:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL,
+                allowed_updates=ALLOWED_UPDATES,
+                secret_token=secret_token,
+            )
+            logger.info("Бот запущен (вебхук %s)...", WEBHOOK_URL)
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            await application.stop()
+            await on_shutdown(application)
+
+def main():
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook())
+        return
+    application = build_application()
+    logger.info("Бот запущен (long polling)...")
+    application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == '__main__':
-    # Инициализируем БД
-    asyncio.run(db.init_db())
-    # Заполняем начальные данные (в реальной системе это делается отдельно)
-    asyncio.run(db.populate_initial_data())
-    main()
\ No newline at end of file
+    main()
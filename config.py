@@ -10,6 +10,37 @@ if not TELEGRAM_BOT_TOKEN:
 
 # Путь к базе данных (можно переопределить через .env)
 DATABASE_PATH = os.getenv("DATABASE_PATH", "game_database.db")
+# Количество соединений-читателей в пуле (писатель всегда один)
+DB_POOL_READERS = int(os.getenv("DB_POOL_READERS", "4"))
+# Шардирование игроков: users и user_inventory делятся по telegram_id на DB_SHARDS файлов
+# рядом с DATABASE_PATH (game_database.shard0.db, ...), каталог и рынок остаются в DATABASE_PATH.
+# 1 — без шардов. Число шардов записывается в БД при первом запуске и потом не меняется.
+# Веб-API и mini-app с шардами не работают, поэтому DB_SHARDS > 1 требует DB_SHARDS_BOT_ONLY=1.
+# Выигрыш — только от нескольких процессов бота на нескольких ядрах: на одном ядре шарды
+# медленнее одного файла (benchmarks/bench_shards.py, см. utils/shards.py)
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))
+DB_SHARDS_BOT_ONLY = os.getenv("DB_SHARDS_BOT_ONLY", "") == "1"
+# Сколько пользователей держать в LRU-кэше (0 — отключить кэш)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+# Групповой коммит мелких записей: до WRITE_BATCH_SIZE операций в транзакции.
+# Пачка — всё, что накопилось за время предыдущего коммита; WRITE_BATCH_DELAY_MS > 0
+# дополнительно ждёт попутчиков. Очередь ограничена WRITE_QUEUE_SIZE
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "64"))
+WRITE_BATCH_DELAY_MS = float(os.getenv("WRITE_BATCH_DELAY_MS", "0"))
+WRITE_QUEUE_SIZE = int(os.getenv("WRITE_QUEUE_SIZE", "1024"))
+
+# Вебхук: если WEBHOOK_URL задан, бот принимает апдейты по HTTP вместо long polling.
+# WEBHOOK_URL — внешний адрес (за reverse proxy с TLS), сервер слушает WEBHOOK_LISTEN:WEBHOOK_PORT
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Секрет заголовка X-Telegram-Bot-Api-Secret-Token; пустой — генерируется при каждом запуске
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Сколько апдейтов обрабатывать одновременно (апдейты одного пользователя — всегда по очереди)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "16"))
+# Адрес Bot API; переопределяется для локального Bot API сервера или прогона без сети
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "")
 
 # Путь к папке со статическими файлами для Mini App
 STATIC_FOLDER_PATH = "static"
@@ -1,293 +1,1052 @@
 # database.py
-import aiosqlite
+import asyncio
 import logging
-from config import DATABASE_PATH
+import os
+import sqlite3
+import time
+from config import (
+    DATABASE_PATH, DB_POOL_READERS, DB_SHARDS, DB_SHARDS_BOT_ONLY, USER_CACHE_SIZE, WRITE_BATCH_DELAY_MS, WRITE_BATCH_SIZE,
+    WRITE_QUEUE_SIZE,
+)
+from db_pool import ConnectionPool
+from utils import catalog_import, metrics
+from write_batcher import WriteBatcher
+from utils.schema import (
+    CREATE_TABLES_SQL, CREATE_INDEXES_SQL, CREATE_TRIGGERS_SQL, ADDED_COLUMNS, ADDED_UNIQUE_INDEXES,
+    INVENTORY_VALUE_BACKFILL_SQL, PRAGMAS,
+)
+from utils.catalog import (
+    CATALOG_CASE_CONTENTS_SQL, CATALOG_CASES_SQL, CATALOG_PHONES_SQL, CATALOG_VERSION_SQL,
+    CatalogCache, build_snapshot,
+)
+from utils.users import (
+    GRANT_STARTING_ITEMS_SQL, STARTER_PHONE_NAME, STARTING_SIGNALS, UPSERT_USER_SQL, USER_BY_TELEGRAM_ID_SQL,
+    UserCache,
+)
+from utils.inventory import (
+    INVENTORY_PAGE_SIZE, INVENTORY_SUMMARY_SQL, build_inventory_items_query, paginate_inventory_rows,
+    summarize_inventory,
+)
+from utils.case_engine import DEBIT_CASE_PRICE_SQL, MAX_BULK_OPEN, CaseEngine, prize_phone_ids, summarize_draws
+from utils.order_book import ORDER_BOOK_EVENTS_SQL, ORDER_BOOK_SQL, OrderBook
+from utils.market_feed import FEED_BATCH_SIZE, FEED_POLL_SECONDS, LAST_MARKET_EVENT_SQL
+from utils.leaderboard import (
+    LEADERBOARD_SIZE, MAX_LEADERBOARD_SIZE, NET_WORTH_DISTRIBUTION_SQL, PLAYER_NET_WORTH_SQL, PLAYERS_ABOVE_SQL,
+    TOP_PLAYERS_SQL, RankCache, build_rank_snapshot, player_rank, rank_top_players,
+)
+from utils.market import (
+    CLAIM_LISTING_SQL, CREDIT_SELLER_SQL, DEBIT_BUYER_SQL, DELETE_LISTING_SQL, INSERT_LISTING_SQL,
+    LISTING_SELLER_SQL, MARKET_PAGE_SIZE, RECORD_MARKET_EVENT_SQL, RECORD_TRADE_SQL, TRANSFER_ITEM_SQL,
+    USER_EXISTS_SQL, ListingResult, ListingStatus, MarketEvent, PurchaseResult, PurchaseStatus,
+    build_market_listings_query, claim_failure_status, debit_failure_status, listing_added_event, paginate_market_rows,
+)
+from utils.shards import (
+    APPLIED_SIDE_SQL, BUYER, CLAIM_VALUES_VERSION_SQL, CLOSE_PENDING_TRADE_SQL, DELETE_SOLD_ITEM_SQL,
+    INSERT_BOUGHT_ITEM_SQL, INSERT_PENDING_TRADE_SQL, INSERT_SHARDED_LISTING_SQL, MARK_APPLIED_SQL, MAX_SHARDS,
+    OWNED_ITEM_SQL, PENDING_TRADES_FLOOR_SQL, PENDING_TRADES_RECOVERY_SECONDS, PRUNE_APPLIED_SQL,
+    RECORD_SHARD_COUNT_SQL, RESTORE_LISTING_SQL, SELLER, SELLER_TELEGRAM_IDS_SQL, SHARD_COUNT_SQL,
+    SHARDED_PRAGMAS, SHARED_INDEXES_SQL, SHARED_PLAYERS_EXIST_SQL, SHARED_SCHEMA, STALE_PENDING_TRADES_SQL,
+    bought_phone_ids, check_shard_count, merge_net_worth_distributions, merge_top_players,
+    shard_for_telegram_id, shard_of, shard_paths, shard_writer_sql,
+)
+from utils.trades import (
+    CANDLES_LIMIT, HOURLY_CANDLES_SINCE_SQL, PHONE_TRADE_STATS_SQL, build_candles_query, candles_payload,
+    stats_since, summarize_trade_stats,
+)
 
 logger = logging.getLogger(__name__)
 
-CREATE_TABLES_SQL = """
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY,
-    telegram_id INTEGER UNIQUE NOT NULL,
-    signals INTEGER DEFAULT 0,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-);
-
--- Таблица с телефонами (их типами, не экземплярами)
-CREATE TABLE IF NOT EXISTS phones (
-    id INTEGER PRIMARY KEY,
-    name TEXT UNIQUE NOT NULL,
-    brand TEXT NOT NULL, -- 'Apple', 'Samsung', 'Google' etc.
-    model_code TEXT, -- 'iPhone15,2', 'SM-S928B' etc.
-    rarity TEXT DEFAULT 'Common', -- 'Common', 'Rare', 'Epic', 'Legendary'
-    value INTEGER DEFAULT 10, -- Базовая стоимость в сигналах
-    image_filename TEXT -- Имя файла изображения в static/images/phones/
-);
-
--- Таблица с кейсами
-CREATE TABLE IF NOT EXISTS cases (
-    id INTEGER PRIMARY KEY,
-    name TEXT UNIQUE NOT NULL,
-    price_signals INTEGER DEFAULT 10
-);
-
--- Таблица с содержимым кейсов (телефон -> шанс)
-CREATE TABLE IF NOT EXISTS case_contents (
-    id INTEGER PRIMARY KEY,
-    case_id INTEGER,
-    phone_id INTEGER,
-    chance REAL, -- Например, 0.5 для 50%
-    FOREIGN KEY (case_id) REFERENCES cases (id),
-    FOREIGN KEY (phone_id) REFERENCES phones (id)
-);
-
--- Инвентарь пользователя (его телефоны)
-CREATE TABLE IF NOT EXISTS user_inventory (
-    id INTEGER PRIMARY KEY,
-    user_id INTEGER,
-    phone_id INTEGER,
-    acquired_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users (id),
-    FOREIGN KEY (phone_id) REFERENCES phones (id)
-);
-
--- Таблица с товарами на рынке
-CREATE TABLE IF NOT EXISTS market_listings (
-    id INTEGER PRIMARY KEY,
-    seller_user_id INTEGER,
-    inventory_item_id INTEGER UNIQUE,
-    price_signals INTEGER,
-    listed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (seller_user_id) REFERENCES users (id),
-    FOREIGN KEY (inventory_item_id) REFERENCES user_inventory (id)
-);
-"""
+# --- Пул соединений ---
+# С DB_SHARDS > 1 игроки живут в файлах шардов (utils/shards.py), у каждого свой пул;
+# в общем файле остаются каталог и рынок. shard=None везде означает общий файл
+if not 1 <= DB_SHARDS <= MAX_SHARDS:
+    raise ValueError(f"DB_SHARDS должно быть от 1 до {MAX_SHARDS}")
+if DB_SHARDS > 1 and not DB_SHARDS_BOT_ONLY:
+    raise ValueError("DB_SHARDS > 1 отключает веб-API и mini-app; включается только с DB_SHARDS_BOT_ONLY=1")
+SHARDED = DB_SHARDS > 1
+
+_pool = None
+_pool_opening = None
+_shard_pools = {}
+_shard_opening = {}
+
+async def get_pool():
+    """Возвращает общий пул соединений, открывая его при первом обращении."""
+    global _pool, _pool_opening
+    if _pool is None:
+        if _pool_opening is None:
+            _pool_opening = asyncio.ensure_future(
+                ConnectionPool(
+                    DATABASE_PATH, readers=DB_POOL_READERS, pragmas=SHARDED_PRAGMAS if SHARDED else PRAGMAS,
+                ).open()
+            )
+        try:
+            _pool = await asyncio.shield(_pool_opening)
+        finally:
+            _pool_opening = None
+    return _pool
+
+async def get_shard_pool(shard):
+    """Пул файла шарда (схему создаёт писатель при подключении); без шардов — общий пул."""
+    if shard is None or not SHARDED:
+        return await get_pool()
+    pool = _shard_pools.get(shard)
+    if pool is None:
+        opening = _shard_opening.get(shard)
+        if opening is None:
+            opening = _shard_opening[shard] = asyncio.ensure_future(ConnectionPool(
+                shard_paths(DATABASE_PATH, DB_SHARDS)[shard],
+                readers=DB_POOL_READERS,
+                name=f"bot-shard{shard}",
+                pragmas=SHARDED_PRAGMAS,
+                attach=[(SHARED_SCHEMA, DATABASE_PATH)],
+                writer_sql=shard_writer_sql(shard),
+                begin="BEGIN",
+            ).open())
+        try:
+            pool = _shard_pools[shard] = await asyncio.shield(opening)
+        finally:
+            _shard_opening.pop(shard, None)
+    return pool
+
+def _telegram_shard(telegram_id):
+    return shard_for_telegram_id(telegram_id, DB_SHARDS) if SHARDED else None
+
+def _player_shard(user_id):
+    return shard_of(user_id) if SHARDED else None
+
+async def close_pool():
+    global _pool, _writes, _order_book_sync, _shard_maintenance
+    # Фоновые задачи ходят в пулы, поэтому останавливаются первыми
+    tasks = [task for task in (_order_book_sync, _shard_maintenance) if task is not None]
+    _order_book_sync = _shard_maintenance = None
+    for task in tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    # Сначала дописываем очереди: после закрытия пулов записать их будет некуда
+    batchers = list(_shard_writes.values())
+    if _writes is not None:
+        batchers.insert(0, _writes)
+    _writes = None
+    _shard_writes.clear()
+    for writes in batchers:
+        await writes.close()
+    pools = list(_shard_pools.values())
+    _shard_pools.clear()
+    if _pool is not None:
+        pools.append(_pool)
+        _pool = None
+    for pool in pools:
+        await pool.close()
+
+# --- Групповой коммит ---
+# Мелкие частые записи (выставление и снятие лотов, стартовые наборы) идут через
+# общую очередь и коммитятся пачками; покупки и кейсы открывают свои транзакции.
+# У каждого шарда своя очередь: пачка пишет в один файл
+_writes = None
+_shard_writes = {}
+
+def _start_batcher(pool):
+    return WriteBatcher(
+        pool,
+        max_batch=WRITE_BATCH_SIZE,
+        max_delay=WRITE_BATCH_DELAY_MS / 1000,
+        max_pending=WRITE_QUEUE_SIZE,
+    ).start()
+
+async def get_write_batcher(shard=None):
+    global _writes
+    if shard is None or not SHARDED:
+        if _writes is None:
+            pool = await get_pool()
+            if _writes is None:
+                _writes = _start_batcher(pool)
+        return _writes
+    writes = _shard_writes.get(shard)
+    if writes is None:
+        pool = await get_shard_pool(shard)
+        writes = _shard_writes.get(shard)
+        if writes is None:
+            writes = _shard_writes[shard] = _start_batcher(pool)
+    return writes
+
+async def submit_write(op, shard=None):
+    """Выполняет op(db) в очередной пачке записей файла shard и возвращает результат после COMMIT."""
+    writes = await get_write_batcher(shard)
+    return await writes.submit(op)
 
 async def init_db():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    global _shard_maintenance
+    pool = await get_pool()
+    async with pool.write() as db:
         await db.executescript(CREATE_TABLES_SQL)
-        await db.commit()
-        logger.info(f"База данных {DATABASE_PATH} инициализирована.")
+        for table, column, declaration, backfill_sql in ADDED_COLUMNS:
+            columns = {row[1] for row in await db.execute_fetchall(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+                await db.execute(backfill_sql)
+                logger.info("Добавлена колонка %s.%s", table, column)
+        for index, dedupe_sql in ADDED_UNIQUE_INDEXES:
+            async with db.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index,)) as cursor:
+                exists = await cursor.fetchone()
+            if not exists:
+                removed = (await db.execute(dedupe_sql)).rowcount
+                logger.info("Перед созданием %s удалено дубликатов: %s", index, removed)
+        await db.executescript(CREATE_INDEXES_SQL)
+        await db.executescript(CREATE_TRIGGERS_SQL)
+        if SHARDED:
+            await db.executescript(SHARED_INDEXES_SQL)
+    # Число шардов сверяется и записывается одной транзакцией: бот и веб-API могут стартовать вместе
+    async with pool.transaction() as db:
+        async with db.execute(SHARD_COUNT_SQL) as cursor:
+            stored = await cursor.fetchone()
+        async with db.execute(SHARED_PLAYERS_EXIST_SQL) as cursor:
+            shared_players = (await cursor.fetchone())[0]
+        check_shard_count(stored[0] if stored else None, DB_SHARDS, shared_players)
+        await db.execute(RECORD_SHARD_COUNT_SQL, (DB_SHARDS,))
+    if SHARDED:
+        if (os.cpu_count() or 1) < 2:
+            logger.warning("DB_SHARDS=%s на одном ядре медленнее одного файла (см. utils/shards.py)", DB_SHARDS)
+        for shard in range(DB_SHARDS):
+            await get_shard_pool(shard)
+        await _maintain_shards()
+        if _shard_maintenance is None:
+            _shard_maintenance = metrics.background_task(_maintain_shards_periodically())
+        logger.info(f"Файлы шардов игроков: {', '.join(shard_paths(DATABASE_PATH, DB_SHARDS))}")
+    logger.info(f"База данных {DATABASE_PATH} инициализирована.")
+
+# --- Каталог ---
+_catalog = CatalogCache()
+
+async def get_catalog():
+    """Снимок каталога (телефоны, кейсы, содержимое кейсов).
+
+    Версия сверяется с БД не чаще раза в CATALOG_REFRESH_SECONDS; снимок
+    перечитывается целиком, только если версия изменилась.
+    """
+    if not _catalog.needs_check():
+        return _catalog.snapshot
+    pool = await get_pool()
+    async with pool.read() as db:
+        # Одна читающая транзакция: версия и таблицы каталога согласованы
+        await db.execute("BEGIN")
+        try:
+            version = (await db.execute_fetchall(CATALOG_VERSION_SQL))[0][0]
+            if _catalog.is_current(version):
+                return _catalog.snapshot
+            snapshot = build_snapshot(
+                version,
+                await db.execute_fetchall(CATALOG_PHONES_SQL),
+                await db.execute_fetchall(CATALOG_CASES_SQL),
+                await db.execute_fetchall(CATALOG_CASE_CONTENTS_SQL),
+            )
+        finally:
+            await db.execute("COMMIT")
+    logger.info("Каталог загружен, версия %s", version)
+    return _catalog.install(snapshot)
+
+def invalidate_catalog():
+    """Сверить версию каталога при следующем обращении; вызывать после записей в каталог."""
+    _catalog.invalidate()
+
+# --- Пользователи ---
+# Строки users по telegram_id: /start и кнопки не ходят в БД за уже известным игроком
+_users = UserCache(USER_CACHE_SIZE)
+
+def invalidate_users(*user_ids):
+    """Сбрасывает кэш пользователей (users.id); вызывать после изменения signals."""
+    _users.invalidate(*user_ids)
 
-# --- Примеры функций ---
 async def get_user_by_telegram_id(telegram_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
-        row = await cursor.fetchone()
-        if row:
-            return dict(zip([d[0] for d in cursor.description], row))
+    user = _users.get(telegram_id)
+    if user is not None:
+        return user
+    generation = _users.generation()
+    pool = await get_shard_pool(_telegram_shard(telegram_id))
+    async with pool.read() as db:
+        async with db.execute(USER_BY_TELEGRAM_ID_SQL, (telegram_id,)) as cursor:
+            row = await cursor.fetchone()
+    if not row:
         return None
+    user = dict(row)
+    _users.put(user, generation)
+    return user
+
+async def _get_starter_phone_id():
+    # Берётся из снимка каталога: без запроса к phones на каждого нового игрока
+    catalog = await get_catalog()
+    phone_id = catalog.phone_ids_by_name.get(STARTER_PHONE_NAME)
+    if phone_id is None:
+        logger.warning("Стартовый телефон %s не найден", STARTER_PHONE_NAME)
+    return phone_id
+
+async def _give_starting_phone(db, user_id, phone_id):
+    if phone_id is not None:
+        await db.execute(
+            "INSERT INTO user_inventory (user_id, phone_id) VALUES (?, ?)",
+            (user_id, phone_id)
+        )
+
+async def _insert_user(db, telegram_id, starter_phone_id):
+    async with db.execute(UPSERT_USER_SQL, (telegram_id, STARTING_SIGNALS, starter_phone_id)) as cursor:
+        row = await cursor.fetchone()
+    if row:
+        await _give_starting_phone(db, row['id'], starter_phone_id)
+    else:
+        # Пользователя успел создать параллельный запрос
+        async with db.execute(USER_BY_TELEGRAM_ID_SQL, (telegram_id,)) as cursor:
+            row = await cursor.fetchone()
+    return dict(row)
 
 async def create_user_if_not_exists(telegram_id):
+    """Возвращает пользователя, при первом обращении создавая его.
+
+    Новый игрок создаётся вместе со стартовым балансом и телефоном одной
+    операцией группового коммита; ON CONFLICT DO NOTHING разрешает гонку
+    двух /start подряд.
+    """
     existing_user = await get_user_by_telegram_id(telegram_id)
     if existing_user:
         return existing_user
 
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
-            await db.execute(
-                "INSERT INTO users (telegram_id) VALUES (?)",
-                (telegram_id,)
-            )
-            await db.commit()
-        except Exception:
-            logger.exception("Не удалось создать пользователя %s", telegram_id)
-            return None
-
-    user = await get_user_by_telegram_id(telegram_id)
-    if not user:
-        logger.error("Пользователь %s не появился в БД после вставки", telegram_id)
+    starter_phone_id = await _get_starter_phone_id()
+    generation = _users.generation()
+    try:
+        user = await submit_write(
+            lambda db: _insert_user(db, telegram_id, starter_phone_id), shard=_telegram_shard(telegram_id)
+        )
+    except Exception:
+        logger.exception("Не удалось создать пользователя %s", telegram_id)
         return None
 
-    logger.info("Новый пользователь создан: %s", telegram_id)
-    await give_starting_items(user)
+    _users.put(user, generation)
+    logger.info("Пользователь %s готов (id %s)", telegram_id, user['id'])
     return user
 
+async def _grant_starting_items(db, user_id, phone_id):
+    await _give_starting_phone(db, user_id, phone_id)
+    await db.execute(GRANT_STARTING_ITEMS_SQL, (STARTING_SIGNALS, phone_id, user_id))
+
 async def give_starting_items(user):
+    """Выдаёт стартовый набор существующему пользователю (новые получают его при создании)."""
     if not user:
         logger.warning("Нельзя выдать стартовые предметы: пользователь не найден")
         return
 
-    phone_name = "Samsung Galaxy A01"
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
-            cursor = await db.execute("SELECT id FROM phones WHERE name = ?", (phone_name,))
-            phone_row = await cursor.fetchone()
-            if not phone_row:
-                logger.warning("Стартовый телефон %s не найден", phone_name)
-                return
-
-            phone_id = phone_row[0]
-            await db.execute(
-                "INSERT INTO user_inventory (user_id, phone_id) VALUES (?, ?)",
-                (user['id'], phone_id)
-            )
-            await db.execute(
-                "UPDATE users SET signals = signals + 50 WHERE telegram_id = ?",
-                (user['telegram_id'],)
-            )
-            await db.commit()
-            logger.info("Стартовые предметы выданы пользователю %s", user['telegram_id'])
-        except Exception:
-            logger.exception("Не удалось выдать стартовые предметы пользователю %s", user['telegram_id'])
+    starter_phone_id = await _get_starter_phone_id()
+    generation = _users.generation()
+    try:
+        await submit_write(
+            lambda db: _grant_starting_items(db, user['id'], starter_phone_id), shard=_player_shard(user['id'])
+        )
+        invalidate_users(user['id'])
+        logger.info("Стартовые предметы выданы пользователю %s", user['telegram_id'])
+    except Exception:
+        logger.exception("Не удалось выдать стартовые предметы пользователю %s", user['telegram_id'])
 
 # --- Функции для рынка ---
-async def get_market_listings():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("""
-            SELECT
-                ml.id,
-                ml.price_signals,
-                p.name,
-                p.rarity,
-                p.image_filename,
-                u.telegram_id as seller_id,
-                u_profile.first_name as seller_name
-            FROM market_listings ml
-            JOIN users u ON ml.seller_user_id = u.id
-            JOIN user_inventory ui ON ml.inventory_item_id = ui.id
-            JOIN phones p ON ui.phone_id = p.id
-            LEFT JOIN users u_profile ON u.telegram_id = u_profile.telegram_id
-            ORDER BY ml.listed_at DESC
-        """)
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows] if rows else []
+async def get_market_listings(limit=MARKET_PAGE_SIZE, cursor=None, rarity=None, brand=None,
+                              phone_id=None, min_price=None, max_price=None,
+                              seller_id=None, exclude_seller_id=None):
+    """Страница рынка: {"items": [...], "next_cursor": str | None}.
+
+    seller_id / exclude_seller_id — это users.id (не telegram_id).
+    """
+    sql, params, limit = build_market_listings_query(
+        limit=limit, cursor=cursor, rarity=rarity, brand=brand, phone_id=phone_id,
+        min_price=min_price, max_price=max_price,
+        seller_id=seller_id, exclude_seller_id=exclude_seller_id, join_sellers=not SHARDED,
+    )
+    catalog = await get_catalog()
+    pool = await get_pool()
+    async with pool.read() as db:
+        rows = await db.execute_fetchall(sql, params)
+    if SHARDED:
+        rows = await _with_seller_telegram_ids(rows)
+    return paginate_market_rows(rows, limit, catalog)
+
+async def _with_seller_telegram_ids(rows):
+    """seller_id строк рынка: users.id -> telegram_id из шардов продавцов."""
+    sellers = {}
+    for row in rows:
+        sellers.setdefault(shard_of(row['seller_id']), set()).add(row['seller_id'])
+    telegram_ids = {}
+    for shard, user_ids in sellers.items():
+        pool = await get_shard_pool(shard)
+        async with pool.read() as db:
+            found = await db.execute_fetchall(
+                SELLER_TELEGRAM_IDS_SQL.format(", ".join("?" * len(user_ids))), tuple(user_ids)
+            )
+        telegram_ids.update((user_id, telegram_id) for user_id, telegram_id in found)
+    return [{**dict(row), "seller_id": telegram_ids.get(row['seller_id'])} for row in rows]
+
+async def _insert_listing(db, user_id, inventory_item_id, price, phone_id=None):
+    # phone_id копируется в лот, чтобы рынок фильтровался без JOIN по инвентарю.
+    # Чужой предмет не выставится; повторное выставление отсечёт UNIQUE(inventory_item_id)
+    if phone_id is None:
+        sql, params = INSERT_LISTING_SQL, (user_id, price, inventory_item_id, user_id)
+    else:
+        # Шарды: владение проверено в файле шарда, здесь — что предмет не продан
+        sql, params = INSERT_SHARDED_LISTING_SQL, (user_id, inventory_item_id, phone_id, price)
+    try:
+        async with db.execute(sql, params) as cursor:
+            listing = await cursor.fetchone()
+    except sqlite3.IntegrityError:
+        # Откатывается только этот INSERT: транзакция пачки остаётся рабочей
+        return ListingStatus.ALREADY_LISTED, None
+    if not listing:
+        return ListingStatus.NOT_FOUND, None
+    await db.execute(RECORD_MARKET_EVENT_SQL, listing_added_event(listing, user_id, price))
+    return ListingStatus.OK, listing
 
 async def list_item_on_market(user_id, inventory_item_id, price):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # TODO: Проверить, что предмет принадлежит пользователю и не выставлен на продажу
-        cursor = await db.execute(
-            "INSERT INTO market_listings (seller_user_id, inventory_item_id, price_signals) VALUES (?, ?, ?)",
-            (user_id, inventory_item_id, price)
-        )
-        await db.commit()
-        return cursor.lastrowid
+    """Выставляет предмет на рынок: ListingResult со статусом и id лота."""
+    phone_id = None
+    if SHARDED:
+        pool = await get_shard_pool(_player_shard(user_id))
+        async with pool.read() as db:
+            async with db.execute(OWNED_ITEM_SQL, (inventory_item_id, user_id)) as cursor:
+                item = await cursor.fetchone()
+        if not item:
+            return ListingResult(ListingStatus.NOT_FOUND)
+        phone_id = item['phone_id']
+    status, listing = await submit_write(
+        lambda db: _insert_listing(db, user_id, inventory_item_id, price, phone_id))
+    if not listing:
+        return ListingResult(status)
+    _order_book.add(listing['id'], listing['phone_id'], price, listing['listed_at'], user_id)
+    return ListingResult(status, listing['id'])
+
+async def _delete_listing(db, listing_id):
+    async with db.execute(DELETE_LISTING_SQL, (listing_id,)) as cursor:
+        listing = await cursor.fetchone()
+    if listing:
+        await db.execute(RECORD_MARKET_EVENT_SQL, (
+            MarketEvent.REMOVED.value, listing_id, listing['phone_id'], listing['price_signals'],
+            listing['seller_user_id'], None,
+        ))
 
 async def remove_item_from_market(listing_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("DELETE FROM market_listings WHERE id = ?", (listing_id,))
-        await db.commit()
-        
+    await submit_write(lambda db: _delete_listing(db, listing_id))
+    _order_book.remove(listing_id)
+
 async def get_listing_by_id(listing_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT * FROM market_listings WHERE id = ?", (listing_id,))
-        row = await cursor.fetchone()
+    pool = await get_pool()
+    async with pool.read() as db:
+        async with db.execute("SELECT * FROM market_listings WHERE id = ?", (listing_id,)) as cursor:
+            row = await cursor.fetchone()
         return dict(row) if row else None
 
+async def _purchase_listing(db, listing_id, buyer_id):
+    """Шаги покупки внутри уже открытой транзакции писателя."""
+    async with db.execute(CLAIM_LISTING_SQL, (listing_id, buyer_id)) as cursor:
+        listing = await cursor.fetchone()
+    if not listing:
+        async with db.execute(LISTING_SELLER_SQL, (listing_id,)) as cursor:
+            status = claim_failure_status(await cursor.fetchone(), buyer_id)
+        return PurchaseResult(status, listing_id)
+
+    price = listing['price_signals']
+    async with db.execute(DEBIT_BUYER_SQL, (price, buyer_id, price)) as cursor:
+        balance_row = await cursor.fetchone()
+    if not balance_row:
+        async with db.execute(USER_EXISTS_SQL, (buyer_id,)) as cursor:
+            status = debit_failure_status(await cursor.fetchone())
+        return PurchaseResult(status, listing_id, price=price)
+
+    await db.execute(CREDIT_SELLER_SQL, (price, listing['seller_user_id']))
+    await db.execute(TRANSFER_ITEM_SQL, (buyer_id, listing['inventory_item_id']))
+    await db.execute(RECORD_TRADE_SQL, (
+        listing_id, listing['phone_id'], listing['seller_user_id'], buyer_id, listing['inventory_item_id'], price,
+    ))
+    await db.execute(RECORD_MARKET_EVENT_SQL, (
+        MarketEvent.SOLD.value, listing_id, listing['phone_id'], price, listing['seller_user_id'], None,
+    ))
+    return PurchaseResult(
+        PurchaseStatus.OK, listing_id,
+        new_balance=balance_row[0],
+        price=price,
+        seller_user_id=listing['seller_user_id'],
+        inventory_item_id=listing['inventory_item_id'],
+        phone_id=listing['phone_id'],
+    )
+
 async def buy_item_from_market(listing_id, buyer_id):
-   async with aiosqlite.connect(DATABASE_PATH) as db:
-       async with db.cursor() as cursor:
-           await cursor.execute("BEGIN")
-           try:
-               # Получаем информацию о лоте
-               await cursor.execute("SELECT * FROM market_listings WHERE id = ?", (listing_id,))
-               listing = await cursor.fetchone()
-               if not listing:
-                   raise Exception("Listing not found")
-               
-               listing = dict(zip([d[0] for d in cursor.description], listing))
-               seller_id = listing['seller_user_id']
-               price = listing['price_signals']
-               inventory_item_id = listing['inventory_item_id']
-
-               # Получаем информацию о покупателе
-               await cursor.execute("SELECT * FROM users WHERE id = ?", (buyer_id,))
-               buyer = await cursor.fetchone()
-               if not buyer:
-                   raise Exception("Buyer not found")
-
-               buyer = dict(zip([d[0] for d in cursor.description], buyer))
-               
-               if buyer['signals'] < price:
-                   raise Exception("Not enough signals")
-
-               # Обновляем баланс покупателя
-               new_balance = buyer['signals'] - price
-               await cursor.execute("UPDATE users SET signals = ? WHERE id = ?", (new_balance, buyer_id))
-
-               # Обновляем баланс продавца
-               await cursor.execute("UPDATE users SET signals = signals + ? WHERE id = ?", (price, seller_id))
-               
-               # Перемещаем предмет в инвентарь покупателя
-               await cursor.execute("UPDATE user_inventory SET user_id = ? WHERE id = ?", (buyer_id, inventory_item_id))
-
-               # Удаляем лот с рынка
-               await cursor.execute("DELETE FROM market_listings WHERE id = ?", (listing_id,))
-
-               await db.commit()
-               return new_balance
-           except Exception as e:
-               await db.rollback()
-               logger.error(f"Failed to buy item: {e}")
-               return None
-
-async def get_user_inventory(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("""
-            SELECT
-                ui.id,
-                p.name,
-                p.rarity,
-                p.image_filename
-            FROM user_inventory ui
-            JOIN phones p ON ui.phone_id = p.id
-            WHERE ui.user_id = ?
-        """, (user_id,))
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
-        
-# --- Функции для заполнения начальных данных (только один раз!) ---
-async def populate_initial_data():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    """Покупка лота одной транзакцией BEGIN IMMEDIATE (с шардами — см. _purchase_across_shards).
+
+    Возвращает PurchaseResult; при любом статусе кроме OK транзакция
+    откатывается и лот остаётся на рынке (если он там был).
+    """
+    if SHARDED:
+        result = await _purchase_across_shards(listing_id, buyer_id)
+    else:
+        pool = await get_pool()
+        async with pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                result = await _purchase_listing(db, listing_id, buyer_id)
+            except BaseException:
+                await db.execute("ROLLBACK")
+                raise
+            await db.execute("COMMIT" if result.ok else "ROLLBACK")
+    if result.ok:
+        invalidate_users(buyer_id, result.seller_user_id)
+    if result.ok or result.status is PurchaseStatus.SOLD_OUT:
+        _order_book.remove(listing_id)
+    if not result.ok:
+        logger.info("Покупка лота %s пользователем %s не удалась: %s", listing_id, buyer_id, result.status.value)
+    return result
+
+# --- Покупка между шардами ---
+# Три шага с журналом pending_trades в общем файле (порядок и гарантии — utils/shards.py)
+async def _purchase_across_shards(listing_id, buyer_id):
+    pool = await get_pool()
+    async with pool.transaction() as db:
+        async with db.execute(CLAIM_LISTING_SQL, (listing_id, buyer_id)) as cursor:
+            listing = await cursor.fetchone()
+        if not listing:
+            async with db.execute(LISTING_SELLER_SQL, (listing_id,)) as cursor:
+                status = claim_failure_status(await cursor.fetchone(), buyer_id)
+            return PurchaseResult(status, listing_id)
+        async with db.execute(INSERT_PENDING_TRADE_SQL, (
+            listing_id, listing['seller_user_id'], buyer_id, listing['inventory_item_id'], listing['phone_id'],
+            listing['price_signals'], listing['listed_at'],
+        )) as cursor:
+            trade = dict(await cursor.fetchone())
+
+    price = trade['price_signals']
+    same_shard = shard_of(buyer_id) == shard_of(trade['seller_user_id'])
+    buyer_pool = await get_shard_pool(shard_of(buyer_id))
+    try:
+        async with buyer_pool.transaction() as db:
+            bought = await _apply_buyer_side(db, trade)
+            if bought and same_shard:
+                await _apply_seller_side(db, trade)
+            if not bought:
+                async with db.execute(USER_EXISTS_SQL, (buyer_id,)) as cursor:
+                    status = debit_failure_status(await cursor.fetchone())
+    except Exception:
+        # Транзакция шарда откатилась: лот возвращается на рынок
+        await _cancel_pending_trade(trade)
+        raise
+    if not bought:
+        await _cancel_pending_trade(trade)
+        return PurchaseResult(status, listing_id, price=price)
+
+    try:
+        await _finish_trade(trade, seller_applied=same_shard)
+    except Exception:
+        # Покупатель уже получил предмет; продавца и журнал догонит _recover_pending_trades
+        logger.exception("Покупка %s не завершена, её завершит восстановление", trade['id'])
+    new_balance, inventory_item_id = bought
+    return PurchaseResult(
+        PurchaseStatus.OK, listing_id,
+        new_balance=new_balance,
+        price=price,
+        seller_user_id=trade['seller_user_id'],
+        inventory_item_id=inventory_item_id,
+        phone_id=trade['phone_id'],
+    )
+
+async def _apply_buyer_side(db, trade):
+    """Списание и новый предмет покупателя: (баланс, id предмета) или None, если не хватило сигналов."""
+    price = trade['price_signals']
+    async with db.execute(DEBIT_CASE_PRICE_SQL, (
+        price, bought_phone_ids(trade['phone_id']), trade['buyer_user_id'], price,
+    )) as cursor:
+        balance_row = await cursor.fetchone()
+    if not balance_row:
+        return None
+    cursor = await db.execute(INSERT_BOUGHT_ITEM_SQL, (trade['buyer_user_id'], trade['phone_id']))
+    await db.execute(MARK_APPLIED_SQL, (trade['id'], BUYER, cursor.lastrowid))
+    return balance_row[0], cursor.lastrowid
+
+async def _apply_seller_side(db, trade):
+    cursor = await db.execute(MARK_APPLIED_SQL, (trade['id'], SELLER, trade['inventory_item_id']))
+    if not cursor.rowcount:
+        return
+    await db.execute(CREDIT_SELLER_SQL, (trade['price_signals'], trade['seller_user_id']))
+    # Стоимость проданного предмета вычтет триггер на удаление
+    cursor = await db.execute(DELETE_SOLD_ITEM_SQL, (trade['inventory_item_id'], trade['seller_user_id']))
+    if not cursor.rowcount:
+        logger.error("Проданного предмета %s нет у продавца %s", trade['inventory_item_id'], trade['seller_user_id'])
+
+async def _finish_trade(trade, seller_applied=False):
+    """Сторона продавца (если ещё не применена) и запись сделки в общем файле."""
+    if not seller_applied:
+        seller_pool = await get_shard_pool(shard_of(trade['seller_user_id']))
+        async with seller_pool.transaction() as db:
+            await _apply_seller_side(db, trade)
+    pool = await get_pool()
+    async with pool.transaction() as db:
+        if not (await db.execute(CLOSE_PENDING_TRADE_SQL, (trade['id'],))).rowcount:
+            return
+        await db.execute(RECORD_TRADE_SQL, (
+            trade['listing_id'], trade['phone_id'], trade['seller_user_id'], trade['buyer_user_id'],
+            trade['inventory_item_id'], trade['price_signals'],
+        ))
+        await db.execute(RECORD_MARKET_EVENT_SQL, (
+            MarketEvent.SOLD.value, trade['listing_id'], trade['phone_id'], trade['price_signals'],
+            trade['seller_user_id'], None,
+        ))
+
+async def _cancel_pending_trade(trade):
+    """Возвращает лот на рынок; если его id уже занят, лот получает новый."""
+    pool = await get_pool()
+    restored = None
+    async with pool.transaction() as db:
+        if not (await db.execute(CLOSE_PENDING_TRADE_SQL, (trade['id'],))).rowcount:
+            return
+        async with db.execute(RESTORE_LISTING_SQL, (
+            trade['listing_id'], trade['seller_user_id'], trade['inventory_item_id'], trade['phone_id'],
+            trade['price_signals'], trade['listed_at'],
+        )) as cursor:
+            restored = await cursor.fetchone()
+        if restored['id'] != trade['listing_id']:
+            await db.execute(RECORD_MARKET_EVENT_SQL, (
+                MarketEvent.REMOVED.value, trade['listing_id'], trade['phone_id'], trade['price_signals'],
+                trade['seller_user_id'], None,
+            ))
+            await db.execute(RECORD_MARKET_EVENT_SQL, listing_added_event(
+                restored, trade['seller_user_id'], trade['price_signals'],
+            ))
+    if restored['id'] != trade['listing_id']:
+        _order_book.remove(trade['listing_id'])
+        _order_book.add(
+            restored['id'], restored['phone_id'], trade['price_signals'], restored['listed_at'],
+            trade['seller_user_id'],
+        )
+
+# --- Обслуживание шардов ---
+# То, что без шардов делают транзакции и триггеры одного файла: доведение покупок
+# и переоценка инвентаря. При запуске и затем раз в PENDING_TRADES_RECOVERY_SECONDS
+_shard_maintenance = None
+
+async def _maintain_shards():
+    await _recover_pending_trades()
+    await _sync_inventory_values()
+
+async def _maintain_shards_periodically():
+    # Покупка, чей _finish_trade упал, или брошенная процессом, который быстро
+    # перезапустился, становится видна recovery только через PENDING_TRADE_TIMEOUT_SECONDS
+    while True:
+        await asyncio.sleep(PENDING_TRADES_RECOVERY_SECONDS)
         try:
-            phones = [
-                ("Samsung Galaxy A01", "Samsung", "SM-A015F", "Common", 10, "galaxy_a01.jpg"),
-                ("iPhone 15 Pro Max", "Apple", "iPhone16,2", "Legendary", 1000, "iphone_15_pro_max.jpg"),
-                ("Google Pixel 8 Pro", "Google", "G3JH8", "Epic", 500, "pixel_8_pro.jpg"),
-            ]
-            for phone in phones:
-                await db.execute(
-                    """INSERT OR IGNORE INTO phones (name, brand, model_code, rarity, value, image_filename)
-                       VALUES (?, ?, ?, ?, ?, ?)""",
-                    phone
-                )
-
-            await db.execute(
-                """INSERT OR IGNORE INTO cases (name, price_signals)
-                   VALUES (?, ?)""",
-                ("Базовый кейс", 50)
-            )
+            await _maintain_shards()
+        except Exception:
+            logger.exception("Ошибка обслуживания шардов")
 
-            async def _fetch_id(table, name):
-                cursor = await db.execute(f"SELECT id FROM {table} WHERE name = ?", (name,))
-                row = await cursor.fetchone()
-                if not row:
-                    logger.error("Запись %s не найдена в %s", name, table)
-                return row[0] if row else None
-
-            galaxy_a01_id = await _fetch_id("phones", "Samsung Galaxy A01")
-            pixel_8_pro_id = await _fetch_id("phones", "Google Pixel 8 Pro")
-            basic_case_id = await _fetch_id("cases", "Базовый кейс")
-
-            if None in (galaxy_a01_id, pixel_8_pro_id, basic_case_id):
-                logger.warning("Не удалось добавить содержимое кейсов из-за отсутствующих данных")
-                await db.commit()
-                return
-
-            await db.execute(
-                """INSERT OR IGNORE INTO case_contents (case_id, phone_id, chance)
-                   VALUES (?, ?, ?)""",
-                (basic_case_id, galaxy_a01_id, 0.8)
-            )
-            await db.execute(
-                """INSERT OR IGNORE INTO case_contents (case_id, phone_id, chance)
-                   VALUES (?, ?, ?)""",
-                (basic_case_id, pixel_8_pro_id, 0.05)
-            )
-            await db.commit()
-            logger.info("Начальные данные (телефоны, кейсы) добавлены.")
+async def _sync_inventory_values():
+    """Пересчитывает users.inventory_value шардов, отставших от версии каталога (переоценка моделей)."""
+    for shard in range(DB_SHARDS):
+        pool = await get_shard_pool(shard)
+        async with pool.transaction() as db:
+            async with db.execute(CLAIM_VALUES_VERSION_SQL) as cursor:
+                claimed = await cursor.fetchone()
+            if claimed:
+                await db.execute(INVENTORY_VALUE_BACKFILL_SQL)
+        if claimed:
+            logger.info("Стоимость инвентаря шарда %s пересчитана (каталог версии %s)", shard, claimed[0])
+
+async def _recover_pending_trades():
+    """Доводит покупки, прерванные между шагами: с отметкой покупателя — до конца, без неё — откатывает."""
+    pool = await get_pool()
+    async with pool.read() as db:
+        trades = [dict(row) for row in await db.execute_fetchall(STALE_PENDING_TRADES_SQL)]
+    for trade in trades:
+        buyer_pool = await get_shard_pool(shard_of(trade['buyer_user_id']))
+        async with buyer_pool.read() as db:
+            async with db.execute(APPLIED_SIDE_SQL, (trade['id'], BUYER)) as cursor:
+                bought = await cursor.fetchone()
+        if bought:
+            await _finish_trade(trade)
+        else:
+            await _cancel_pending_trade(trade)
+        logger.info("Покупка %s восстановлена: %s", trade['id'], "завершена" if bought else "отменена")
+
+    async with pool.read() as db:
+        floor = (await db.execute_fetchall(PENDING_TRADES_FLOOR_SQL))[0][0]
+    for shard in range(DB_SHARDS):
+        shard_pool = await get_shard_pool(shard)
+        async with shard_pool.transaction() as db:
+            await db.execute(PRUNE_APPLIED_SQL, (floor,))
+
+# --- История цен ---
+async def get_candles(phone_id, period="1h", limit=CANDLES_LIMIT, before=None):
+    """Свечи модели по готовым корзинам trade_candles (см. build_candles_query), старые первыми."""
+    sql, params = build_candles_query(phone_id, period=period, limit=limit, before=before)
+    pool = await get_pool()
+    async with pool.read() as db:
+        rows = await db.execute_fetchall(sql, params)
+    return candles_payload(rows)
+
+async def get_trade_stats(phone_id):
+    """Последняя цена, VWAP, объём и min/max модели за 1h/24h/7d (см. summarize_trade_stats)."""
+    now = time.time()
+    pool = await get_pool()
+    async with pool.read() as db:
+        async with db.execute(PHONE_TRADE_STATS_SQL, (phone_id,)) as cursor:
+            stats_row = await cursor.fetchone()
+        hourly_rows = []
+        if stats_row:
+            hourly_rows = await db.execute_fetchall(HOURLY_CANDLES_SINCE_SQL, (phone_id, stats_since(now)))
+    return summarize_trade_stats(stats_row, hourly_rows, now)
+
+# --- Книга заявок ---
+# Лучшие цены по моделям отвечаются из памяти; БД нужна только для коммита покупки.
+# Лоты, выставленные, купленные и снятые другими процессами (веб-API), книга
+# догоняет по market_events: фоновая задача опрашивает их раз в FEED_POLL_SECONDS
+_order_book = OrderBook()
+_order_book_seq = 0  # seq последнего события market_events, учтённого в книге
+_order_book_sync = None
+
+async def warm_order_book():
+    """Загружает книгу заявок и запускает её синхронизацию с market_events."""
+    global _order_book_sync
+    await _load_order_book()
+    if _order_book_sync is None:
+        _order_book_sync = metrics.background_task(_sync_order_book())
+
+async def _load_order_book():
+    global _order_book_seq
+    pool = await get_pool()
+    async with pool.read() as db:
+        # Одна читающая транзакция: лоты и seq, с которого продолжать, согласованы
+        await db.execute("BEGIN")
+        try:
+            seq = (await db.execute_fetchall(LAST_MARKET_EVENT_SQL))[0][0]
+            rows = await db.execute_fetchall(ORDER_BOOK_SQL)
+        finally:
+            await db.execute("COMMIT")
+    _order_book.load(rows)
+    _order_book_seq = seq
+    logger.info("Книга заявок загружена: %s лотов", len(rows))
+
+async def poll_order_book():
+    """Применяет к книге заявок новые события market_events; возвращает их число."""
+    global _order_book_seq
+    pool = await get_pool()
+    async with pool.read() as db:
+        rows = await db.execute_fetchall(ORDER_BOOK_EVENTS_SQL, (_order_book_seq, FEED_BATCH_SIZE))
+    if rows and rows[0]['seq'] != _order_book_seq + 1:
+        # Пропущенные события уже удалены (TRIM_MARKET_EVENTS_SQL): книга перечитывается целиком
+        logger.warning("Книга заявок отстала от market_events (seq %s), перезагрузка", _order_book_seq)
+        await _load_order_book()
+        return len(rows)
+    _order_book.apply_events(rows)
+    if rows:
+        _order_book_seq = rows[-1]['seq']
+    return len(rows)
+
+async def _sync_order_book():
+    while True:
+        await asyncio.sleep(FEED_POLL_SECONDS)
+        try:
+            while await poll_order_book() == FEED_BATCH_SIZE:
+                pass
         except Exception:
-            logger.exception("Ошибка при заполнении начальных данных")
\ No newline at end of file
+            logger.exception("Ошибка синхронизации книги заявок")
+
+def get_best_ask(phone_id):
+    return _order_book.best_ask(phone_id)
+
+def get_market_depth(phone_id, levels=5):
+    return _order_book.depth(phone_id, levels)
+
+def get_market_summary():
+    """[(phone_id, лучшая цена, число лотов)], дешёвые модели первыми."""
+    return _order_book.summary()
+
+async def buy_cheapest(buyer_id, phone_id, count=1):
+    """Покупает до `count` самых дешёвых лотов модели одной транзакцией.
+
+    Кандидаты берутся из книги заявок; каждая покупка идёт в своём SAVEPOINT,
+    поэтому устаревший (уже проданный) лот просто пропускается.
+    Возвращает (список успешных PurchaseResult, PurchaseStatus): OK — куплено
+    всё, SOLD_OUT — лоты закончились, иначе причина остановки.
+    """
+    if SHARDED:
+        return await _buy_cheapest_across_shards(buyer_id, phone_id, count)
+    purchases, tried, gone = [], set(), []
+    status = PurchaseStatus.OK
+    pool = await get_pool()
+    async with pool.write() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            while len(purchases) < count and status is PurchaseStatus.OK:
+                # Опробованные лоты ещё лежат в книге, поэтому запрашиваем их "сверху"
+                candidates = [
+                    listing_id
+                    for listing_id in _order_book.cheapest(
+                        phone_id, count - len(purchases) + len(tried), exclude_seller_id=buyer_id
+                    )
+                    if listing_id not in tried
+                ]
+                if not candidates:
+                    status = PurchaseStatus.SOLD_OUT
+                    break
+                for listing_id in candidates:
+                    tried.add(listing_id)
+                    await db.execute("SAVEPOINT buy_listing")
+                    result = await _purchase_listing(db, listing_id, buyer_id)
+                    if result.ok:
+                        await db.execute("RELEASE buy_listing")
+                        purchases.append(result)
+                        if len(purchases) == count:
+                            break
+                        continue
+                    await db.execute("ROLLBACK TO buy_listing")
+                    await db.execute("RELEASE buy_listing")
+                    if result.status is PurchaseStatus.SOLD_OUT:
+                        gone.append(listing_id)
+                    elif result.status is not PurchaseStatus.OWN_LISTING:
+                        status = result.status
+                        break
+        except BaseException:
+            await db.execute("ROLLBACK")
+            raise
+        await db.execute("COMMIT")
+
+    for listing_id in gone:
+        _order_book.remove(listing_id)
+    for result in purchases:
+        _order_book.remove(result.listing_id)
+    if purchases:
+        invalidate_users(buyer_id, *(result.seller_user_id for result in purchases))
+    return purchases, status
+
+async def _buy_cheapest_across_shards(buyer_id, phone_id, count):
+    # Общей транзакции на несколько файлов нет: каждая покупка — свой обмен в три шага
+    purchases, tried = [], set()
+    status = PurchaseStatus.OK
+    while len(purchases) < count and status is PurchaseStatus.OK:
+        candidates = [
+            listing_id
+            for listing_id in _order_book.cheapest(
+                phone_id, count - len(purchases) + len(tried), exclude_seller_id=buyer_id
+            )
+            if listing_id not in tried
+        ]
+        if not candidates:
+            status = PurchaseStatus.SOLD_OUT
+            break
+        for listing_id in candidates:
+            tried.add(listing_id)
+            result = await _purchase_across_shards(listing_id, buyer_id)
+            if result.ok or result.status is PurchaseStatus.SOLD_OUT:
+                _order_book.remove(listing_id)
+            if result.ok:
+                purchases.append(result)
+                if len(purchases) == count:
+                    break
+            elif result.status is not PurchaseStatus.SOLD_OUT and result.status is not PurchaseStatus.OWN_LISTING:
+                status = result.status
+                break
+    if purchases:
+        invalidate_users(buyer_id, *(result.seller_user_id for result in purchases))
+    return purchases, status
+
+# --- Кейсы ---
+_case_engine = CaseEngine()
+
+async def get_case_table(case_id):
+    # Alias-таблицы сбрасываются, когда меняется версия каталога
+    catalog = await get_catalog()
+    _case_engine.sync_version(catalog.version)
+    case_table = _case_engine.get(case_id)
+    if case_table is None:
+        case_table = _case_engine.build_from_catalog(catalog, case_id)
+    return case_table
+
+async def open_case(user_id, case_id):
+    """Открывает кейс: списывает цену и кладёт выпавший телефон в инвентарь.
+
+    Возвращает описание приза с inventory_id и new_balance либо None,
+    если кейса нет или не хватает сигналов.
+    """
+    case_table = await get_case_table(case_id)
+    if case_table is None:
+        logger.warning("Кейс %s не найден или пуст", case_id)
+        return None
+
+    phone = case_table.table.draw()
+    pool = await get_shard_pool(_player_shard(user_id))
+    async with pool.transaction() as db:
+        # Условное списание: баланс проверяется и уменьшается одним выражением
+        async with db.execute(
+            DEBIT_CASE_PRICE_SQL, (case_table.price, prize_phone_ids([phone]), user_id, case_table.price)
+        ) as cursor:
+            balance_row = await cursor.fetchone()
+        if not balance_row:
+            logger.info("Пользователю %s не хватает сигналов на кейс %s", user_id, case_id)
+            return None
+        cursor = await db.execute(
+            "INSERT INTO user_inventory (user_id, phone_id) VALUES (?, ?)",
+            (user_id, phone['phone_id'])
+        )
+    invalidate_users(user_id)
+    return {**phone, "inventory_id": cursor.lastrowid, "new_balance": balance_row[0]}
+
+async def open_cases(user_id, case_id, count):
+    """Массовое открытие: все розыгрыши одним проходом, одно списание,
+    одна вставка executemany и один COMMIT.
+
+    Возвращает {"case_id", "count", "new_balance", "prizes", "rolls"}
+    (см. summarize_draws) либо None, если кейса нет или не хватает сигналов.
+    """
+    if not 1 <= count <= MAX_BULK_OPEN:
+        raise ValueError(f"Можно открыть от 1 до {MAX_BULK_OPEN} кейсов за раз")
+    case_table = await get_case_table(case_id)
+    if case_table is None:
+        logger.warning("Кейс %s не найден или пуст", case_id)
+        return None
+
+    draws = case_table.table.draw_many(count)
+    total_price = case_table.price * count
+    pool = await get_shard_pool(_player_shard(user_id))
+    async with pool.transaction() as db:
+        async with db.execute(
+            DEBIT_CASE_PRICE_SQL, (total_price, prize_phone_ids(draws), user_id, total_price)
+        ) as cursor:
+            balance_row = await cursor.fetchone()
+        if not balance_row:
+            logger.info("Пользователю %s не хватает сигналов на %s кейсов %s", user_id, count, case_id)
+            return None
+        await db.executemany(
+            "INSERT INTO user_inventory (user_id, phone_id) VALUES (?, ?)",
+            [(user_id, phone['phone_id']) for phone in draws]
+        )
+    invalidate_users(user_id)
+    prizes, rolls = summarize_draws(draws)
+    return {"case_id": case_id, "count": count, "new_balance": balance_row[0], "prizes": prizes, "rolls": rolls}
+
+async def get_phone_names():
+    catalog = await get_catalog()
+    return {phone_id: phone['name'] for phone_id, phone in catalog.phones.items()}
+
+async def get_inventory_summary(user_id):
+    """Инвентарь по моделям: {"models", "total_count", "total_value"} (см. summarize_inventory)."""
+    catalog = await get_catalog()
+    pool = await get_shard_pool(_player_shard(user_id))
+    async with pool.read() as db:
+        rows = await db.execute_fetchall(INVENTORY_SUMMARY_SQL, (user_id,))
+    return summarize_inventory(rows, catalog)
+
+async def get_inventory_items(user_id, limit=INVENTORY_PAGE_SIZE, cursor=None, phone_id=None):
+    """Отдельные предметы страницами: {"items": [...], "next_cursor": str | None}."""
+    sql, params, limit = build_inventory_items_query(user_id, limit=limit, cursor=cursor, phone_id=phone_id)
+    catalog = await get_catalog()
+    pool = await get_shard_pool(_player_shard(user_id))
+    async with pool.read() as db:
+        rows = await db.execute_fetchall(sql, params)
+    return paginate_inventory_rows(rows, limit, catalog)
+
+# --- Рейтинг ---
+# Состояние игрока — users.signals + users.inventory_value, хранится в строке игрока
+# и обновляется вместе с балансом и инвентарём (см. utils/schema.py)
+_ranks = RankCache()
+_ranks_refreshing = None
+
+async def get_leaderboard(limit=LEADERBOARD_SIZE):
+    """Самые богатые игроки с местами (см. rank_top_players), по индексу idx_users_net_worth."""
+    limit = max(1, min(int(limit), MAX_LEADERBOARD_SIZE))
+    row_lists = await _fetch_from_players(TOP_PLAYERS_SQL, (limit,))
+    return rank_top_players(merge_top_players(row_lists, limit))
+
+async def get_player_rank(user_id):
+    """Место игрока в рейтинге (см. player_rank) или None, если игрока нет."""
+    pool = await get_shard_pool(_player_shard(user_id))
+    async with pool.read() as db:
+        async with db.execute(PLAYER_NET_WORTH_SQL, (user_id,)) as cursor:
+            player = await cursor.fetchone()
+    if not player:
+        return None
+    # С шардами — сумма по файлам: если хоть один упёрся в EXACT_RANK_LIMIT, упрётся и сумма
+    row_lists = await _fetch_from_players(PLAYERS_ABOVE_SQL, (player["net_worth"],))
+    players_above = sum(rows[0][0] for rows in row_lists)
+    return player_rank(player, players_above, await get_rank_snapshot())
+
+async def _fetch_from_players(sql, params=()):
+    """Строки sql из каждого файла с игроками: всех шардов или общего файла."""
+    async def fetch(shard):
+        pool = await get_shard_pool(shard)
+        async with pool.read() as db:
+            return await db.execute_fetchall(sql, params)
+    return await asyncio.gather(*(fetch(shard) for shard in (range(DB_SHARDS) if SHARDED else [None])))
+
+async def get_rank_snapshot():
+    """Распределение состояний для мест ниже EXACT_RANK_LIMIT.
+
+    Устаревший снимок перестраивается в фоне, а пока отвечает старый;
+    ждать приходится только самый первый.
+    """
+    global _ranks_refreshing
+    if not _ranks.needs_refresh():
+        return _ranks.snapshot
+    if _ranks_refreshing is None:
+        _ranks_refreshing = metrics.background_task(_refresh_rank_snapshot())
+    if _ranks.snapshot is not None:
+        return _ranks.snapshot
+    return await asyncio.shield(_ranks_refreshing)
+
+async def _refresh_rank_snapshot():
+    global _ranks_refreshing
+    try:
+        rows = merge_net_worth_distributions(await _fetch_from_players(NET_WORTH_DISTRIBUTION_SQL))
+        snapshot = _ranks.install(build_rank_snapshot(rows))
+    finally:
+        _ranks_refreshing = None
+    logger.info("Распределение состояний обновлено: %s игроков", snapshot.total_players)
+    return snapshot
+
+# --- Функции для заполнения начальных данных ---
+# Начальный каталог проходит через тот же импорт, что и файлы (utils/catalog_import.py),
+# но только добавляет недостающее: правки каталога импортом перезапуск бота не откатывает
+INITIAL_PHONES = [
+    {"name": "Samsung Galaxy A01", "brand": "Samsung", "model_code": "SM-A015F", "rarity": "Common",
+     "value": 10, "image_filename": "galaxy_a01.jpg"},
+    {"name": "iPhone 15 Pro Max", "brand": "Apple", "model_code": "iPhone16,2", "rarity": "Legendary",
+     "value": 1000, "image_filename": "iphone_15_pro_max.jpg"},
+    {"name": "Google Pixel 8 Pro", "brand": "Google", "model_code": "G3JH8", "rarity": "Epic",
+     "value": 500, "image_filename": "pixel_8_pro.jpg"},
+]
+INITIAL_CASES = [{"name": "Базовый кейс", "price_signals": 50}]
+INITIAL_CASE_CONTENTS = [
+    {"case": "Базовый кейс", "phone": "Samsung Galaxy A01", "chance": 0.8},
+    {"case": "Базовый кейс", "phone": "Google Pixel 8 Pro", "chance": 0.05},
+]
+
+def _import_initial_catalog():
+    # sqlite3 напрямую: импорт синхронный, поэтому идёт в отдельном потоке и соединении
+    conn = catalog_import.connect(DATABASE_PATH)
+    try:
+        return catalog_import.import_catalog(
+            conn, INITIAL_PHONES, INITIAL_CASES, INITIAL_CASE_CONTENTS, update_existing=False,
+        )
+    finally:
+        conn.close()
+
+async def populate_initial_data():
+    try:
+        report = await asyncio.to_thread(_import_initial_catalog)
+    except Exception:
+        logger.exception("Ошибка при заполнении начальных данных")
+        return
+    if report.changed:
+        # Версию каталога подняли триггеры; свой процесс сверяет её сразу
+        invalidate_catalog()
+        for warning in report.warnings:
+            logger.warning(warning)
+        logger.info("Начальные данные добавлены: %s", report.summary())
+
+# --- Метрики ---
+# Публичные функции выше оборачиваются таймером (при METRICS_ENABLED=0 — нет);
+# служебные вызываются изнутри на каждом шаге и отдельно не меряются. Публичная
+# функция, вызванная из другой публичной, входит во время внешней (metrics.instrument)
+metrics.instrument_module(globals(), "bot", exclude={
+    "get_pool", "get_shard_pool", "close_pool", "get_write_batcher", "submit_write", "invalidate_catalog",
+    "invalidate_users",
+})
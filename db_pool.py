@@ -0,0 +1,167 @@
+# db_pool.py
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+from utils import metrics
+from utils.schema import PRAGMAS
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """Пул соединений aiosqlite: один писатель и N читателей.
+
+    Писатель сериализуется через asyncio.Lock, транзакции открываются явно
+    (BEGIN IMMEDIATE), поэтому соединения работают в autocommit-режиме.
+    Подготовленные выражения переиспользуются встроенным кэшем sqlite3
+    (cached_statements), так как соединения живут всё время работы бота.
+
+    Пулу шарда (utils/shards.py) передаются attach — [(имя, путь)] для ATTACH,
+    writer_sql — скрипт для писателя после ATTACH (TEMP-триггеры) и begin="BEGIN":
+    BEGIN IMMEDIATE заблокировал бы на запись и все подключённые файлы.
+    """
+
+    def __init__(self, path, readers=4, statement_cache=256, name="bot", pragmas=PRAGMAS, attach=(),
+                 writer_sql=None, begin="BEGIN IMMEDIATE"):
+        self.path = path
+        self.name = name
+        self.pragmas = pragmas
+        self.attach = attach
+        self.writer_sql = writer_sql
+        self.begin = begin
+        # Читатели ":memory:" видели бы собственную пустую БД
+        self.readers = 0 if path == ":memory:" else max(0, readers)
+        self.statement_cache = statement_cache
+        self._writer = None
+        self._write_lock = None
+        self._idle_readers = None
+        self._closed = False
+        self._timed = metrics.ENABLED
+        # Соединение -> metrics.StatementTrace (только при metrics.TRACE_SQL)
+        self._traces = {}
+
+    async def _connect(self, readonly=False):
+        conn = await aiosqlite.connect(
+            self.path,
+            isolation_level=None,
+            cached_statements=self.statement_cache,
+        )
+        conn.row_factory = aiosqlite.Row
+        for pragma in self.pragmas:
+            await conn.execute(pragma)
+        for schema, path in self.attach:
+            await conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+        if readonly:
+            await conn.execute("PRAGMA query_only = ON")
+        elif self.writer_sql:
+            await conn.executescript(self.writer_sql)
+        if metrics.TRACE_SQL:
+            # Колбэк вызывается в потоке соединения aiosqlite
+            trace = self._traces[conn] = metrics.StatementTrace(self.name)
+            await conn.set_trace_callback(trace)
+        return conn
+
+    def _checked_out(self, conn, mode, started):
+        metrics.CONNECTION_WAIT_SECONDS.observe(time.perf_counter() - started, self.name, mode)
+        trace = self._traces.get(conn)
+        if trace is not None:
+            trace.reset()
+
+    async def _checked_in(self, conn):
+        trace = self._traces.get(conn)
+        if trace is None:
+            return
+        for statement, sql, seconds in trace.finish():
+            plan = None
+            if metrics.wants_plan(sql, statement):
+                try:
+                    plan = await conn.execute_fetchall(f"EXPLAIN QUERY PLAN {sql}")
+                except aiosqlite.Error:
+                    pass
+            metrics.record_slow_query(self.name, statement, sql, seconds, plan)
+
+    async def open(self):
+        self._write_lock = asyncio.Lock()
+        self._idle_readers = asyncio.Queue()
+        # Писатель открывается первым: он переводит файл БД в WAL
+        self._writer = await self._connect()
+        for _ in range(self.readers):
+            conn = await self._connect(readonly=True)
+            self._idle_readers.put_nowait(conn)
+        logger.info("Пул соединений к %s открыт (читателей: %s)", self.path, self.readers)
+        return self
+
+    @asynccontextmanager
+    async def read(self):
+        if self._closed:
+            raise RuntimeError("Пул соединений закрыт")
+        started = time.perf_counter()
+        if not self.readers:
+            async with self._write_lock:
+                if self._timed:
+                    self._checked_out(self._writer, "read", started)
+                try:
+                    yield self._writer
+                finally:
+                    if self._traces:
+                        await self._checked_in(self._writer)
+            return
+        conn = await self._idle_readers.get()
+        if self._timed:
+            self._checked_out(conn, "read", started)
+        try:
+            yield conn
+        finally:
+            if self._traces:
+                await self._checked_in(conn)
+            self._idle_readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        """Эксклюзивный доступ к писателю без открытия транзакции."""
+        if self._closed:
+            raise RuntimeError("Пул соединений закрыт")
+        started = time.perf_counter()
+        async with self._write_lock:
+            if self._timed:
+                self._checked_out(self._writer, "write", started)
+            try:
+                yield self._writer
+            finally:
+                if self._traces:
+                    await self._checked_in(self._writer)
+
+    @asynccontextmanager
+    async def transaction(self):
+        """BEGIN IMMEDIATE (или self.begin) ... COMMIT на писателе; при исключении ROLLBACK."""
+        async with self.write() as conn:
+            await conn.execute(self.begin)
+            try:
+                yield conn
+            except BaseException:
+                await conn.execute("ROLLBACK")
+                raise
+            await conn.execute("COMMIT")
+
+    async def close(self):
+        if self._closed or self._writer is None:
+            return
+        self._closed = True
+        # Дожидаемся, пока все читатели и писатель вернутся в пул
+        for _ in range(self.readers):
+            conn = await self._idle_readers.get()
+            await conn.close()
+        async with self._write_lock:
+            try:
+                # Только свой файл: подключённые через ATTACH оптимизирует их собственный пул
+                await self._writer.execute("PRAGMA main.optimize")
+            except aiosqlite.OperationalError as e:
+                # Файл пишет другой процесс (несколько ботов, шарды): статистику обновит он
+                logger.warning("PRAGMA optimize для %s пропущен: %s", self.path, e)
+            finally:
+                await self._writer.close()
+        logger.info("Пул соединений к %s закрыт", self.path)
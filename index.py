@@ -1,6 +1,103 @@
-from flask import Flask, jsonify
+import os
+import threading
+import time
+
+from flask import Flask, g, jsonify, request
+
+from utils import metrics
+from utils.case_engine import MAX_BULK_OPEN
+from utils.database import GameDatabase
+from utils.leaderboard import LEADERBOARD_SIZE
+from utils.market import ListingStatus, PurchaseStatus
+from utils.market_feed import HEARTBEAT_SECONDS, format_reset
+from utils.trades import CANDLES_LIMIT
+from utils.webapp_auth import INIT_DATA_HEADER, INIT_DATA_MAX_AGE_SECONDS, verify_init_data
 
 app = Flask(__name__)
+# Один экземпляр на процесс: пул соединений и кэши живут между запросами
+game_db = GameDatabase()
+
+# Каждый подписчик /api/market/events занимает поток сервера на всё время
+# подключения. Сверх лимита поток не открывается (503 + Retry-After), чтобы
+# подписчики не забрали все потоки у обычных запросов
+MARKET_STREAMS_LIMIT = int(os.environ.get("MARKET_STREAMS_LIMIT", "32"))
+MARKET_STREAMS_RETRY_SECONDS = 30
+market_streams = threading.BoundedSemaphore(MARKET_STREAMS_LIMIT)
+
+# Игрок /api определяется по initData Telegram Mini App, подписанной токеном бота
+TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
+INIT_DATA_MAX_AGE = int(os.environ.get("INIT_DATA_MAX_AGE_SECONDS", str(INIT_DATA_MAX_AGE_SECONDS)))
+
+# Статус неудачной покупки -> HTTP-код ответа
+PURCHASE_ERROR_CODES = {
+    PurchaseStatus.SOLD_OUT: 409,
+    PurchaseStatus.OWN_LISTING: 409,
+    PurchaseStatus.INSUFFICIENT_FUNDS: 402,
+    PurchaseStatus.NOT_FOUND: 404,
+}
+
+def phone_payload(phone):
+    # Формат телефона, который ожидает фронтенд (script.js)
+    return {
+        "id": phone.get("inventory_id", phone["phone_id"]),
+        "phone_id": phone["phone_id"],
+        "name": phone["name"],
+        "rarity": (phone["rarity"] or "common").lower(),
+        "value": phone["value"],
+        "image": f"/images/phones/{phone['image_filename']}" if phone.get("image_filename") else None,
+    }
+
+def error(message, status):
+    return jsonify({"ok": False, "error": message}), status
+
+def int_arg(name, default=None):
+    value = request.args.get(name)
+    return int(value) if value not in (None, "") else default
+
+def catalog_response(resource, render):
+    """Ответ по снимку каталога с сильным ETag.
+
+    Повторный запрос с If-None-Match получает 304 без тела; тело каждого
+    ресурса сериализуется один раз на версию каталога.
+    """
+    catalog = game_db.get_catalog()
+    etag = catalog.etag(resource)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        body = catalog.rendered.get(resource)
+        if body is None:
+            body = catalog.rendered[resource] = app.json.dumps(render(catalog))
+        response = app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    # Браузер может хранить ответ, но обязан перепроверять его по ETag
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def resolve_user(telegram_id):
+    """Фронтенд знает только telegram_id; в БД продавцы и покупатели — это users.id."""
+    return game_db.get_user_by_telegram_id(telegram_id) if telegram_id is not None else None
+
+@app.before_request
+def authenticate():
+    """Каждый запрос к /api несёт initData; telegram_id игрока берётся только из неё.
+
+    initData передаётся заголовком X-Telegram-Init-Data. EventSource заголовков
+    не умеет, поэтому поток /api/market/events принимает её и параметром ?initData=.
+    """
+    if not request.path.startswith("/api/"):
+        return None
+    init_data = request.headers.get(INIT_DATA_HEADER)
+    if not init_data and request.endpoint == "market_events":
+        init_data = request.args.get("initData")
+    g.telegram_id = verify_init_data(init_data, TELEGRAM_BOT_TOKEN, INIT_DATA_MAX_AGE)
+    if g.telegram_id is None:
+        return error("Нужна действительная initData Telegram", 401)
+    return None
+
+def current_user():
+    """Игрок, от имени которого пришёл запрос (проверенная initData)."""
+    return resolve_user(g.telegram_id)
 
 @app.route('/')
 def home():
@@ -10,11 +107,337 @@ def home():
 def test():
     return jsonify({"message": "Test successful!"})
 
+if metrics.ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.teardown_request
+    def observe_request(exc=None):
+        started = g.pop("request_started", None)
+        if started is None:
+            return
+        labels = ("http", request.endpoint or "unknown")
+        metrics.HANDLER_SECONDS.observe(time.perf_counter() - started, *labels)
+        if exc is not None:
+            metrics.HANDLER_ERRORS.inc(*labels)
+
+def metrics_unavailable():
+    """Ответ-отказ для эндпоинтов метрик или None, если запрос можно обслужить."""
+    if not metrics.ENABLED:
+        return error("Метрики выключены (METRICS_ENABLED=0)", 404)
+    if not metrics.TOKEN:
+        return error("Метрики закрыты: не задан METRICS_TOKEN", 404)
+    if not metrics.authorized(request.headers.get("Authorization")):
+        return error("Нужен заголовок Authorization: Bearer <METRICS_TOKEN>", 401)
+    return None
+
+@app.route('/metrics')
+def metrics_text():
+    denied = metrics_unavailable()
+    if denied:
+        return denied
+    return app.response_class(metrics.render(), content_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+@app.route('/metrics/slow-queries')
+def slow_queries():
+    """Последние медленные выражения SQL с EXPLAIN QUERY PLAN, новые первыми."""
+    denied = metrics_unavailable()
+    if denied:
+        return denied
+    return jsonify({"ok": True, "thresholdMs": metrics.SLOW_QUERY_SECONDS * 1000,
+                    "queries": list(reversed(metrics.slow_queries))})
+
+@app.route('/api/user')
+def user():
+    found = current_user()
+    if not found:
+        return error("Пользователь не найден", 404)
+    return jsonify({"ok": True, "user": {"signals": found["signals"]}})
+
+def leaderboard_payload(player):
+    return {
+        "rank": player["rank"],
+        "userId": player["telegram_id"],
+        "netWorth": player["net_worth"],
+        "signals": player["signals"],
+        "inventoryValue": player["inventory_value"],
+    }
+
+@app.route('/api/leaderboard')
+def leaderboard():
+    """Топ по состоянию (сигналы + стоимость телефонов) и место игрока, если он уже играет."""
+    try:
+        limit = int_arg("limit", LEADERBOARD_SIZE)
+    except ValueError:
+        return error("Некорректные параметры", 400)
+    response = {"ok": True, "players": [leaderboard_payload(player) for player in game_db.get_leaderboard(limit)]}
+    found = current_user()
+    if found:
+        rank = game_db.get_player_rank(found["id"])
+        response["me"] = {**leaderboard_payload(rank), "exact": rank["exact"]}
+        response["totalPlayers"] = rank["total_players"]
+    return jsonify(response)
+
+def case_payload(case):
+    return {"id": case["id"], "name": case["name"], "price": case["price_signals"], "image": None}
+
+@app.route('/api/cases')
+def cases():
+    return catalog_response("cases", lambda catalog: {
+        "ok": True,
+        "cases": [case_payload(case) for case in catalog.cases],
+    })
+
+@app.route('/api/catalog')
+def catalog():
+    return catalog_response("catalog", lambda catalog: {
+        "ok": True,
+        "version": catalog.version,
+        "phones": [
+            {**phone_payload({**phone, "phone_id": phone_id}), "brand": phone["brand"]}
+            for phone_id, phone in catalog.phones.items()
+        ],
+        "cases": [
+            {
+                **case_payload(case),
+                "contents": [
+                    {"phone_id": phone_id, "chance": chance}
+                    for phone_id, chance in catalog.case_contents.get(case["id"], ())
+                ],
+            }
+            for case in catalog.cases
+        ],
+    })
+
+@app.route('/api/inventory')
+def inventory():
+    found = current_user()
+    if not found:
+        return error("Пользователь не найден", 404)
+    # mode=grouped — модели с количеством и стоимостью, mode=items — отдельные предметы страницами
+    mode = request.args.get("mode", "grouped")
+    if mode == "grouped":
+        summary = game_db.get_inventory_summary(found["id"])
+        return jsonify({
+            "ok": True,
+            "models": [
+                {
+                    **phone_payload({**model, "inventory_id": model["id"]}),
+                    "count": model["count"],
+                    "total_value": model["total_value"],
+                }
+                for model in summary["models"]
+            ],
+            "totalCount": summary["total_count"],
+            "totalValue": summary["total_value"],
+        })
+    if mode != "items":
+        return error("mode должен быть grouped или items", 400)
+    try:
+        page = game_db.get_inventory_items(
+            found["id"],
+            limit=int_arg("limit", 50),
+            cursor=request.args.get("cursor") or None,
+            phone_id=int_arg("phoneId"),
+        )
+    except ValueError as e:
+        return error(str(e), 400)
+    return jsonify({
+        "ok": True,
+        "items": [phone_payload({**item, "inventory_id": item["id"]}) for item in page["items"]],
+        "next_cursor": page["next_cursor"],
+    })
+
 @app.route('/api/market')
 def market():
+    try:
+        filters = {
+            "limit": int_arg("limit", 50),
+            "cursor": request.args.get("cursor") or None,
+            "rarity": request.args.get("rarity") or None,
+            "brand": request.args.get("brand") or None,
+            "phone_id": int_arg("phoneId"),
+            "min_price": int_arg("minPrice"),
+            "max_price": int_arg("maxPrice"),
+        }
+        seller, excluded = int_arg("seller"), int_arg("excludeSeller")
+    except ValueError:
+        return error("Некорректные параметры фильтра", 400)
+
+    # Фильтры по продавцу приходят в telegram_id и переводятся в users.id
+    if seller is not None:
+        found = resolve_user(seller)
+        if not found:
+            return jsonify({"items": [], "next_cursor": None})
+        filters["seller_id"] = found["id"]
+    if excluded is not None:
+        found = resolve_user(excluded)
+        filters["exclude_seller_id"] = found["id"] if found else None
+
+    # Номер ленты берётся до чтения страницы: события после него клиент применит поверх,
+    # а те, что уже попали в страницу, применятся повторно без вреда
+    seq = game_db.get_market_feed().head
+    try:
+        page = game_db.get_market_listings(**filters)
+    except ValueError as e:
+        return error(str(e), 400)
+    for item in page["items"]:
+        item["rarity"] = (item["rarity"] or "common").lower()
+    return jsonify({**page, "seq": seq})
+
+@app.route('/api/market/events')
+def market_events():
+    """Изменения рынка (added / removed / sold) потоком Server-Sent Events.
+
+    Продолжает с Last-Event-ID (переподключение EventSource) или ?since= (seq
+    из /api/market); без них — с текущего момента. Если столько событий лента
+    уже не помнит, первым приходит reset: клиент перечитывает рынок.
+    Одновременных потоков не больше MARKET_STREAMS_LIMIT, сверх — 503.
+    """
+    try:
+        since = int(request.headers.get("Last-Event-ID") or request.args.get("since") or -1)
+    except ValueError:
+        return error("Некорректный since", 400)
+    if not market_streams.acquire(blocking=False):
+        body, status = error("Слишком много подписчиков ленты рынка", 503)
+        return body, status, {"Retry-After": str(MARKET_STREAMS_RETRY_SECONDS)}
+    try:
+        feed = game_db.get_market_feed()
+    except Exception:
+        market_streams.release()
+        raise
+    seq = since if since >= 0 else feed.head
+
+    def stream():
+        nonlocal seq
+        yield "retry: 3000\n\n"
+        while True:
+            frames = feed.wait(seq, HEARTBEAT_SECONDS)
+            if frames is None:
+                seq = feed.head
+                yield format_reset(seq)
+            elif frames:
+                seq += len(frames)
+                yield "".join(frames)
+            else:
+                yield ": ping\n\n"
+
+    response = app.response_class(stream(), mimetype="text/event-stream")
+    # Слот освобождается при закрытии ответа: и после обрыва соединения,
+    # и если поток так и не начал отдаваться
+    response.call_on_close(market_streams.release)
+    response.headers["Cache-Control"] = "no-cache"
+    # nginx иначе буферизует поток
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route('/api/market/depth')
+def market_depth():
+    try:
+        phone_id = int_arg("phoneId")
+    except ValueError:
+        return error("Некорректный phoneId", 400)
+    if phone_id is None:
+        return jsonify({"ok": True, "models": [
+            {"phone_id": model_id, "best_price": best_price, "count": count}
+            for model_id, best_price, count in game_db.order_book.summary()
+        ]})
     return jsonify({
-        "phones": [
-            {"id": 1, "model": "iPhone 14", "price": 50000},
-            {"id": 2, "model": "Samsung S23", "price": 45000}
-        ]
+        "ok": True,
+        "best_ask": game_db.order_book.best_ask(phone_id),
+        **game_db.order_book.depth(phone_id),
+    })
+
+@app.route('/api/market/candles')
+def market_candles():
+    """Свечи модели (period: 1h, 24h, 7d) из готовых корзин; before — unix time для старых страниц."""
+    try:
+        phone_id = int_arg("phoneId")
+        limit = int_arg("limit", CANDLES_LIMIT)
+        before = int_arg("before")
+    except ValueError:
+        return error("Некорректные параметры", 400)
+    if phone_id is None:
+        return error("Нужен phoneId", 400)
+    try:
+        candles = game_db.get_candles(phone_id, period=request.args.get("period", "1h"), limit=limit, before=before)
+    except ValueError as e:
+        return error(str(e), 400)
+    return jsonify({"ok": True, "candles": candles})
+
+@app.route('/api/market/stats')
+def market_stats():
+    """Последняя цена, VWAP, объём и min/max за 1h/24h/7d — ориентир цены для продавца."""
+    try:
+        phone_id = int_arg("phoneId")
+    except ValueError:
+        return error("Некорректный phoneId", 400)
+    if phone_id is None:
+        return error("Нужен phoneId", 400)
+    return jsonify({"ok": True, "phone_id": phone_id, **game_db.get_trade_stats(phone_id)})
+
+@app.route('/api/market/buy', methods=['POST'])
+def market_buy():
+    data = request.get_json(silent=True) or {}
+    try:
+        listing_id = int(data["listingId"])
+    except (KeyError, TypeError, ValueError):
+        return error("Нужен listingId", 400)
+    buyer = current_user()
+    if not buyer:
+        return error("Пользователь не найден", 404)
+
+    result = game_db.buy_item_from_market(listing_id, buyer["id"])
+    if not result.ok:
+        return jsonify({"ok": False, "error": result.status.value}), PURCHASE_ERROR_CODES[result.status]
+    return jsonify({"ok": True, "newBalance": result.new_balance, "inventoryItemId": result.inventory_item_id})
+
+@app.route('/api/market/sell', methods=['POST'])
+def market_sell():
+    data = request.get_json(silent=True) or {}
+    try:
+        inventory_item_id = int(data["inventoryItemId"])
+        price = int(data["price"])
+    except (KeyError, TypeError, ValueError):
+        return error("Нужны inventoryItemId и price", 400)
+    if price <= 0:
+        return error("Цена должна быть положительной", 400)
+    seller = current_user()
+    if not seller:
+        return error("Пользователь не найден", 404)
+
+    result = game_db.list_item_on_market(seller["id"], inventory_item_id, price)
+    if result.status is ListingStatus.ALREADY_LISTED:
+        return error("Предмет уже выставлен на продажу", 409)
+    if not result.ok:
+        return error("Предмет не найден в инвентаре", 404)
+    return jsonify({"ok": True, "listingId": result.listing_id})
+
+@app.route('/api/cases/open', methods=['POST'])
+def open_cases():
+    data = request.get_json(silent=True) or {}
+    try:
+        case_id = int(data["caseId"])
+        count = int(data.get("count", 1))
+    except (KeyError, TypeError, ValueError):
+        return error("Нужен caseId", 400)
+    if not 1 <= count <= MAX_BULK_OPEN:
+        return error(f"count должен быть от 1 до {MAX_BULK_OPEN}", 400)
+
+    user = current_user()
+    if not user:
+        return error("Пользователь не найден", 404)
+    result = game_db.open_cases(user["id"], case_id, count)
+    if result is None:
+        return error("Кейс не найден или недостаточно сигналов", 409)
+
+    prizes = [{**phone_payload(prize), "count": prize["count"]} for prize in result["prizes"]]
+    return jsonify({
+        "ok": True,
+        "newBalance": result["new_balance"],
+        # Самый ценный приз показывается в модальном окне, остальное — списком
+        "prize": max(prizes, key=lambda prize: prize["value"] or 0),
+        "prizes": prizes,
+        "rolls": result["rolls"],
     })
@@ -13,11 +13,9 @@ class ApiService {
         const now = Date.now();
         
         // Return cached data if available and fresh
-        if (useCache && this.cache.has(cacheKey)) {
-            const { data, timestamp } = this.cache.get(cacheKey);
-            if (now - timestamp < this.cacheTTL) {
-                return data;
-            }
+        const cached = useCache ? this.cache.get(cacheKey) : undefined;
+        if (cached && now - cached.timestamp < this.cacheTTL) {
+            return cached.data;
         }
 
         // Return pending promise if request is in progress
@@ -26,20 +24,26 @@ class ApiService {
         }
 
         try {
-            const request = fetch(`${this.baseUrl}${endpoint}`)
+            // Stale entry with an ETag: revalidate, the server answers 304 without a body
+            const headers = cached && cached.etag ? { 'If-None-Match': cached.etag } : {};
+            const request = fetch(`${this.baseUrl}${endpoint}`, { headers })
                 .then(response => {
+                    if (response.status === 304 && cached) {
+                        cached.timestamp = now;
+                        return cached.data;
+                    }
                     if (!response.ok) {
                         throw new Error(`HTTP error! status: ${response.status}`);
                     }
-                    return response.json();
-                })
-                .then(data => {
-                    // Cache the response
-                    this.cache.set(cacheKey, {
-                        data,
-                        timestamp: now
+                    return response.json().then(data => {
+                        // Cache the response
+                        this.cache.set(cacheKey, {
+                            data,
+                            etag: response.headers.get('ETag'),
+                            timestamp: now
+                        });
+                        return data;
                     });
-                    return data;
                 })
                 .finally(() => {
                     // Clean up pending request
@@ -78,6 +82,15 @@ class ApiService {
         }
     }
 
+    // Server-Sent Events stream; the browser reconnects by itself and resumes from Last-Event-ID
+    subscribe(endpoint, handlers) {
+        const source = new EventSource(`${this.baseUrl}${endpoint}`);
+        Object.entries(handlers).forEach(([event, handler]) => {
+            source.addEventListener(event, message => handler(JSON.parse(message.data)));
+        });
+        return source;
+    }
+
     // Clear specific cache entry
     clearCache(endpoint) {
         const cacheKey = `GET:${endpoint}`;
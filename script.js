@@ -26,6 +26,12 @@ const state = {
     },
     cases: [],
     marketItems: [],
+    marketCursor: null,
+    marketSeq: null,
+    inventoryTotal: 0,
+    sellItems: [],
+    sellCursor: null,
+    myListings: [],
     isLoading: false,
     currentPage: 'home'
 };
@@ -265,7 +271,14 @@ const UI = {
                         utils.createElement('button', {
                             class: 'btn open-case-btn',
                             'data-case-id': caseItem.id,
+                            'data-count': 1,
                             text: 'Открыть'
+                        }),
+                        utils.createElement('button', {
+                            class: 'btn open-case-btn',
+                            'data-case-id': caseItem.id,
+                            'data-count': 10,
+                            text: 'Открыть x10'
                         })
                     ])
                 ]);
@@ -279,6 +292,9 @@ const UI = {
     },
     
     async loadInventoryPage(containerId = 'inventory-list') {
+        // Для продажи нужны отдельные экземпляры, для просмотра — сводка по моделям
+        if (containerId === 'sell-phone-list') return this.loadSellItems();
+        
         const inventoryList = document.getElementById(containerId);
         if (!inventoryList) return;
         
@@ -286,13 +302,14 @@ const UI = {
             // Показываем загрузку
             inventoryList.innerHTML = '<div class="loading-state"><div class="loading-spinner"><div class="spinner"></div><p>Загрузка...</p></div></div>';
             
-            // Загружаем инвентарь
-            const response = await apiService.get(`/inventory?userId=${state.user.id}`);
-            console.log("Inventory response:", JSON.stringify(response, null, 2));
-            if (response.ok && response.inventory) {
-                state.user.inventory = Array.isArray(response.inventory) ? response.inventory : response.inventory.inventory || [];
+            // Загружаем инвентарь: одна карточка на модель с количеством
+            const response = await apiService.get(`/inventory?mode=grouped`);
+            if (response.ok && response.models) {
+                state.user.inventory = response.models;
+                state.inventoryTotal = response.totalCount;
             } else {
                state.user.inventory = [];
+               state.inventoryTotal = 0;
             }
             
             inventoryList.innerHTML = '';
@@ -319,11 +336,12 @@ const UI = {
                         })
                     ]),
                     utils.createElement('div', { class: 'phone-info' }, [
-                        utils.createElement('h4', { text: phone.name }),
+                        utils.createElement('h4', { text: phone.count > 1 ? `${phone.name} ×${phone.count}` : phone.name }),
                         utils.createElement('p', { text: utils.getRarityName(phone.rarity || 'common') })
                     ]),
                     utils.createElement('div', { class: 'phone-actions' }, [
-                        utils.createElement('button', {
+                        // id is null when every copy of the model is already on the market
+                        phone.id != null && utils.createElement('button', {
                             class: 'btn btn-sell',
                             'data-inventory-id': phone.id,
                             text: 'Продать'
@@ -339,6 +357,80 @@ const UI = {
         }
     },
     
+    async loadSellItems() {
+        const sellList = document.getElementById('sell-phone-list');
+        if (!sellList) return;
+        
+        try {
+            sellList.innerHTML = '<div class="loading-state"><div class="loading-spinner"><div class="spinner"></div><p>Загрузка...</p></div></div>';
+            const response = await apiService.get(`/inventory?mode=items`, false);
+            state.sellItems = response.items || [];
+            state.sellCursor = response.next_cursor || null;
+            this.renderSellItems();
+        } catch (error) {
+            console.error('Ошибка загрузки инвентаря:', error);
+            sellList.innerHTML = '<div class="error-state"><p>Не удалось загрузить инвентарь</p></div>';
+        }
+    },
+    
+    async loadMoreSellItems() {
+        if (!state.sellCursor) return;
+        
+        try {
+            const cursor = encodeURIComponent(state.sellCursor);
+            const response = await apiService.get(`/inventory?mode=items&cursor=${cursor}`, false);
+            state.sellItems = state.sellItems.concat(response.items || []);
+            state.sellCursor = response.next_cursor || null;
+            this.renderSellItems();
+        } catch (error) {
+            console.error('Ошибка загрузки инвентаря:', error);
+            utils.showNotification('Не удалось загрузить инвентарь', 'error');
+        }
+    },
+    
+    renderSellItems() {
+        const sellList = document.getElementById('sell-phone-list');
+        if (!sellList) return;
+        
+        sellList.innerHTML = '';
+        if (state.sellItems.length === 0) {
+            sellList.innerHTML = '<div class="empty-state"><p>Нечего продавать</p></div>';
+            return;
+        }
+        
+        state.sellItems.forEach(phone => {
+            sellList.appendChild(utils.createElement('div', {
+                class: `phone-card rarity-${phone.rarity || 'common'}`
+            }, [
+                utils.createElement('div', { class: 'phone-icon' }, [
+                    utils.createElement('img', {
+                        src: phone.image || 'https://via.placeholder.com/84?text=Phone',
+                        alt: phone.name
+                    })
+                ]),
+                utils.createElement('div', { class: 'phone-info' }, [
+                    utils.createElement('h4', { text: phone.name }),
+                    utils.createElement('p', { text: utils.getRarityName(phone.rarity || 'common') })
+                ]),
+                utils.createElement('div', { class: 'phone-actions' }, [
+                    utils.createElement('button', {
+                        class: 'btn btn-sell',
+                        'data-inventory-id': phone.id,
+                        text: 'Продать'
+                    })
+                ])
+            ]));
+        });
+        
+        if (state.sellCursor) {
+            sellList.appendChild(utils.createElement('button', {
+                class: 'btn btn-load-more',
+                'data-list': 'sell',
+                text: 'Показать ещё'
+            }));
+        }
+    },
+    
     async loadMarketPage() {
         const marketItems = document.getElementById('market-items');
         if (!marketItems) return;
@@ -346,28 +438,38 @@ const UI = {
         try {
             marketItems.innerHTML = '<div class="loading-spinner"><div class="spinner"></div><p>Загрузка маркета...</p></div>';
             
-            const response = await apiService.get('/market');
+            // Свои лоты отфильтровывает сервер, страница приходит с курсором
+            const response = await apiService.get(`/market?excludeSeller=${state.user.id}`, false);
             state.marketItems = response.items || [];
+            state.marketCursor = response.next_cursor || null;
+            state.marketSeq = response.seq ?? null;
             
             this.renderMarketItems('buy');
+            MarketFeed.connect();
         } catch (error) {
             console.error('Ошибка загрузки маркета:', error);
             marketItems.innerHTML = '<div class="error-state"><p>Не удалось загрузить маркет</p></div>';
         }
     },
     
+    async loadMyListings() {
+        try {
+            const response = await apiService.get(`/market?seller=${state.user.id}`, false);
+            state.myListings = response.items || [];
+        } catch (error) {
+            console.error('Ошибка загрузки своих лотов:', error);
+            state.myListings = [];
+        }
+        this.renderMarketItems('my-listings');
+    },
+    
     renderMarketItems(tab) {
        const container = document.getElementById(`${tab}-items`);
        if (!container) return;
        
        container.innerHTML = '';
        
-       let itemsToRender = [];
-       if (tab === 'buy') {
-           itemsToRender = state.marketItems.filter(item => item.seller_id !== state.user.id);
-       } else if (tab === 'my-listings') {
-           itemsToRender = state.marketItems.filter(item => item.seller_id === state.user.id);
-       }
+       const itemsToRender = tab === 'my-listings' ? state.myListings : state.marketItems;
 
        if (itemsToRender.length === 0) {
            container.innerHTML = `<div class="empty-state"><p>Здесь пока пусто</p></div>`;
@@ -409,21 +511,43 @@ const UI = {
            ]);
            container.appendChild(itemCard);
        });
+
+       if (tab === 'buy' && state.marketCursor) {
+           container.appendChild(utils.createElement('button', {
+               class: 'btn btn-load-more',
+               text: 'Показать ещё'
+           }));
+       }
    },
     
+    async loadMoreMarketItems() {
+        if (!state.marketCursor) return;
+        
+        try {
+            const cursor = encodeURIComponent(state.marketCursor);
+            const response = await apiService.get(`/market?excludeSeller=${state.user.id}&cursor=${cursor}`, false);
+            state.marketItems = state.marketItems.concat(response.items || []);
+            state.marketCursor = response.next_cursor || null;
+            this.renderMarketItems('buy');
+        } catch (error) {
+            console.error('Ошибка загрузки маркета:', error);
+            utils.showNotification('Не удалось загрузить лоты', 'error');
+        }
+    },
+    
     async loadProfilePage() {
         const username = document.getElementById('username');
         const totalPhones = document.getElementById('total-phones');
         const totalCases = document.getElementById('total-cases');
         
         if (username) username.textContent = state.user.firstName;
-        if (totalPhones) totalPhones.textContent = state.user.inventory.length;
-        if (totalCases) totalCases.textContent = state.user.inventory.length;
+        if (totalPhones) totalPhones.textContent = state.inventoryTotal;
+        if (totalCases) totalCases.textContent = state.inventoryTotal;
         
         this.updateUserAvatar();
     },
     
-    showCaseResult(prize) {
+    showCaseResult(prize, prizes = [prize]) {
         if (!elements.caseResultModal) return;
         
         const prizeImage = elements.caseResultModal.querySelector('#result-phone-img');
@@ -432,7 +556,12 @@ const UI = {
         const prizeAnimation = elements.caseResultModal.querySelector('.prize-animation');
         
         if (prizeImage) prizeImage.src = prize.image;
-        if (prizeName) prizeName.textContent = prize.name;
+        const totalPrizes = prizes.reduce((sum, p) => sum + (p.count || 1), 0);
+        if (prizeName) {
+            prizeName.textContent = totalPrizes > 1
+                ? `${prize.name} (всего телефонов: ${totalPrizes})`
+                : prize.name;
+        }
         if (prizeRarity) {
             prizeRarity.textContent = utils.getRarityName(prize.rarity);
             prizeRarity.className = `prize-rarity rarity-${prize.rarity}`;
@@ -508,6 +637,18 @@ const EventHandlers = {
             return;
         }
         
+        // Следующая страница маркета
+        const loadMoreBtn = e.target.closest('.btn-load-more');
+        if (loadMoreBtn) {
+            e.preventDefault();
+            if (loadMoreBtn.dataset.list === 'sell') {
+                UI.loadMoreSellItems();
+            } else {
+                UI.loadMoreMarketItems();
+            }
+            return;
+        }
+        
         // Переключение вкладок маркета
         const tabBtn = e.target.closest('.tab-btn');
         if (tabBtn) {
@@ -537,14 +678,16 @@ const EventHandlers = {
         if (state.isLoading) return;
         
         const caseId = parseInt(button.dataset.caseId);
+        const count = parseInt(button.dataset.count || '1');
         const caseItem = state.cases.find(c => c.id === caseId);
+        const buttonText = button.textContent;
         
         if (!caseItem) {
             utils.showNotification('Кейс не найден', 'error');
             return;
         }
         
-        if (state.user.signals < caseItem.price) {
+        if (state.user.signals < caseItem.price * count) {
             utils.showNotification('Недостаточно сигналов', 'error');
             soundManager.play('error');
             return;
@@ -558,16 +701,18 @@ const EventHandlers = {
             // Звук открытия
             soundManager.play('openCase');
             
-            const response = await apiService.post('/cases/open', { caseId });
+            // Массовое открытие — один запрос и одна транзакция на сервере
+            const response = await apiService.post('/cases/open', { caseId, count });
             
             if (response.ok && response.prize) {
                 // Обновляем состояние
                 state.user.signals = response.newBalance;
-                state.user.inventory.push(response.prize);
+                state.inventoryTotal += count;
+                apiService.clearCache(`/inventory?mode=grouped`);
                 
                 // Обновляем UI
                 UI.updateBalance();
-                UI.showCaseResult(response.prize);
+                UI.showCaseResult(response.prize, response.prizes);
                 
                 utils.showNotification(`Получен: ${response.prize.name}!`, 'success');
             }
@@ -577,7 +722,7 @@ const EventHandlers = {
         } finally {
             state.isLoading = false;
             button.disabled = false;
-            button.textContent = 'Открыть';
+            button.textContent = buttonText;
         }
     },
     
@@ -600,13 +745,15 @@ const EventHandlers = {
             button.disabled = true;
             button.textContent = 'Покупаем...';
 
-            const response = await apiService.post('/market/buy', { listingId: item.id, userId: state.user.id });
+            const response = await apiService.post('/market/buy', { listingId: item.id });
 
             if (response.ok) {
                 utils.showNotification('Телефон успешно куплен!', 'success');
                 state.user.signals = response.newBalance;
+                apiService.clearCache(`/inventory?mode=grouped`);
                 UI.updateBalance();
-                UI.loadMarketPage();
+                // Остальным покупателям лот уберёт лента, себе — сразу
+                MarketFeed.dropListing(item.id);
                 UI.loadInventoryPage();
             }
         } catch (error) {
@@ -620,10 +767,8 @@ const EventHandlers = {
     },
 
    handleSellItem(button) {
-       const inventoryId = button.dataset.inventoryId;
-       console.log("Trying to sell item with inventoryId:", inventoryId);
-       console.log("Current inventory:", state.user.inventory);
-       const item = state.user.inventory.find(i => i.id === inventoryId);
+       const inventoryId = parseInt(button.dataset.inventoryId);
+       const item = state.user.inventory.concat(state.sellItems).find(i => i.id === inventoryId);
        
        if (!item) {
            utils.showNotification('Предмет не найден в инвентаре', 'error');
@@ -647,15 +792,14 @@ const EventHandlers = {
            try {
                const response = await apiService.post('/market/sell', {
                    inventoryItemId: item.id,
-                   userId: state.user.id,
                    price: price
                });
 
                if (response.ok) {
                    utils.showNotification('Телефон выставлен на продажу!', 'success');
                    modal.classList.remove('active');
+                   apiService.clearCache(`/inventory?mode=grouped`);
                    UI.loadInventoryPage(); // Обновляем инвентарь
-                   UI.loadMarketPage(); // Обновляем маркет
                }
            } catch (error) {
                utils.showNotification(error.message || 'Не удалось выставить на продажу', 'error');
@@ -683,11 +827,72 @@ const EventHandlers = {
             // UI для продажи уже в инвентаре
             UI.loadInventoryPage('sell-phone-list');
         } else if (tabId === 'my-sales') {
-            UI.renderMarketItems('my-listings');
+            UI.loadMyListings();
         }
     }
 };
 
+// ======================
+// Лента изменений рынка (SSE)
+// ======================
+// Вместо перезагрузки списка сервер присылает события added / removed / sold,
+// они применяются к state.marketItems и state.myListings
+const MarketFeed = {
+    source: null,
+    renderScheduled: false,
+
+    connect() {
+        if (this.source || state.marketSeq === null || typeof EventSource === 'undefined') return;
+        this.source = apiService.subscribe(`/market/events?since=${state.marketSeq}`, {
+            added: event => this.applyAdded(event),
+            removed: event => this.applyGone(event),
+            sold: event => this.applyGone(event),
+            // Сервер уже не помнит пропущенные события — перечитываем рынок
+            reset: () => UI.loadMarketPage()
+        });
+    },
+
+    applyAdded(event) {
+        state.marketSeq = event.seq;
+        const { seq, kind, ...listing } = event;
+        if (listing.seller_id === state.user.id) {
+            if (!state.myListings.some(i => i.id === listing.id)) state.myListings.unshift(listing);
+        } else if (!state.marketItems.some(i => i.id === listing.id)) {
+            // Новый лот — самый свежий, его место в начале ленты
+            state.marketItems.unshift(listing);
+        }
+        this.scheduleRender();
+    },
+
+    applyGone(event) {
+        state.marketSeq = event.seq;
+        if (event.kind === 'sold' && event.seller_id === state.user.id) {
+            utils.showNotification(`Ваш ${event.name} продан за ${event.price_signals}`, 'success');
+        }
+        this.dropListing(event.id);
+    },
+
+    dropListing(listingId) {
+        state.marketItems = state.marketItems.filter(i => i.id !== listingId);
+        state.myListings = state.myListings.filter(i => i.id !== listingId);
+        this.scheduleRender();
+    },
+
+    // Пачка событий перерисовывает список один раз
+    scheduleRender() {
+        if (this.renderScheduled) return;
+        this.renderScheduled = true;
+        requestAnimationFrame(() => {
+            this.renderScheduled = false;
+            if (state.currentPage !== 'market') return;
+            UI.renderMarketItems('buy');
+            if (document.getElementById('my-sales-tab')?.classList.contains('active')) {
+                UI.renderMarketItems('my-listings');
+            }
+        });
+    }
+};
+
 // ======================
 // Инициализация Telegram WebApp
 // ======================
@@ -729,7 +934,7 @@ function initTelegramWebApp() {
 // ======================
 async function loadUserData() {
     try {
-        const response = await apiService.get('/user');
+        const response = await apiService.get('/user', false);
         if (response.ok && response.user) {
             state.user = {
                 ...state.user,
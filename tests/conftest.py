@@ -0,0 +1,50 @@
+# tests/conftest.py
+# config.py и utils/database.py читают окружение при импорте и создании, поэтому
+# оно задаётся до импорта модулей проекта: одна временная БД на весь прогон
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.update(
+    TELEGRAM_BOT_TOKEN="test",
+    DATABASE_PATH=os.path.join(tempfile.mkdtemp(), "game_database.db"),
+    DB_SHARDS="1",
+)
+
+import asyncio  # noqa: E402
+import json  # noqa: E402
+import time  # noqa: E402
+
+import pytest  # noqa: E402
+
+from utils.webapp_auth import INIT_DATA_HEADER, sign_init_data  # noqa: E402
+
+
+@pytest.fixture
+def auth_headers():
+    """Заголовки запроса к /api от имени игрока: initData, подписанная тестовым токеном бота."""
+    def headers(telegram_id, auth_date=None):
+        fields = {
+            "auth_date": str(int(time.time()) if auth_date is None else auth_date),
+            "user": json.dumps({"id": telegram_id, "first_name": "Тест"}),
+        }
+        return {INIT_DATA_HEADER: sign_init_data(fields, os.environ["TELEGRAM_BOT_TOKEN"])}
+    return headers
+
+
+@pytest.fixture
+def create_players():
+    """Создаёт игроков через слой бота (со стартовым набором); каталог заполняется при первом вызове."""
+    import database as db
+
+    async def create(telegram_ids):
+        await db.init_db()
+        await db.populate_initial_data()
+        try:
+            return [await db.create_user_if_not_exists(telegram_id) for telegram_id in telegram_ids]
+        finally:
+            await db.close_pool()
+    return lambda *telegram_ids: asyncio.run(create(telegram_ids))
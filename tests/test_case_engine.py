@@ -0,0 +1,97 @@
+# tests/test_case_engine.py
+# Розыгрыш alias-таблицей: частоты совпадают с шансами, шансы нормализуются,
+# таблицы перестраиваются вместе с версией каталога
+import math
+import random
+from collections import Counter
+
+import pytest
+
+from utils.case_engine import AliasTable, CaseEngine
+from utils.catalog import build_snapshot
+
+DRAWS = 200_000
+# Квантиль 0.999 стандартного нормального: тест с фиксированным зерном не "мигает"
+Z_999 = 3.0902
+
+
+def chi_square_critical(df, z=Z_999):
+    # Аппроксимация Уилсона-Хилферти (как в benchmarks/bench_cases.py)
+    h = 2 / (9 * df)
+    return df * (1 - h + z * math.sqrt(h)) ** 3
+
+
+def exact_probabilities(table, key=lambda outcome: outcome):
+    """Вероятности исходов, заложенные в prob/alias, без розыгрыша."""
+    n = len(table.prob)
+    result = Counter()
+    for i, prob in enumerate(table.prob):
+        result[key(table.outcomes[i])] += prob / n
+        result[key(table.outcomes[table.alias[i]])] += (1 - prob) / n
+    return result
+
+
+@pytest.mark.parametrize("weights", [
+    [0.8, 0.05],  # "Базовый кейс": сумма 0.85
+    [0.5, 0.3, 0.15, 0.05],
+    [1e-3, 0.2, 0.2, 0.599],
+    [random.Random(7).random() for _ in range(200)],
+], ids=["basic", "four", "rare", "200"])
+def test_draw_frequencies_match_chances(weights):
+    table = AliasTable(range(len(weights)), weights)
+    total = sum(weights)
+    for outcome, probability in exact_probabilities(table).items():
+        assert probability == pytest.approx(weights[outcome] / total, abs=1e-12)
+
+    counts = Counter(table.draw_many(DRAWS, random.Random(42)))
+    stat = sum((counts[outcome] - DRAWS * weight / total) ** 2 / (DRAWS * weight / total)
+               for outcome, weight in enumerate(weights))
+    assert stat < chi_square_critical(len(weights) - 1)
+
+    # draw() и draw_many() дают одинаковые результаты при одном зерне
+    single = random.Random(1)
+    assert [table.draw(single) for _ in range(100)] == table.draw_many(100, random.Random(1))
+
+
+def test_chances_below_one_are_normalized():
+    table = AliasTable(["A01", "Pixel"], [0.8, 0.05])
+    probabilities = exact_probabilities(table)
+    assert probabilities["A01"] == pytest.approx(0.8 / 0.85)
+    assert probabilities["Pixel"] == pytest.approx(0.05 / 0.85)
+    assert sum(probabilities.values()) == pytest.approx(1.0)
+
+
+def test_invalid_weights_are_rejected():
+    for outcomes, weights in (([], []), ([1], [0]), ([1, 2], [1, -1]), ([1, 2], [1])):
+        with pytest.raises(ValueError):
+            AliasTable(outcomes, weights)
+
+
+def _snapshot(version, pixel_chance):
+    phones = [
+        {"id": 1, "name": "A01", "rarity": "common", "value": 10, "image_filename": None},
+        {"id": 2, "name": "Pixel", "rarity": "legendary", "value": 500, "image_filename": None},
+    ]
+    cases = [{"id": 1, "name": "Базовый кейс", "price_signals": 50}]
+    contents = [
+        {"case_id": 1, "phone_id": 1, "chance": 0.8},
+        {"case_id": 1, "phone_id": 2, "chance": pixel_chance},
+    ]
+    return build_snapshot(version, phones, cases, contents)
+
+
+def test_tables_are_rebuilt_when_catalog_version_changes():
+    engine = CaseEngine()
+    first = engine.build_from_catalog(_snapshot(1, 0.05), 1)
+    assert engine.get(1) is first
+    assert engine.build_from_catalog(_snapshot(1, 0.05), 99) is None
+
+    engine.sync_version(1)
+    assert engine.get(1) is first
+    engine.sync_version(2)
+    assert engine.get(1) is None
+
+    rebuilt = engine.build_from_catalog(_snapshot(2, 0.2), 1)
+    assert rebuilt is not first and engine.get(1) is rebuilt
+    probabilities = exact_probabilities(rebuilt.table, key=lambda phone: phone["phone_id"])
+    assert probabilities[2] == pytest.approx(0.2 / 1.0)
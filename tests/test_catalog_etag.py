@@ -0,0 +1,55 @@
+# tests/test_catalog_etag.py
+# /api/cases и /api/catalog: совпавший If-None-Match получает 304 без тела,
+# правка каталога меняет ETag
+import sqlite3
+
+import pytest
+
+import index
+from utils.database import GameDatabase
+
+TELEGRAM_ID = 670_001
+
+
+@pytest.fixture
+def catalog_db(tmp_path, monkeypatch):
+    """Отдельная БД с одним кейсом: правки каталога не задевают остальные тесты."""
+    path = str(tmp_path / "catalog.db")
+    monkeypatch.setenv("DATABASE_PATH", path)
+    game_db = GameDatabase()
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("INSERT INTO phones (id, name, brand, value) VALUES (1, 'A01', 'Samsung', 10)")
+        conn.execute("INSERT INTO cases (id, name, price_signals) VALUES (1, 'Базовый', 50)")
+        conn.execute("INSERT INTO case_contents (case_id, phone_id, chance) VALUES (1, 1, 1.0)")
+    monkeypatch.setattr(index, "game_db", game_db)
+    yield game_db, conn
+    conn.close()
+    game_db.close()
+
+
+@pytest.mark.parametrize("url", ["/api/cases", "/api/catalog"])
+def test_catalog_etag(catalog_db, auth_headers, url):
+    game_db, conn = catalog_db
+    client = index.app.test_client()
+    headers = auth_headers(TELEGRAM_ID)
+
+    first = client.get(url, headers=headers)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    cached = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.data == b"" and cached.headers["ETag"] == etag
+    assert client.get(url, headers={**headers, "If-None-Match": '"other"'}).status_code == 200
+
+    # Правка каталога поднимает версию (триггеры), новый снимок — новый ETag
+    with conn:
+        conn.execute("UPDATE cases SET price_signals = 60 WHERE id = 1")
+    game_db.catalog.invalidate()
+    edited = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert edited.status_code == 200
+    assert edited.headers["ETag"] != etag
+    assert edited.get_json() != first.get_json()
+    assert client.get(url, headers={**headers, "If-None-Match": edited.headers["ETag"]}).status_code == 304
@@ -0,0 +1,100 @@
+# tests/test_catalog_import.py
+# Импорт каталога: повтор ничего не меняет, ошибка откатывает всё,
+# update_existing=False не трогает существующее, лишние позиции кейса удаляются
+import sqlite3
+
+import pytest
+
+from utils.catalog_import import CatalogImportError, import_catalog
+from utils.schema import CREATE_INDEXES_SQL, CREATE_TABLES_SQL, CREATE_TRIGGERS_SQL
+
+PHONES = [
+    {"name": "A01", "brand": "Samsung", "rarity": "common", "value": "10"},
+    {"name": "Pixel", "brand": "Google", "rarity": "Legendary", "value": "500"},
+    {"name": "Redmi", "brand": "Xiaomi", "rarity": "Rare", "value": "50"},
+]
+CASES = [{"name": "Базовый", "price_signals": "50"}, {"name": "Премиум", "price_signals": "300"}]
+CONTENTS = [
+    {"case": "Базовый", "phone": "A01", "chance": "0.8"},
+    {"case": "Базовый", "phone": "Redmi", "chance": "0.15"},
+    {"case": "Базовый", "phone": "Pixel", "chance": "0.05"},
+    {"case": "Премиум", "phone": "Redmi", "chance": "0.7"},
+    {"case": "Премиум", "phone": "Pixel", "chance": "0.3"},
+]
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    conn.executescript(CREATE_TABLES_SQL + CREATE_INDEXES_SQL + CREATE_TRIGGERS_SQL)
+    import_catalog(conn, PHONES, CASES, CONTENTS)
+    yield conn
+    conn.close()
+
+
+def _catalog(conn):
+    return (
+        conn.execute("SELECT name, brand, rarity, value FROM phones ORDER BY name").fetchall(),
+        conn.execute("SELECT name, price_signals FROM cases ORDER BY name").fetchall(),
+        conn.execute(
+            "SELECT c.name, p.name, cc.chance FROM case_contents cc"
+            " JOIN cases c ON c.id = cc.case_id JOIN phones p ON p.id = cc.phone_id ORDER BY 1, 2"
+        ).fetchall(),
+    )
+
+
+def test_repeated_import_changes_nothing(conn):
+    before = _catalog(conn)
+    report = import_catalog(conn, PHONES, CASES, CONTENTS)
+    assert not report.changed
+    assert report.unchanged == {"phones": 3, "cases": 2, "case_contents": 5}
+    assert _catalog(conn) == before
+
+
+def test_bad_row_rolls_back_whole_import(conn):
+    before = _catalog(conn)
+    phones = PHONES + [{"name": "New", "brand": "Nokia", "value": "20"}, {"name": "Broken", "brand": "X", "value": "-1"}]
+    cases = [{"name": "Базовый", "price_signals": "70"}]
+    with pytest.raises(CatalogImportError) as raised:
+        import_catalog(conn, phones, cases)
+    assert raised.value.total == 1
+    assert "phones:5" in raised.value.errors[0]
+    assert _catalog(conn) == before
+    assert not conn.in_transaction
+
+
+def test_chances_above_one_are_rejected(conn):
+    before = _catalog(conn)
+    contents = [dict(row, chance="0.9") if row["phone"] == "A01" else row for row in CONTENTS]
+    with pytest.raises(CatalogImportError, match="сумма шансов 1.100000 больше 1"):
+        import_catalog(conn, contents=contents)
+    assert _catalog(conn) == before
+
+
+def test_only_new_keeps_existing_rows(conn):
+    phones = [dict(PHONES[0], value="999"), {"name": "New", "brand": "Nokia", "value": "20"}]
+    cases = [{"name": "Базовый", "price_signals": "1"}]
+    contents = [{"case": "Базовый", "phone": "A01", "chance": "0.5"}]
+    report = import_catalog(conn, phones, cases, contents, update_existing=False)
+    assert report.added["phones"] == 1 and not any(report.updated.values()) and not any(report.removed.values())
+
+    phone_rows, case_rows, content_rows = _catalog(conn)
+    assert ("A01", "Samsung", "Common", 10) in phone_rows
+    assert ("New", "Nokia", "Common", 20) in phone_rows
+    assert ("Базовый", 50) in case_rows
+    assert ("Базовый", "A01", 0.8) in content_rows
+    assert len(content_rows) == len(CONTENTS)  # позиции, которых нет в файле, не удалены
+
+
+def test_missing_contents_are_removed_only_from_touched_cases(conn):
+    # Redmi и Pixel больше нет в "Базовом"; "Премиум" в файле не упомянут
+    contents = [{"case": "Базовый", "phone": "A01", "chance": "1"}]
+    report = import_catalog(conn, contents=contents)
+    assert report.removed == {"case_contents": 2}
+    assert report.updated["case_contents"] == 1
+    _phones, _cases, content_rows = _catalog(conn)
+    assert content_rows == [
+        ("Базовый", "A01", 1.0),
+        ("Премиум", "Pixel", 0.3),
+        ("Премиум", "Redmi", 0.7),
+    ]
@@ -0,0 +1,85 @@
+# tests/test_inventory.py
+# /api/inventory: сводка по моделям отдаёт невыставленный экземпляр,
+# постраничный список проходит весь инвентарь по курсору без пропусков и повторов
+import asyncio
+import os
+import sqlite3
+
+import pytest
+
+import database as db
+import index
+
+TELEGRAM_ID = 640_001
+
+
+@pytest.fixture
+def player(create_players):
+    user, = create_players(TELEGRAM_ID)
+    phone_ids = sorted(index.game_db.get_catalog().phones)[:2]
+    conn = sqlite3.connect(os.environ["DATABASE_PATH"])
+    with conn:
+        conn.executemany("INSERT INTO user_inventory (user_id, phone_id) VALUES (?, ?)",
+                         [(user["id"], phone_ids[0])] * 3 + [(user["id"], phone_ids[1])] * 2)
+    items = conn.execute("SELECT id, phone_id FROM user_inventory WHERE user_id = ? ORDER BY phone_id, id",
+                         (user["id"],)).fetchall()
+    conn.close()
+    return user, phone_ids, items
+
+
+async def _remove_listings(listing_ids):
+    # БД общая на прогон: лоты не должны остаться на рынке для других тестов
+    await db.init_db()
+    try:
+        for listing_id in listing_ids:
+            await db.remove_item_from_market(listing_id)
+    finally:
+        await db.close_pool()
+
+
+def _get(auth_headers, query):
+    response = index.app.test_client().get(f"/api/inventory?{query}", headers=auth_headers(TELEGRAM_ID))
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_grouped_points_at_unlisted_copy(player, auth_headers):
+    user, (first, second), items = player
+    copies = {phone_id: [item_id for item_id, model in items if model == phone_id] for phone_id in (first, second)}
+    # Младший экземпляр первой модели и все экземпляры второй — на рынке
+    listing_ids = []
+    try:
+        for item_id in copies[first][:1] + copies[second]:
+            listing = index.game_db.list_item_on_market(user["id"], item_id, 100)
+            assert listing.ok
+            listing_ids.append(listing.listing_id)
+
+        models = {model["phone_id"]: model for model in _get(auth_headers, "mode=grouped")["models"]}
+        assert models[first]["count"] == len(copies[first])
+        assert models[first]["id"] == copies[first][1]
+        assert models[second]["count"] == 2
+        assert models[second]["id"] is None
+    finally:
+        asyncio.run(_remove_listings(listing_ids))
+
+
+def test_items_cursor_walks_whole_inventory(player, auth_headers):
+    _user, (first, _second), items = player
+    seen, cursor = [], None
+    while True:
+        page = _get(auth_headers, "mode=items&limit=2" + (f"&cursor={cursor}" if cursor else ""))
+        assert len(page["items"]) <= 2
+        seen.extend((item["id"], item["phone_id"]) for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [tuple(item) for item in items]
+
+    only_first = _get(auth_headers, f"mode=items&phoneId={first}")["items"]
+    assert [item["id"] for item in only_first] == [item_id for item_id, model in items if model == first]
+
+
+def test_bad_cursor_is_rejected(player, auth_headers):
+    response = index.app.test_client().get("/api/inventory?mode=items&cursor=garbage",
+                                           headers=auth_headers(TELEGRAM_ID))
+    assert response.status_code == 400
@@ -0,0 +1,45 @@
+# tests/test_market_events.py
+# Подписчики SSE сверх лимита получают 503, а закрытый поток освобождает слот;
+# клиент с seq впереди ленты получает reset
+import threading
+
+import index
+from utils.market_feed import MarketFeed, format_reset
+
+
+def test_market_streams_are_capped(monkeypatch, auth_headers):
+    monkeypatch.setattr(index, "market_streams", threading.BoundedSemaphore(1))
+    client = index.app.test_client()
+    headers = auth_headers(620_001)
+
+    first = client.get("/api/market/events", headers=headers, buffered=False)
+    assert first.status_code == 200
+    rejected = client.get("/api/market/events", headers=headers)
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"]
+
+    first.close()
+    second = client.get("/api/market/events", headers=headers, buffered=False)
+    assert second.status_code == 200
+    second.close()
+
+
+def test_seq_ahead_of_feed_gets_reset():
+    feed = MarketFeed(head=5)
+    feed.publish([{"seq": 6, "kind": "added"}, {"seq": 7, "kind": "removed"}])
+    assert len(feed.frames_after(5)) == 2
+    assert feed.frames_after(7) == []
+    # Клиент пришёл с seq, которого лента ещё не выдавала: reset сразу, без ожидания
+    assert feed.frames_after(100) is None
+    assert feed.wait(100, timeout=5) is None
+
+
+def test_stream_resets_client_ahead_of_feed(auth_headers):
+    client = index.app.test_client()
+    head = index.game_db.get_market_feed().head
+    response = client.get("/api/market/events", headers={**auth_headers(620_001), "Last-Event-ID": str(head + 1000)},
+                          buffered=False)
+    chunks = response.response
+    assert next(chunks) == b"retry: 3000\n\n"
+    assert next(chunks) == format_reset(head).encode()
+    response.close()
@@ -0,0 +1,73 @@
+# tests/test_market_plans.py
+# Ни одно сочетание фильтров ленты рынка не сортирует во временном B-дереве
+# и не читает таблицу лотов без индекса
+import itertools
+import random
+import sqlite3
+
+import pytest
+
+from utils.market import build_market_listings_query, encode_cursor
+from utils.schema import CREATE_INDEXES_SQL, CREATE_TABLES_SQL, CREATE_TRIGGERS_SQL
+
+FILTERS = {
+    "cursor": encode_cursor("2024-01-01 00:00:00", 500),
+    "rarity": "legendary",
+    "brand": "Apple",
+    "phone_id": 3,
+    "min_price": 10,
+    "max_price": 500,
+    "seller_id": 7,
+    "exclude_seller_id": 7,
+}
+
+
+def _database(filled):
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(CREATE_TABLES_SQL + CREATE_INDEXES_SQL + CREATE_TRIGGERS_SQL)
+    if filled:
+        # Перекос как в живой БД: мало редких моделей, у пары продавцов большая часть лотов
+        rng = random.Random(1)
+        brands, rarities = ["Apple", "Samsung", "Xiaomi"], ["common"] * 8 + ["rare", "legendary"]
+        conn.executemany("INSERT INTO phones (id, name, brand, rarity, value) VALUES (?, ?, ?, ?, ?)",
+                         [(i, f"Phone {i}", rng.choice(brands), rng.choice(rarities), i) for i in range(1, 101)])
+        conn.executemany("INSERT INTO users (id, telegram_id) VALUES (?, ?)",
+                         [(i, 1000 + i) for i in range(1, 201)])
+        conn.executemany("INSERT INTO user_inventory (id, user_id, phone_id) VALUES (?, ?, ?)",
+                         [(i, rng.choice([7, 8, rng.randint(1, 200)]), rng.randint(1, 100)) for i in range(1, 5001)])
+        conn.execute(
+            "INSERT INTO market_listings (seller_user_id, inventory_item_id, phone_id, rarity, brand, price_signals,"
+            " listed_at)"
+            " SELECT ui.user_id, ui.id, ui.phone_id, p.rarity, p.brand, ui.id % 1000 + 1,"
+            " datetime('2024-01-01', '+' || ui.id || ' seconds')"
+            " FROM user_inventory ui JOIN phones p ON p.id = ui.phone_id WHERE ui.id % 2 = 0")
+        conn.execute("ANALYZE")
+    return conn
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["empty", "analyzed"])
+def conn(request):
+    conn = _database(request.param)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("join_sellers", [True, False])
+def test_market_filters_use_indexes(conn, join_sellers):
+    for size in range(len(FILTERS) + 1):
+        for names in itertools.combinations(FILTERS, size):
+            sql, params, _ = build_market_listings_query(
+                join_sellers=join_sellers, **{name: FILTERS[name] for name in names})
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            assert not any("USE TEMP B-TREE" in step for step in plan), (names, plan)
+            for step in plan:
+                if step.startswith("SCAN"):
+                    assert "USING COVERING INDEX" in step, (names, plan)
+
+
+def test_listing_follows_phone_attributes(conn):
+    conn.execute("INSERT INTO phones (id, name, brand, rarity, value) VALUES (1000, 'Moved', 'Old', 'common', 1)")
+    conn.execute("INSERT INTO market_listings (seller_user_id, inventory_item_id, phone_id, rarity, brand,"
+                 " price_signals) VALUES (1, 100000, 1000, 'common', 'Old', 5)")
+    conn.execute("UPDATE phones SET brand = 'New', rarity = 'rare' WHERE id = 1000")
+    assert conn.execute("SELECT rarity, brand FROM market_listings WHERE phone_id = 1000").fetchone() == ("rare", "New")
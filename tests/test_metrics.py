@@ -0,0 +1,66 @@
+# tests/test_metrics.py
+import asyncio
+
+import index
+from utils import metrics
+
+
+def _calls(name):
+    prefix = f'db_call_seconds_count{{layer="test",function="{name}"}} '
+    for line in metrics.render().splitlines():
+        if line.startswith(prefix):
+            return int(line[len(prefix):])
+    return 0
+
+
+def test_nested_calls_are_timed_once():
+    inner = metrics.instrument(lambda: 1, "test", "nested_inner")
+    outer = metrics.instrument(lambda: inner() + 1, "test", "nested_outer")
+
+    async def inner_async():
+        return 1
+
+    inner_async = metrics.instrument(inner_async, "test", "nested_inner_async")
+
+    async def outer_async():
+        return await inner_async() + outer()
+
+    outer_async = metrics.instrument(outer_async, "test", "nested_outer_async")
+
+    assert outer() == 2
+    assert asyncio.run(outer_async()) == 3
+    assert _calls("nested_outer_async") == 1
+    assert _calls("nested_outer") == 1  # только прямой вызов, не из outer_async
+    assert _calls("nested_inner") == 0
+    assert _calls("nested_inner_async") == 0
+    inner()
+    assert _calls("nested_inner") == 1
+
+
+def test_metrics_endpoints_need_token(monkeypatch):
+    client = index.app.test_client()
+    for path in ("/metrics", "/metrics/slow-queries"):
+        monkeypatch.setattr(metrics, "TOKEN", "")
+        assert client.get(path, headers={"Authorization": "Bearer "}).status_code == 404
+        monkeypatch.setattr(metrics, "TOKEN", "secret")
+        assert client.get(path).status_code == 401
+        assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 401
+        assert client.get(path, headers={"Authorization": "Bearer secret"}).status_code == 200
+
+
+def test_background_task_from_instrumented_call_is_timed():
+    async def poll():
+        return 1
+
+    poll = metrics.instrument(poll, "test", "background_poll")
+
+    async def warm():
+        inherited = asyncio.ensure_future(poll())
+        detached = metrics.background_task(poll())
+        return await inherited, await detached
+
+    warm = metrics.instrument(warm, "test", "background_warm")
+    assert asyncio.run(warm()) == (1, 1)
+    assert _calls("background_warm") == 1
+    # Унаследовавшая контекст задача не измерена, запущенная через background_task — измерена
+    assert _calls("background_poll") == 1
@@ -0,0 +1,128 @@
+# tests/test_net_worth.py
+# Состояние игрока (signals + inventory_value): триггеры и DEBIT_CASE_PRICE_SQL держат
+# inventory_value равным сумме стоимостей инвентаря, ранги при равенстве общие
+import random
+import sqlite3
+
+import pytest
+
+from utils.case_engine import DEBIT_CASE_PRICE_SQL, prize_phone_ids
+from utils.leaderboard import (
+    EXACT_RANK_LIMIT, NET_WORTH_DISTRIBUTION_SQL, PLAYER_NET_WORTH_SQL, PLAYERS_ABOVE_SQL, TOP_PLAYERS_SQL,
+    build_rank_snapshot, player_rank, rank_top_players,
+)
+from utils.market import CREDIT_SELLER_SQL, DEBIT_BUYER_SQL, TRANSFER_ITEM_SQL
+from utils.schema import CREATE_INDEXES_SQL, CREATE_TABLES_SQL, CREATE_TRIGGERS_SQL
+
+PHONE_VALUES = {1: 10, 2: 500, 3: 0}
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(CREATE_TABLES_SQL + CREATE_INDEXES_SQL + CREATE_TRIGGERS_SQL)
+    conn.executemany("INSERT INTO phones (id, name, brand, rarity, value) VALUES (?, ?, 'Test', 'common', ?)",
+                     [(phone_id, f"Phone {phone_id}", value) for phone_id, value in PHONE_VALUES.items()])
+    conn.executemany("INSERT INTO users (id, telegram_id, signals) VALUES (?, ?, 1000)", [(1, 1001), (2, 1002)])
+    yield conn
+    conn.close()
+
+
+def _inventory_values(conn):
+    """(inventory_value, сумма стоимостей по user_inventory) каждого игрока."""
+    return {
+        row["id"]: (row["inventory_value"], row["actual"])
+        for row in conn.execute("""
+            SELECT u.id, u.inventory_value,
+                   (SELECT COALESCE(SUM(p.value), 0) FROM user_inventory ui JOIN phones p ON p.id = ui.phone_id
+                    WHERE ui.user_id = u.id) AS actual
+            FROM users u
+        """)
+    }
+
+
+def _open_cases(conn, user_id, price, phone_ids):
+    """Списание и вставка призов так же, как database.open_cases."""
+    conn.execute("BEGIN")
+    balance = conn.execute(DEBIT_CASE_PRICE_SQL, (
+        price, prize_phone_ids([{"phone_id": phone_id} for phone_id in phone_ids]), user_id, price,
+    )).fetchone()
+    if balance is None:
+        conn.execute("ROLLBACK")
+        return None
+    conn.executemany("INSERT INTO user_inventory (user_id, phone_id) VALUES (?, ?)",
+                     [(user_id, phone_id) for phone_id in phone_ids])
+    conn.execute("COMMIT")
+    return balance[0]
+
+
+def test_inventory_value_follows_inventory(conn):
+    # Вставка: призы кейса оплачиваются и оцениваются одним UPDATE users
+    assert _open_cases(conn, 1, 30, [1, 2, 2, 3]) == 970
+    assert _inventory_values(conn)[1] == (1010, 1010)
+
+    # Не хватило сигналов: ни баланс, ни стоимость не меняются
+    assert _open_cases(conn, 2, 10 ** 6, [2]) is None
+    assert tuple(conn.execute("SELECT signals, inventory_value FROM users WHERE id = 2").fetchone()) == (1000, 0)
+
+    # Продажа игроком 1 и покупка игроком 2: шаги покупки из utils/market.py
+    item_id = conn.execute("SELECT id FROM user_inventory WHERE user_id = 1 AND phone_id = 2 LIMIT 1").fetchone()[0]
+    assert conn.execute(DEBIT_BUYER_SQL, (300, 2, 300)).fetchone()[0] == 700
+    conn.execute(CREDIT_SELLER_SQL, (300, 1))
+    conn.execute(TRANSFER_ITEM_SQL, (2, item_id))
+    assert _inventory_values(conn) == {1: (510, 510), 2: (500, 500)}
+    assert [row["net_worth"] for row in conn.execute(PLAYER_NET_WORTH_SQL, (1,))] == [1270 + 510]
+
+    # Удаление предмета
+    conn.execute("DELETE FROM user_inventory WHERE user_id = 1 AND phone_id = 1")
+    assert _inventory_values(conn)[1] == (500, 500)
+
+    # Переоценка модели в каталоге
+    conn.execute("UPDATE phones SET value = 700 WHERE id = 2")
+    assert _inventory_values(conn) == {1: (700, 700), 2: (700, 700)}
+
+
+def test_case_price_debit_requires_balance(conn):
+    prizes = prize_phone_ids([{"phone_id": 2}, {"phone_id": 2}, {"phone_id": 1}])
+    # Ровно весь баланс — можно, на сигнал больше — нет
+    assert conn.execute(DEBIT_CASE_PRICE_SQL, (1000, prizes, 1, 1000)).fetchone()[0] == 0
+    assert conn.execute(DEBIT_CASE_PRICE_SQL, (1001, prizes, 2, 1001)).fetchone() is None
+    rows = conn.execute("SELECT signals, inventory_value FROM users ORDER BY id").fetchall()
+    assert [tuple(row) for row in rows] == [(0, 1010), (1000, 0)]
+    # Неизвестная игроку модель и пустой список призов ничего не прибавляют
+    assert conn.execute(DEBIT_CASE_PRICE_SQL, (0, prize_phone_ids([{"phone_id": 99}]), 2, 0)).fetchone()[0] == 1000
+    assert conn.execute(DEBIT_CASE_PRICE_SQL, (0, prize_phone_ids([]), 2, 0)).fetchone()[0] == 1000
+    assert conn.execute("SELECT inventory_value FROM users WHERE id = 2").fetchone()[0] == 0
+
+
+def test_ranks_with_ties(conn):
+    # Игроков больше EXACT_RANK_LIMIT, у многих одинаковое состояние
+    rng = random.Random(3)
+    conn.execute("DELETE FROM users")
+    conn.executemany("INSERT INTO users (id, telegram_id, signals, inventory_value) VALUES (?, ?, ?, ?)",
+                     [(i, 10_000 + i, rng.randint(0, 50) * 10, rng.choice([0, 10, 500])) for i in range(1, 3001)])
+    net_worths = [row[0] for row in conn.execute("SELECT signals + inventory_value FROM users")]
+    snapshot = build_rank_snapshot(conn.execute(NET_WORTH_DISTRIBUTION_SQL).fetchall())
+    assert snapshot.total_players == len(net_worths)
+
+    for net_worth in sorted(set(net_worths)) + [-1, 10 ** 9]:
+        assert snapshot.players_above(net_worth) == sum(other > net_worth for other in net_worths)
+
+    # Самый богатый и самый бедный: ранг по индексу и ранг из снимка
+    richest, poorest = (conn.execute(f"SELECT id FROM users ORDER BY signals + inventory_value {order}, id LIMIT 1")
+                        .fetchone()[0] for order in ("DESC", "ASC"))
+    exact = set()
+    for user_id in (richest, 2, 1500, poorest):
+        player = conn.execute(PLAYER_NET_WORTH_SQL, (user_id,)).fetchone()
+        above = conn.execute(PLAYERS_ABOVE_SQL, (player["net_worth"],)).fetchone()[0]
+        rank = player_rank(player, above, snapshot)
+        assert rank["rank"] == 1 + sum(other > player["net_worth"] for other in net_worths)
+        assert rank["exact"] == (above < EXACT_RANK_LIMIT)
+        exact.add(rank["exact"])
+    assert exact == {True, False}
+
+    top = rank_top_players(conn.execute(TOP_PLAYERS_SQL, (100,)).fetchall())
+    for player in top:
+        assert player["rank"] == 1 + sum(other > player["net_worth"] for other in net_worths)
+    assert len({player["rank"] for player in top}) < len(top)  # в топе есть равные места
@@ -0,0 +1,113 @@
+# tests/test_open_cases.py
+# Массовое открытие кейсов: одно списание и одна вставка executemany;
+# если сигналов не хватает, не меняется ничего
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+
+import index
+from utils.case_engine import DEBIT_CASE_PRICE_SQL, MAX_BULK_OPEN
+
+TELEGRAM_ID = 650_001
+COUNT = 5
+
+
+class RecordingConnection:
+    """Соединение, которое запоминает вызовы execute и executemany."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.calls = []
+
+    def execute(self, sql, params=()):
+        self.calls.append(("execute", sql, params))
+        return self.conn.execute(sql, params)
+
+    def executemany(self, sql, rows):
+        rows = list(rows)
+        self.calls.append(("executemany", sql, rows))
+        return self.conn.executemany(sql, rows)
+
+
+@pytest.fixture
+def player(create_players, monkeypatch):
+    user, = create_players(TELEGRAM_ID)
+    case = index.game_db.get_cases()[0]
+    recorded = []
+    transaction = index.game_db.pool.transaction
+
+    @contextmanager
+    def recording_transaction():
+        with transaction() as conn:
+            recording = RecordingConnection(conn)
+            recorded.append(recording)
+            yield recording
+    monkeypatch.setattr(index.game_db.pool, "transaction", recording_transaction)
+    return user, case, recorded
+
+
+def _state(user_id):
+    conn = sqlite3.connect(os.environ["DATABASE_PATH"])
+    try:
+        signals, inventory_value = conn.execute(
+            "SELECT signals, inventory_value FROM users WHERE id = ?", (user_id,)).fetchone()
+        items = conn.execute("SELECT COUNT(*) FROM user_inventory WHERE user_id = ?", (user_id,)).fetchone()[0]
+        return signals, inventory_value, items
+    finally:
+        conn.close()
+
+
+def _set_signals(user_id, signals):
+    conn = sqlite3.connect(os.environ["DATABASE_PATH"])
+    with conn:
+        conn.execute("UPDATE users SET signals = ? WHERE id = ?", (signals, user_id))
+    conn.close()
+    index.game_db.users.invalidate(user_id)
+
+
+def _open(auth_headers, case_id, count):
+    return index.app.test_client().post("/api/cases/open", json={"caseId": case_id, "count": count},
+                                        headers=auth_headers(TELEGRAM_ID))
+
+
+def test_bulk_open_is_charged_once(player, auth_headers):
+    user, case, recorded = player
+    _set_signals(user["id"], case["price_signals"] * COUNT)
+    signals, inventory_value, items = _state(user["id"])
+
+    response = _open(auth_headers, case["id"], COUNT)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["newBalance"] == 0
+    assert sum(prize["count"] for prize in body["prizes"]) == COUNT == len(body["rolls"])
+
+    calls, = [recording.calls for recording in recorded]
+    debits = [call for call in calls if call[1] == DEBIT_CASE_PRICE_SQL]
+    inserts = [call for call in calls if "INSERT INTO user_inventory" in call[1]]
+    assert [(kind, params[0]) for kind, _sql, params in debits] == [("execute", case["price_signals"] * COUNT)]
+    assert [(kind, len(rows)) for kind, _sql, rows in inserts] == [("executemany", COUNT)]
+
+    prize_value = sum((prize["value"] or 0) * prize["count"] for prize in body["prizes"])
+    assert _state(user["id"]) == (0, inventory_value + prize_value, items + COUNT)
+
+
+def test_bulk_open_without_enough_signals_changes_nothing(player, auth_headers):
+    user, case, recorded = player
+    _set_signals(user["id"], case["price_signals"] * COUNT - 1)
+    before = _state(user["id"])
+
+    response = _open(auth_headers, case["id"], COUNT)
+    assert response.status_code == 409
+    assert _state(user["id"]) == before
+    calls, = [recording.calls for recording in recorded]
+    assert not any(kind == "executemany" for kind, _sql, _params in calls)
+
+
+@pytest.mark.parametrize("count", [0, MAX_BULK_OPEN + 1])
+def test_bulk_open_count_is_limited(player, auth_headers, count):
+    user, case, recorded = player
+    before = _state(user["id"])
+    assert _open(auth_headers, case["id"], count).status_code == 400
+    assert _state(user["id"]) == before and not recorded
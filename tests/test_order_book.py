@@ -0,0 +1,72 @@
+# tests/test_order_book.py
+# Книга заявок бота видит лоты, выставленные веб-API (другой процесс пишет в ту же БД)
+import asyncio
+
+import database as db
+from utils.database import GameDatabase
+from utils.market import ListingResult, ListingStatus, PurchaseStatus
+
+
+async def _web_listing_bought_by_bot(game_db):
+    await db.init_db()
+    await db.populate_initial_data()
+    await db.warm_order_book()
+    try:
+        seller = await db.create_user_if_not_exists(610_001)
+        buyer = await db.create_user_if_not_exists(610_002)
+        item = (await db.get_inventory_items(seller['id']))['items'][0]
+
+        listing = await asyncio.to_thread(game_db.list_item_on_market, seller['id'], item['id'], 1)
+        assert listing.ok
+        listing_id = listing.listing_id
+        await db.poll_order_book()
+        assert db.get_best_ask(item['phone_id'])['listing_id'] == listing_id
+
+        purchases, status = await db.buy_cheapest(buyer['id'], item['phone_id'])
+        assert status is PurchaseStatus.OK
+        assert [result.listing_id for result in purchases] == [listing_id]
+
+        # Покупка через веб-API убирает лот бота из его книги
+        listing_id = (await db.list_item_on_market(buyer['id'], purchases[0].inventory_item_id, 1)).listing_id
+        assert db.get_best_ask(item['phone_id'])['listing_id'] == listing_id
+        result = await asyncio.to_thread(game_db.buy_item_from_market, listing_id, seller['id'])
+        assert result.ok
+        await db.poll_order_book()
+        assert db.get_best_ask(item['phone_id']) is None
+    finally:
+        await db.close_pool()
+
+
+def test_web_listing_reaches_bot_buy_cheapest():
+    game_db = GameDatabase()
+    try:
+        asyncio.run(_web_listing_bought_by_bot(game_db))
+    finally:
+        game_db.close()
+
+
+async def _duplicate_listing(game_db):
+    await db.init_db()
+    await db.populate_initial_data()
+    try:
+        seller = await db.create_user_if_not_exists(610_003)
+        item = (await db.get_inventory_items(seller['id']))['items'][0]
+        assert (await db.list_item_on_market(seller['id'], item['id'], 5)).ok
+
+        # Повтор не роняет пачку записи и не долетает до вызывающего как IntegrityError
+        again = await db.list_item_on_market(seller['id'], item['id'], 6)
+        assert again == ListingResult(ListingStatus.ALREADY_LISTED)
+        from_web = await asyncio.to_thread(game_db.list_item_on_market, seller['id'], item['id'], 7)
+        assert from_web.status is ListingStatus.ALREADY_LISTED
+        missing = await db.list_item_on_market(seller['id'], 10 ** 9, 5)
+        assert missing.status is ListingStatus.NOT_FOUND
+    finally:
+        await db.close_pool()
+
+
+def test_duplicate_listing_returns_status():
+    game_db = GameDatabase()
+    try:
+        asyncio.run(_duplicate_listing(game_db))
+    finally:
+        game_db.close()
@@ -0,0 +1,136 @@
+# tests/test_purchase.py
+# Покупка лота: у каждой неудачи свой PurchaseStatus (и HTTP-код), ничего не меняется;
+# потоки, гоняющиеся за одними лотами, не продают лот дважды и не теряют сигналы
+import os
+import random
+import sqlite3
+import threading
+from collections import Counter
+
+import pytest
+
+import index
+from utils.database import GameDatabase
+from utils.market import PurchaseStatus
+
+SELLER, BUYER = 660_001, 660_002
+PRICE = 25
+
+
+def _signals(*user_ids):
+    conn = sqlite3.connect(os.environ["DATABASE_PATH"])
+    try:
+        return [conn.execute("SELECT signals FROM users WHERE id = ?", (user_id,)).fetchone()[0]
+                for user_id in user_ids]
+    finally:
+        conn.close()
+
+
+def _listed(listing_id):
+    conn = sqlite3.connect(os.environ["DATABASE_PATH"])
+    try:
+        return conn.execute("SELECT COUNT(*) FROM market_listings WHERE id = ?", (listing_id,)).fetchone()[0] == 1
+    finally:
+        conn.close()
+
+
+def _set_signals(user_id, signals):
+    conn = sqlite3.connect(os.environ["DATABASE_PATH"])
+    with conn:
+        conn.execute("UPDATE users SET signals = ? WHERE id = ?", (signals, user_id))
+    conn.close()
+    index.game_db.users.invalidate(user_id)
+
+
+def _buy(auth_headers, telegram_id, listing_id):
+    return index.app.test_client().post("/api/market/buy", json={"listingId": listing_id},
+                                        headers=auth_headers(telegram_id))
+
+
+def test_purchase_statuses(create_players, auth_headers):
+    game_db = index.game_db
+    seller, buyer = create_players(SELLER, BUYER)
+    item = game_db.get_inventory_items(seller["id"])["items"][0]
+    listing_id = game_db.list_item_on_market(seller["id"], item["id"], PRICE).listing_id
+    _set_signals(buyer["id"], PRICE - 1)
+    before = _signals(seller["id"], buyer["id"])
+
+    assert game_db.buy_item_from_market(listing_id, seller["id"]).status is PurchaseStatus.OWN_LISTING
+    result = game_db.buy_item_from_market(listing_id, buyer["id"])
+    assert (result.status, result.price) == (PurchaseStatus.INSUFFICIENT_FUNDS, PRICE)
+    assert game_db.buy_item_from_market(listing_id, 10 ** 12).status is PurchaseStatus.NOT_FOUND
+    assert game_db.buy_item_from_market(10 ** 12, buyer["id"]).status is PurchaseStatus.SOLD_OUT
+
+    response = _buy(auth_headers, SELLER, listing_id)
+    assert (response.status_code, response.get_json()["error"]) == (409, "own_listing")
+    response = _buy(auth_headers, BUYER, listing_id)
+    assert (response.status_code, response.get_json()["error"]) == (402, "insufficient_funds")
+
+    # Неудачные попытки ничего не списали, лот на месте
+    assert _signals(seller["id"], buyer["id"]) == before
+    assert _listed(listing_id)
+
+    _set_signals(buyer["id"], PRICE)
+    response = _buy(auth_headers, BUYER, listing_id)
+    assert response.status_code == 200
+    assert response.get_json()["newBalance"] == 0
+    assert _signals(seller["id"]) == [before[0] + PRICE]
+    assert not _listed(listing_id)
+
+    result = game_db.buy_item_from_market(listing_id, buyer["id"])
+    assert result.status is PurchaseStatus.SOLD_OUT and not result.ok
+    response = _buy(auth_headers, BUYER, listing_id)
+    assert (response.status_code, response.get_json()["error"]) == (409, "sold_out")
+
+
+@pytest.fixture
+def race_db(tmp_path, monkeypatch):
+    """Отдельная БД: продавец 1 с лотами, покупатели 2.. с большим балансом (как bench_purchase)."""
+    path = str(tmp_path / "purchase.db")
+    monkeypatch.setenv("DATABASE_PATH", path)
+    game_db = GameDatabase()
+    yield game_db, path
+    game_db.close()
+
+
+def test_racing_buyers_never_double_sell(race_db):
+    game_db, path = race_db
+    listings, buyers, start_signals = 300, 4, 10 ** 9
+    rng = random.Random(5)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("INSERT INTO phones (name, brand) VALUES ('Race Phone', 'Test')")
+        conn.executemany("INSERT INTO users (id, telegram_id, signals) VALUES (?, ?, ?)",
+                         [(i, i, start_signals) for i in range(1, buyers + 2)])
+        conn.executemany("INSERT INTO user_inventory (id, user_id, phone_id) VALUES (?, 1, 1)",
+                         [(i,) for i in range(1, listings + 1)])
+        conn.executemany(
+            "INSERT INTO market_listings (id, seller_user_id, inventory_item_id, phone_id, price_signals)"
+            " VALUES (?, 1, ?, 1, ?)",
+            [(i, i, rng.randint(1, 100)) for i in range(1, listings + 1)])
+
+    winners, outcomes, lock = Counter(), Counter(), threading.Lock()
+
+    def worker(buyer_id):
+        # Все потоки идут по лотам в одном порядке и гоняются за одними и теми же
+        local = [(listing_id, game_db.buy_item_from_market(listing_id, buyer_id).status)
+                 for listing_id in range(1, listings + 1)]
+        with lock:
+            winners.update(listing_id for listing_id, status in local if status is PurchaseStatus.OK)
+            outcomes.update(status for _listing_id, status in local)
+
+    threads = [threading.Thread(target=worker, args=(buyer_id,)) for buyer_id in range(2, buyers + 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Каждый лот продан ровно один раз, остальные попытки — SOLD_OUT
+    assert set(winners) == set(range(1, listings + 1)) and set(winners.values()) == {1}
+    assert outcomes == {PurchaseStatus.OK: listings, PurchaseStatus.SOLD_OUT: listings * (buyers - 1)}
+    remaining, total, owned_by_seller = conn.execute(
+        "SELECT (SELECT COUNT(*) FROM market_listings), (SELECT SUM(signals) FROM users),"
+        " (SELECT COUNT(*) FROM user_inventory WHERE user_id = 1)").fetchone()
+    conn.close()
+    assert (remaining, owned_by_seller) == (0, 0)
+    assert total == start_signals * (buyers + 1)  # сигналы только переходили между игроками
@@ -0,0 +1,169 @@
+# tests/test_shards.py
+# Покупка между шардами (DB_SHARDS=2) и восстановление прерванных покупок.
+# config читается при импорте, поэтому database.py загружается отдельным модулем
+# со своими кэшами и пулами и переключается на шарды в своей временной БД
+import asyncio
+import importlib.util
+import os
+
+import pytest
+
+from conftest import ROOT
+from utils.market import PurchaseStatus
+
+PRICE = 7
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    spec = importlib.util.spec_from_file_location("database_sharded", os.path.join(ROOT, "database.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.DATABASE_PATH = str(tmp_path / "game_database.db")
+    module.DB_SHARDS = 2
+    module.SHARDED = True
+    return module
+
+
+def _telegram_ids_on_shards(db, first_shard, second_shard, start=700_000):
+    """Первый telegram_id на каждом из двух шардов."""
+    found = {}
+    telegram_id = start
+    while len(found) < 2:
+        shard = db.shard_for_telegram_id(telegram_id, db.DB_SHARDS)
+        if shard in (first_shard, second_shard) and shard not in found:
+            found[shard] = telegram_id
+        telegram_id += 1
+    return found[first_shard], found[second_shard]
+
+
+async def _signals(db, user_id):
+    pool = await db.get_shard_pool(db.shard_of(user_id))
+    async with pool.read() as conn:
+        return (await conn.execute_fetchall("SELECT signals FROM users WHERE id = ?", (user_id,)))[0][0]
+
+
+async def _count(db, table):
+    pool = await db.get_pool()
+    async with pool.read() as conn:
+        return (await conn.execute_fetchall(f"SELECT COUNT(*) FROM {table}"))[0][0]
+
+
+async def _items(db, user_id):
+    pool = await db.get_shard_pool(db.shard_of(user_id))
+    async with pool.read() as conn:
+        rows = await conn.execute_fetchall("SELECT id, phone_id FROM user_inventory WHERE user_id = ?", (user_id,))
+    return [tuple(row) for row in rows]
+
+
+def _run(db, scenario, price=PRICE):
+    """Продавец и покупатель в разных шардах; продавец выставляет стартовый телефон за price."""
+    async def main():
+        await db.init_db()
+        await db.populate_initial_data()
+        try:
+            seller_tid, buyer_tid = _telegram_ids_on_shards(db, 0, 1)
+            seller = await db.create_user_if_not_exists(seller_tid)
+            buyer = await db.create_user_if_not_exists(buyer_tid)
+            assert db.shard_of(seller['id']) != db.shard_of(buyer['id'])
+            (item_id, phone_id), = await _items(db, seller['id'])
+            listing = await db.list_item_on_market(seller['id'], item_id, price)
+            assert listing.ok
+            await scenario(seller, buyer, listing.listing_id, item_id, phone_id)
+        finally:
+            await db.close_pool()
+    asyncio.run(main())
+
+
+async def _age_pending_trades(db):
+    # Recovery берёт только покупки старше PENDING_TRADE_TIMEOUT_SECONDS
+    pool = await db.get_pool()
+    async with pool.transaction() as conn:
+        await conn.execute("UPDATE pending_trades SET created_at = datetime('now', '-1 day')")
+
+
+def test_cross_shard_purchase(sharded):
+    db = sharded
+
+    async def scenario(seller, buyer, listing_id, item_id, phone_id):
+        result = await db.buy_item_from_market(listing_id, buyer['id'])
+        assert result.status is PurchaseStatus.OK
+        assert await _signals(db, buyer['id']) == buyer['signals'] - PRICE == result.new_balance
+        assert await _signals(db, seller['id']) == seller['signals'] + PRICE
+        assert await _items(db, seller['id']) == []
+        assert (result.inventory_item_id, phone_id) in await _items(db, buyer['id'])
+        assert await _count(db, "pending_trades") == 0
+        assert await _count(db, "trades") == 1
+        assert await db.get_listing_by_id(listing_id) is None
+
+    _run(db, scenario)
+
+
+def test_insufficient_funds_restores_listing(sharded):
+    db = sharded
+
+    async def scenario(seller, buyer, listing_id, item_id, phone_id):
+        result = await db.buy_item_from_market(listing_id, buyer['id'])
+        assert result.status is PurchaseStatus.INSUFFICIENT_FUNDS
+        restored = await db.get_listing_by_id(listing_id)
+        assert restored['inventory_item_id'] == item_id
+        assert await _signals(db, buyer['id']) == buyer['signals']
+        assert await _signals(db, seller['id']) == seller['signals']
+        assert await _items(db, seller['id']) == [(item_id, phone_id)]
+        assert await _count(db, "pending_trades") == 0
+        assert await _count(db, "trades") == 0
+
+    _run(db, scenario, price=10 ** 6)
+
+
+def test_recovery_finishes_trade_with_only_buyer_side(sharded, monkeypatch):
+    db = sharded
+
+    async def crash(trade, seller_applied=False):
+        raise RuntimeError("процесс упал после шага покупателя")
+
+    async def scenario(seller, buyer, listing_id, item_id, phone_id):
+        with monkeypatch.context() as patch:
+            patch.setattr(db, "_finish_trade", crash)
+            assert (await db.buy_item_from_market(listing_id, buyer['id'])).ok
+        assert await _signals(db, seller['id']) == seller['signals']
+        assert await _count(db, "pending_trades") == 1
+
+        await _age_pending_trades(db)
+        await db._recover_pending_trades()
+        await db._recover_pending_trades()
+        assert await _signals(db, buyer['id']) == buyer['signals'] - PRICE
+        assert await _signals(db, seller['id']) == seller['signals'] + PRICE
+        assert await _items(db, seller['id']) == []
+        assert await _count(db, "pending_trades") == 0
+        assert await _count(db, "trades") == 1
+
+    _run(db, scenario)
+
+
+def test_recovery_keeps_seller_side_idempotent(sharded, monkeypatch):
+    db = sharded
+
+    async def crash_after_seller(trade, seller_applied=False):
+        # Сторона продавца применена, а журнал в общем файле закрыть не успели
+        pool = await db.get_shard_pool(db.shard_of(trade['seller_user_id']))
+        async with pool.transaction() as conn:
+            await db._apply_seller_side(conn, trade)
+        raise RuntimeError("процесс упал после шага продавца")
+
+    async def scenario(seller, buyer, listing_id, item_id, phone_id):
+        with monkeypatch.context() as patch:
+            patch.setattr(db, "_finish_trade", crash_after_seller)
+            assert (await db.buy_item_from_market(listing_id, buyer['id'])).ok
+        assert await _signals(db, seller['id']) == seller['signals'] + PRICE
+
+        await _age_pending_trades(db)
+        await db._recover_pending_trades()
+        await _age_pending_trades(db)
+        await db._recover_pending_trades()
+        assert await _signals(db, seller['id']) == seller['signals'] + PRICE
+        assert await _signals(db, buyer['id']) == buyer['signals'] - PRICE
+        assert await _count(db, "pending_trades") == 0
+        assert await _count(db, "trades") == 1
+
+    _run(db, scenario)
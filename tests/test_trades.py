@@ -0,0 +1,102 @@
+# tests/test_trades.py
+# Журнал сделок только пополняется, а триггер trg_trades_rollup раскладывает
+# сделки по часовым, суточным и недельным свечам и итогам модели
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils.schema import CREATE_INDEXES_SQL, CREATE_TABLES_SQL, CREATE_TRIGGERS_SQL, TRADE_ROLLUPS_BACKFILL_SQL
+from utils.trades import CANDLE_PERIODS
+
+PHONE_ID = 1
+# 2024-01-01 — понедельник. Сделки на границах часа, суток и недели
+TRADES = [
+    ("2024-01-01 10:15:00", 100),
+    ("2024-01-01 10:45:00", 140),
+    ("2024-01-01 10:59:59", 90),
+    ("2024-01-01 11:00:00", 120),
+    ("2024-01-01 23:59:59", 80),
+    ("2024-01-02 00:00:00", 200),
+    ("2024-01-07 23:59:59", 60),
+    ("2024-01-08 00:00:00", 300),
+]
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    conn.executescript(CREATE_TABLES_SQL + CREATE_INDEXES_SQL + CREATE_TRIGGERS_SQL)
+    conn.execute("INSERT INTO phones (id, name, brand, rarity, value) VALUES (?, 'Phone', 'Test', 'common', 1)",
+                 (PHONE_ID,))
+    yield conn
+    conn.close()
+
+
+def _bucket_start(traded_at, seconds):
+    moment = datetime.strptime(traded_at, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    if seconds == CANDLE_PERIODS["7d"]:
+        moment = (moment - timedelta(days=moment.weekday())).replace(hour=0, minute=0, second=0)
+    else:
+        moment = datetime.fromtimestamp(int(moment.timestamp()) // seconds * seconds, timezone.utc)
+    return int(moment.timestamp())
+
+
+def _expected_candles():
+    candles = {}
+    for traded_at, price in TRADES:
+        for seconds in CANDLE_PERIODS.values():
+            key = (seconds, _bucket_start(traded_at, seconds))
+            candle = candles.setdefault(key, [price, price, price, price, 0, 0])
+            candle[1], candle[2] = max(candle[1], price), min(candle[2], price)
+            candle[3] = price
+            candle[4] += 1
+            candle[5] += price
+    return {key: tuple(candle) for key, candle in candles.items()}
+
+
+def _candles(conn):
+    return {
+        (period, bucket_start): tuple(ohlc)
+        for period, bucket_start, *ohlc in conn.execute(
+            "SELECT period, bucket_start, open_price, high_price, low_price, close_price, volume, turnover"
+            " FROM trade_candles WHERE phone_id = ?", (PHONE_ID,))
+    }
+
+
+def _insert_trades(conn):
+    conn.executemany(
+        "INSERT INTO trades (listing_id, phone_id, seller_user_id, buyer_user_id, inventory_item_id, price_signals,"
+        " traded_at) VALUES (?, ?, 1, 2, ?, ?, ?)",
+        [(i, PHONE_ID, i, price, traded_at) for i, (traded_at, price) in enumerate(TRADES, 1)])
+
+
+def test_trades_are_append_only(conn):
+    _insert_trades(conn)
+    for statement in ("UPDATE trades SET price_signals = 1", "DELETE FROM trades WHERE id = 1"):
+        with pytest.raises(sqlite3.IntegrityError, match="append-only"):
+            conn.execute(statement)
+    assert conn.execute("SELECT COUNT(*), SUM(price_signals) FROM trades").fetchone() == (
+        len(TRADES), sum(price for _, price in TRADES))
+
+
+def test_rollup_fills_candles_across_buckets(conn):
+    _insert_trades(conn)
+    candles = _candles(conn)
+    assert candles == _expected_candles()
+    # Границы: 10:59:59 и 11:00 — разные часы, 23:59:59 и 00:00 — разные сутки,
+    # воскресенье и понедельник — разные недели
+    hour, day, week = CANDLE_PERIODS.values()
+    assert candles[(hour, _bucket_start("2024-01-01 10:00:00", hour))] == (100, 140, 90, 90, 3, 330)
+    assert candles[(day, _bucket_start("2024-01-01 00:00:00", day))] == (100, 140, 80, 80, 5, 530)
+    assert candles[(week, _bucket_start("2024-01-01 00:00:00", week))] == (100, 200, 60, 60, 7, 790)
+    assert candles[(week, _bucket_start("2024-01-08 00:00:00", week))] == (300, 300, 300, 300, 1, 300)
+
+    assert conn.execute(
+        "SELECT last_price, last_traded_at, volume, turnover FROM phone_trade_stats WHERE phone_id = ?", (PHONE_ID,)
+    ).fetchone() == (300, "2024-01-08 00:00:00", len(TRADES), sum(price for _, price in TRADES))
+
+    # Пересчёт с нуля для загрузки в обход триггера даёт те же корзины
+    conn.executescript(TRADE_ROLLUPS_BACKFILL_SQL)
+    assert _candles(conn) == candles
+
@@ -0,0 +1,15 @@
+# tests/test_user_cache.py
+# Строка, прочитанная до invalidate, не попадает в кэш после него
+from utils.users import UserCache
+
+
+def test_put_after_invalidate_is_dropped():
+    cache = UserCache()
+    generation = cache.generation()
+    stale = {"id": 1, "telegram_id": 100, "signals": 50}  # прочитана до списания
+    cache.invalidate(1)  # писатель списал баланс, пока строки ещё не было в кэше
+    cache.put(stale, generation)
+    assert cache.get(100) is None
+
+    cache.put({"id": 1, "telegram_id": 100, "signals": 40}, cache.generation())
+    assert cache.get(100)["signals"] == 40
@@ -0,0 +1,58 @@
+# tests/test_webapp_auth.py
+# Веб-API узнаёт игрока только из подписанной initData Telegram
+import json
+import time
+
+import index
+from utils.webapp_auth import INIT_DATA_HEADER, sign_init_data, verify_init_data
+
+TOKEN = "123:test-token"
+
+
+def _init_data(telegram_id, auth_date=None, token=TOKEN):
+    fields = {"auth_date": str(auth_date or int(time.time())), "user": json.dumps({"id": telegram_id})}
+    return sign_init_data(fields, token)
+
+
+def test_verify_init_data():
+    assert verify_init_data(_init_data(42), TOKEN) == 42
+    assert verify_init_data(_init_data(42, token="other"), TOKEN) is None
+    assert verify_init_data(_init_data(42).replace("42", "43"), TOKEN) is None
+    assert verify_init_data(_init_data(42, auth_date=int(time.time()) - 100), TOKEN, max_age=10) is None
+    assert verify_init_data("", TOKEN) is None
+    assert verify_init_data("garbage", TOKEN) is None
+    assert verify_init_data(_init_data(42), "") is None
+
+
+def test_api_requires_init_data(auth_headers):
+    client = index.app.test_client()
+    for path in ("/api/user", "/api/cases", "/api/market", "/api/inventory"):
+        assert client.get(path).status_code == 401
+        assert client.get(path, headers={INIT_DATA_HEADER: "hash=0&auth_date=1"}).status_code == 401
+    expired = auth_headers(1, auth_date=int(time.time()) - index.INIT_DATA_MAX_AGE - 60)
+    assert client.get("/api/user", headers=expired).status_code == 401
+    assert client.post("/api/cases/open", json={"caseId": 1}).status_code == 401
+    # Вне /api проверка не нужна
+    assert client.get("/").status_code == 200
+
+
+def test_user_comes_from_init_data(auth_headers, create_players):
+    player, victim = create_players(630_001, 630_002)
+    client = index.app.test_client()
+    case_id = client.get("/api/cases", headers=auth_headers(630_001)).json["cases"][0]["id"]
+
+    # userId в теле ничего не решает: платит тот, чья initData
+    response = client.post("/api/cases/open", headers=auth_headers(630_001),
+                           json={"caseId": case_id, "userId": 630_002})
+    assert response.status_code == 200
+    assert client.get("/api/user", headers=auth_headers(630_001)).json["user"]["signals"] < player["signals"]
+    assert client.get("/api/user", headers=auth_headers(630_002)).json["user"]["signals"] == victim["signals"]
+
+
+def test_init_data_in_query_only_for_event_stream(auth_headers):
+    client = index.app.test_client()
+    query = {"initData": auth_headers(630_003)[INIT_DATA_HEADER]}
+    assert client.get("/api/cases", query_string=query).status_code == 401
+    stream = client.get("/api/market/events", query_string=query, buffered=False)
+    assert stream.status_code == 200
+    stream.close()
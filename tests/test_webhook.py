@@ -0,0 +1,41 @@
+# tests/test_webhook.py
+# Секрет вебхука: неверный (в том числе не-ASCII) заголовок получает 403, а не обрыв соединения
+import asyncio
+import json
+from types import SimpleNamespace
+
+from webhook import SECRET_TOKEN_HEADER, WebhookServer
+
+SECRET = "webhook-secret"
+
+
+async def _post(port, secret_header):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps({"update_id": 1}).encode()
+    head = (
+        f"POST /telegram HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n"
+    ).encode() + secret_header + b"\r\n"
+    writer.write(head + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    writer.close()
+    await writer.wait_closed()
+    return int(status_line.split()[1])
+
+
+def test_webhook_secret_is_checked():
+    async def main():
+        application = SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+        server = WebhookServer(application, "127.0.0.1", 0, "/telegram", SECRET)
+        await server.start()
+        try:
+            header = SECRET_TOKEN_HEADER.encode()
+            assert await _post(server.port, header + b": " + SECRET.encode() + b"\r\n") == 200
+            assert await _post(server.port, header + b": wrong\r\n") == 403
+            assert await _post(server.port, header + ": секрет".encode() + b"\r\n") == 403
+            assert await _post(server.port, b"") == 403
+            assert application.update_queue.qsize() == 1
+        finally:
+            await server.stop()
+    asyncio.run(main())
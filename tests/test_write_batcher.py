@@ -0,0 +1,90 @@
+# tests/test_write_batcher.py
+# Групповой коммит: упавшая операция не откатывает соседей по пачке,
+# результаты приходят в порядке очереди, close() применяет накопленное
+import asyncio
+
+import pytest
+
+from db_pool import ConnectionPool
+from write_batcher import WriteBatcher
+
+
+def _insert(value):
+    async def op(db):
+        cursor = await db.execute("INSERT INTO log (value) VALUES (?)", (value,))
+        return cursor.lastrowid
+    return op
+
+
+def _fail_after_insert(value):
+    async def op(db):
+        await db.execute("INSERT INTO log (value) VALUES (?)", (value,))
+        raise ValueError(value)
+    return op
+
+
+async def _values(pool):
+    async with pool.read() as conn:
+        return [row[0] for row in await conn.execute_fetchall("SELECT value FROM log ORDER BY id")]
+
+
+async def _open_pool(tmp_path):
+    pool = await ConnectionPool(str(tmp_path / "batch.db"), readers=1).open()
+    async with pool.transaction() as db:
+        await db.execute("CREATE TABLE log (id INTEGER PRIMARY KEY, value TEXT NOT NULL)")
+    return pool
+
+
+def _run(tmp_path, scenario):
+    async def main():
+        pool = await _open_pool(tmp_path)
+        # Задержка собирает все операции теста в одну пачку
+        batcher = WriteBatcher(pool, max_batch=64, max_delay=0.05)
+        try:
+            await scenario(pool, batcher)
+        finally:
+            await batcher.close()
+            await pool.close()
+    asyncio.run(main())
+
+
+def test_failing_operation_is_isolated_by_savepoint(tmp_path):
+    async def scenario(pool, batcher):
+        results = await asyncio.gather(
+            batcher.submit(_insert("a")),
+            batcher.submit(_fail_after_insert("bad")),
+            batcher.submit(_insert("b")),
+            return_exceptions=True,
+        )
+        assert batcher.batches == 1
+        assert isinstance(results[1], ValueError)
+        assert await _values(pool) == ["a", "b"]  # вставка упавшей операции откачена
+    _run(tmp_path, scenario)
+
+
+def test_results_follow_queue_order(tmp_path):
+    async def scenario(pool, batcher):
+        values = [str(i) for i in range(20)]
+        ids = await asyncio.gather(*(batcher.submit(_insert(value)) for value in values))
+        assert ids == sorted(ids)
+        assert await _values(pool) == values
+    _run(tmp_path, scenario)
+
+
+def test_close_applies_pending_operations(tmp_path):
+    async def scenario(pool, batcher):
+        pending = [asyncio.ensure_future(batcher.submit(_insert(str(i)))) for i in range(5)]
+        await asyncio.sleep(0)  # операции в очереди, пачка ещё не применена
+        await batcher.close()
+        assert all(task.done() for task in pending)
+        assert await _values(pool) == ["0", "1", "2", "3", "4"]
+        with pytest.raises(RuntimeError):
+            await batcher.submit(_insert("late"))
+    async def main():
+        pool = await _open_pool(tmp_path)
+        try:
+            # Задержка больше, чем длится тест: применить пачку может только close()
+            await scenario(pool, WriteBatcher(pool, max_delay=60))
+        finally:
+            await pool.close()
+    asyncio.run(main())
@@ -0,0 +1,172 @@
+# utils/case_engine.py
+# Розыгрыш содержимого кейсов по alias-таблицам (метод Уолкера/Воуза)
+import json
+import logging
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Максимум кейсов за одно массовое открытие
+MAX_BULK_OPEN = 100
+
+# Условное списание цены вместе с учётом стоимости призов в users.inventory_value
+# (параметры: цена, prize_phone_ids(draws), users.id, цена). Стоимость берётся из
+# phones в той же транзакции, а не из снимка каталога, который может отставать
+DEBIT_CASE_PRICE_SQL = """
+    UPDATE users SET
+        signals = signals - ?,
+        inventory_value = inventory_value + (
+            SELECT COALESCE(SUM(p.value), 0) FROM json_each(?) AS prize JOIN phones p ON p.id = prize.value
+        )
+    WHERE id = ? AND signals >= ?
+    RETURNING signals
+"""
+
+class AliasTable:
+    """Дискретное распределение с выборкой за O(1).
+
+    Строится за O(n) один раз; веса нормализуются, поэтому шансы кейса
+    не обязаны суммироваться в 1.
+    """
+
+    __slots__ = ("outcomes", "prob", "alias")
+
+    def __init__(self, outcomes, weights):
+        outcomes = list(outcomes)
+        weights = [float(w) for w in weights]
+        if not outcomes or len(outcomes) != len(weights):
+            raise ValueError("Нужен хотя бы один исход и по весу на каждый исход")
+        if any(w < 0 for w in weights):
+            raise ValueError("Веса не могут быть отрицательными")
+        total = sum(weights)
+        if total <= 0:
+            raise ValueError("Сумма весов должна быть положительной")
+
+        n = len(outcomes)
+        scaled = [w * n / total for w in weights]
+        prob = [0.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Остатки равны 1 с точностью до погрешности округления
+        for i in small + large:
+            prob[i] = 1.0
+
+        self.outcomes = outcomes
+        self.prob = prob
+        self.alias = alias
+
+    def draw(self, rng=random):
+        # Одно случайное число: целая часть выбирает столбец, дробная — исход в нём
+        u = rng.random() * len(self.prob)
+        i = int(u)
+        return self.outcomes[i] if u - i < self.prob[i] else self.outcomes[self.alias[i]]
+
+    def draw_many(self, count, rng=random):
+        n = len(self.prob)
+        prob, alias, outcomes = self.prob, self.alias, self.outcomes
+        rand = rng.random
+        result = []
+        append = result.append
+        for _ in range(count):
+            u = rand() * n
+            i = int(u)
+            append(outcomes[i] if u - i < prob[i] else outcomes[alias[i]])
+        return result
+
+
+def prize_phone_ids(draws):
+    """phone_id призов JSON-массивом — параметр DEBIT_CASE_PRICE_SQL."""
+    return json.dumps([phone["phone_id"] for phone in draws])
+
+
+def summarize_draws(draws):
+    """Сжимает результаты розыгрыша: уникальные призы с количеством
+    и порядок выпадения индексами в этом списке (для анимации)."""
+    prizes, positions, rolls = [], {}, []
+    for phone in draws:
+        position = positions.get(phone["phone_id"])
+        if position is None:
+            position = positions[phone["phone_id"]] = len(prizes)
+            prizes.append({**phone, "count": 0})
+        prizes[position]["count"] += 1
+        rolls.append(position)
+    return prizes, rolls
+
+
+class CaseTable:
+    __slots__ = ("case_id", "name", "price", "table")
+
+    def __init__(self, case_id, name, price, table):
+        self.case_id = case_id
+        self.name = name
+        self.price = price
+        self.table = table
+
+
+class CaseEngine:
+    """Кэш alias-таблиц по case_id.
+
+    Таблицы строятся из снимка каталога (build_from_catalog) и привязаны к его
+    версии: sync_version() сбрасывает кэш, когда каталог изменился.
+    """
+
+    def __init__(self):
+        self._tables = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def sync_version(self, version):
+        if version != self._version:
+            with self._lock:
+                self._tables.clear()
+                self._version = version
+
+    def get(self, case_id):
+        return self._tables.get(case_id)
+
+    def build(self, case_id, name, price, contents):
+        """contents — пары (описание телефона, шанс); описание уходит в результат розыгрыша."""
+        contents = [(phone, chance) for phone, chance in contents if chance and chance > 0]
+        if not contents:
+            logger.warning("У кейса %s нет содержимого с положительным шансом", case_id)
+            return None
+        total = sum(chance for _, chance in contents)
+        if abs(total - 1.0) > 1e-9:
+            logger.info("Шансы кейса %s в сумме дают %.4f, нормализуем", case_id, total)
+        case_table = CaseTable(
+            case_id, name, price,
+            AliasTable([phone for phone, _ in contents], [chance for _, chance in contents]),
+        )
+        with self._lock:
+            self._tables[case_id] = case_table
+        return case_table
+
+    def build_from_catalog(self, snapshot, case_id):
+        """Строит таблицу по снимку каталога; None, если кейса нет или он пуст."""
+        case = snapshot.case(case_id)
+        if case is None:
+            return None
+        self.sync_version(snapshot.version)
+        contents = []
+        for phone_id, chance in snapshot.case_contents.get(case_id, ()):
+            phone = snapshot.phone(phone_id)
+            if phone is not None:
+                contents.append((
+                    {
+                        "phone_id": phone_id,
+                        "name": phone["name"],
+                        "rarity": phone["rarity"],
+                        "value": phone["value"],
+                        "image_filename": phone["image_filename"],
+                    },
+                    chance,
+                ))
+        return self.build(case_id, case["name"], case["price_signals"], contents)
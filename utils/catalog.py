@@ -0,0 +1,104 @@
+# utils/catalog.py
+# Неизменяемый снимок каталога (телефоны, кейсы, содержимое кейсов) с версией
+import threading
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Mapping, Tuple
+
+# Версию поднимают триггеры на phones / cases / case_contents (см. utils/schema.py),
+# поэтому изменения из любого процесса видны по одному чтению этой строки
+CATALOG_VERSION_SQL = "SELECT version FROM catalog_meta WHERE id = 1"
+CATALOG_PHONES_SQL = "SELECT id, name, brand, model_code, rarity, value, image_filename FROM phones"
+CATALOG_CASES_SQL = "SELECT id, name, price_signals FROM cases ORDER BY price_signals, id"
+CATALOG_CASE_CONTENTS_SQL = "SELECT case_id, phone_id, chance FROM case_contents ORDER BY case_id, id"
+
+# Как часто сверять версию каталога с БД
+CATALOG_REFRESH_SECONDS = 5.0
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    version: int
+    phones: Mapping[int, Mapping]  # phone_id -> описание телефона
+    cases: Tuple[Mapping, ...]
+    case_contents: Mapping[int, Tuple[Tuple[int, float], ...]]  # case_id -> ((phone_id, шанс), ...)
+    phone_ids_by_name: Mapping[str, int]
+    # Сериализованные ответы API по ключу, заполняются лениво (см. index.py)
+    rendered: dict = field(default_factory=dict, compare=False, repr=False)
+
+    def etag(self, resource):
+        """Сильный ETag ресурса каталога: меняется только вместе с версией."""
+        return f"catalog-{self.version}-{resource}"
+
+    def phone(self, phone_id):
+        return self.phones.get(phone_id)
+
+    def case(self, case_id):
+        for case in self.cases:
+            if case["id"] == case_id:
+                return case
+        return None
+
+
+def build_snapshot(version, phone_rows, case_rows, content_rows):
+    phones = {row["id"]: MappingProxyType(dict(row)) for row in phone_rows}
+    contents = {}
+    for row in content_rows:
+        contents.setdefault(row["case_id"], []).append((row["phone_id"], row["chance"]))
+    return CatalogSnapshot(
+        version=version,
+        phones=MappingProxyType(phones),
+        cases=tuple(MappingProxyType(dict(row)) for row in case_rows),
+        case_contents=MappingProxyType({case_id: tuple(items) for case_id, items in contents.items()}),
+        phone_ids_by_name=MappingProxyType({phone["name"]: phone_id for phone_id, phone in phones.items()}),
+    )
+
+
+# Поля телефона, которые подставляются в строки инвентаря и рынка
+PHONE_FIELDS = ("name", "brand", "rarity", "value", "image_filename")
+# Телефон мог появиться в БД позже снимка: поля пустые до следующей сверки версии
+_UNKNOWN_PHONE = MappingProxyType(dict.fromkeys(PHONE_FIELDS))
+
+
+def attach_phones(rows, snapshot, phone_key="phone_id"):
+    """Дополняет строки полями телефона из снимка вместо JOIN phones в SQL."""
+    items = []
+    for row in rows:
+        item = dict(row)
+        phone = snapshot.phones.get(item[phone_key], _UNKNOWN_PHONE)
+        for name in PHONE_FIELDS:
+            item[name] = phone[name]
+        items.append(item)
+    return items
+
+
+class CatalogCache:
+    """Текущий снимок каталога и время последней сверки версии с БД.
+
+    Загрузку выполняет вызывающая сторона (async или sync): если
+    needs_check() — прочитать версию, и если она отличается от snapshot.version,
+    построить новый снимок и передать его в install().
+    """
+
+    def __init__(self, refresh_seconds=CATALOG_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.snapshot = None
+        self.lock = threading.Lock()
+        self._checked_at = 0.0
+
+    def needs_check(self):
+        return self.snapshot is None or time.monotonic() - self._checked_at >= self.refresh_seconds
+
+    def is_current(self, version):
+        self._checked_at = time.monotonic()
+        return self.snapshot is not None and self.snapshot.version == version
+
+    def install(self, snapshot):
+        self.snapshot = snapshot
+        self._checked_at = time.monotonic()
+        return snapshot
+
+    def invalidate(self):
+        """Заставляет сверить версию при следующем обращении (после записей в каталог)."""
+        self._checked_at = 0.0
@@ -0,0 +1,336 @@
+# utils/catalog_import.py
+# Импорт каталога (телефоны, кейсы, содержимое кейсов) из CSV / JSON Lines.
+# Файлы читаются потоком; с текущим каталогом сравнивается каждая запись, и в БД
+# пачками executemany уходят только изменения — одной транзакцией. Повторный
+# импорт тех же файлов ничего не меняет.
+#
+#   python -m utils.catalog_import --db game_database.db --phones phones.csv --cases cases.csv \
+#       --contents contents.jsonl [--dry-run]
+#
+# Колонки: phones — name, brand, model_code, rarity, value, image_filename;
+# cases — name, price_signals; contents — case, phone, chance (имена кейса и телефона)
+import argparse
+import csv
+import json
+import logging
+import math
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from utils.schema import PRAGMAS
+
+logger = logging.getLogger(__name__)
+
+RARITIES = ("Common", "Rare", "Epic", "Legendary")
+IMPORT_BATCH_SIZE = 5000
+# Сумма шансов кейса может отличаться от 1 на погрешность округления
+CHANCE_TOLERANCE = 1e-6
+# Сколько ошибок перечислять в исключении; остальные только считаются
+MAX_REPORTED_ERRORS = 50
+
+PHONE_FIELDS = ("brand", "model_code", "rarity", "value", "image_filename")
+CURRENT_PHONES_SQL = f"SELECT id, name, {', '.join(PHONE_FIELDS)} FROM phones"
+INSERT_PHONE_SQL = f"INSERT INTO phones (name, {', '.join(PHONE_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?)"
+UPDATE_PHONE_SQL = f"UPDATE phones SET {', '.join(f'{name} = ?' for name in PHONE_FIELDS)} WHERE id = ?"
+CURRENT_CASES_SQL = "SELECT id, name, price_signals FROM cases"
+INSERT_CASE_SQL = "INSERT INTO cases (name, price_signals) VALUES (?, ?)"
+UPDATE_CASE_SQL = "UPDATE cases SET price_signals = ? WHERE id = ?"
+CURRENT_CONTENTS_SQL = "SELECT id, case_id, phone_id, chance FROM case_contents"
+INSERT_CONTENT_SQL = "INSERT INTO case_contents (case_id, phone_id, chance) VALUES (?, ?, ?)"
+UPDATE_CONTENT_SQL = "UPDATE case_contents SET chance = ? WHERE id = ?"
+DELETE_CONTENT_SQL = "DELETE FROM case_contents WHERE id = ?"
+CASE_CHANCES_SQL = "SELECT case_id, COUNT(*), SUM(chance) FROM case_contents GROUP BY case_id"
+
+
+class CatalogImportError(ValueError):
+    """Импорт отменён целиком: errors — сообщения "источник:запись: причина"."""
+
+    def __init__(self, errors, total):
+        self.errors = errors
+        self.total = total
+        more = f"\n... и ещё {total - len(errors)}" if total > len(errors) else ""
+        super().__init__(f"Каталог не импортирован, ошибок: {total}\n" + "\n".join(errors) + more)
+
+
+@dataclass
+class ImportReport:
+    added: Dict[str, int] = field(default_factory=lambda: {"phones": 0, "cases": 0, "case_contents": 0})
+    updated: Dict[str, int] = field(default_factory=lambda: {"phones": 0, "cases": 0, "case_contents": 0})
+    removed: Dict[str, int] = field(default_factory=lambda: {"case_contents": 0})
+    unchanged: Dict[str, int] = field(default_factory=lambda: {"phones": 0, "cases": 0, "case_contents": 0})
+    warnings: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def changed(self):
+        return any(self.added.values()) or any(self.updated.values()) or any(self.removed.values())
+
+    def summary(self):
+        return (f"добавлено {self.added}, изменено {self.updated}, удалено {self.removed}, "
+                f"без изменений {self.unchanged} за {self.seconds:.2f} с")
+
+
+# --- Чтение ---
+def read_records(path):
+    """Словари из .csv (строка заголовка) или .jsonl / .ndjson (объект на строку), потоком."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        with open(path, newline="", encoding="utf-8-sig") as source:
+            yield from csv.DictReader(source)
+    elif extension in (".jsonl", ".ndjson"):
+        with open(path, encoding="utf-8") as source:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        raise ValueError(f"{path}: поддерживаются .csv, .jsonl и .ndjson")
+
+
+def _text(record, name, required=False):
+    value = record.get(name)
+    value = str(value).strip() if value is not None else ""
+    if required and not value:
+        raise ValueError(f"нет поля {name}")
+    return value or None
+
+
+def _integer(record, name, default):
+    value = _text(record, name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name} должно быть целым числом: {value!r}") from None
+    if number < 0:
+        raise ValueError(f"{name} не может быть отрицательным")
+    return number
+
+
+def normalize_phone(record):
+    """(name, brand, model_code, rarity, value, image_filename); умолчания — как в схеме phones."""
+    rarity = _text(record, "rarity") or "Common"
+    canonical = next((name for name in RARITIES if name.lower() == rarity.lower()), None)
+    if canonical is None:
+        raise ValueError(f"неизвестная редкость {rarity!r}, допустимы: {', '.join(RARITIES)}")
+    return (
+        _text(record, "name", required=True),
+        _text(record, "brand", required=True),
+        _text(record, "model_code"),
+        canonical,
+        _integer(record, "value", 10),
+        _text(record, "image_filename"),
+    )
+
+
+def normalize_case(record):
+    return _text(record, "name", required=True), _integer(record, "price_signals", 10)
+
+
+def normalize_content(record):
+    """(имя кейса, имя телефона, шанс); шанс — доля от 0 (не включая) до 1."""
+    chance = _text(record, "chance", required=True)
+    try:
+        chance = float(chance)
+    except ValueError:
+        raise ValueError(f"chance должно быть числом: {chance!r}") from None
+    if not math.isfinite(chance) or not 0 < chance <= 1:
+        raise ValueError(f"chance должно быть в (0, 1]: {chance}")
+    return _text(record, "case", required=True), _text(record, "phone", required=True), chance
+
+
+# --- Импорт ---
+class _Importer:
+    def __init__(self, conn, update_existing, batch_size):
+        self.conn = conn
+        self.update_existing = update_existing
+        self.batch_size = batch_size
+        self.report = ImportReport()
+        self.errors = []
+        self.error_count = 0
+        self._pending = {}  # sql -> строки для executemany
+
+    def error(self, source, number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"{source}:{number}: {message}")
+
+    def write(self, sql, row):
+        rows = self._pending.setdefault(sql, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(sql)
+
+    def flush(self, sql=None):
+        for pending_sql in [sql] if sql else list(self._pending):
+            # Пишется и после ошибок: иначе содержимое кейсов сошлось бы не на все
+            # телефоны из импорта и ошибок стало бы больше, чем на самом деле
+            rows = self._pending.pop(pending_sql, None)
+            if rows:
+                self.conn.executemany(pending_sql, rows)
+
+    def records(self, source, records, normalize):
+        """Нормализованные записи с номерами; плохие и повторные имена — в ошибки."""
+        seen = set()
+        for number, record in enumerate(records, 1):
+            try:
+                row = normalize(record)
+            except (ValueError, TypeError, AttributeError) as e:
+                self.error(source, number, e)
+                continue
+            key = row[:2] if source == "case_contents" else row[0]
+            if key in seen:
+                self.error(source, number, f"повтор {key!r}")
+                continue
+            seen.add(key)
+            yield number, row
+
+    def import_phones(self, records):
+        current = {row[1]: (row[0], tuple(row[2:])) for row in self.conn.execute(CURRENT_PHONES_SQL)}
+        for _number, (name, *fields) in self.records("phones", records, normalize_phone):
+            existing = current.get(name)
+            if existing is None:
+                self.write(INSERT_PHONE_SQL, (name, *fields))
+                self.report.added["phones"] += 1
+            elif existing[1] != tuple(fields) and self.update_existing:
+                self.write(UPDATE_PHONE_SQL, (*fields, existing[0]))
+                self.report.updated["phones"] += 1
+            else:
+                self.report.unchanged["phones"] += 1
+        self.flush()
+
+    def import_cases(self, records):
+        current = {row[1]: (row[0], row[2]) for row in self.conn.execute(CURRENT_CASES_SQL)}
+        for _number, (name, price) in self.records("cases", records, normalize_case):
+            existing = current.get(name)
+            if existing is None:
+                self.write(INSERT_CASE_SQL, (name, price))
+                self.report.added["cases"] += 1
+            elif existing[1] != price and self.update_existing:
+                self.write(UPDATE_CASE_SQL, (price, existing[0]))
+                self.report.updated["cases"] += 1
+            else:
+                self.report.unchanged["cases"] += 1
+        self.flush()
+
+    def import_contents(self, records):
+        """Кейс из файла получает ровно перечисленное в нём содержимое (при update_existing)."""
+        # Имена читаются после вставки телефонов и кейсов: у новых уже есть id
+        phone_ids = {name: phone_id for phone_id, name, *_ in self.conn.execute(CURRENT_PHONES_SQL)}
+        case_ids = {name: case_id for case_id, name, _price in self.conn.execute(CURRENT_CASES_SQL)}
+        current = {(row[1], row[2]): (row[0], row[3]) for row in self.conn.execute(CURRENT_CONTENTS_SQL)}
+        listed, touched_cases = set(), set()
+        for number, (case_name, phone_name, chance) in self.records("case_contents", records, normalize_content):
+            case_id, phone_id = case_ids.get(case_name), phone_ids.get(phone_name)
+            if case_id is None or phone_id is None:
+                missing = f"кейс {case_name!r}" if case_id is None else f"телефон {phone_name!r}"
+                self.error("case_contents", number, f"{missing} не найден ни в БД, ни в импорте")
+                continue
+            listed.add((case_id, phone_id))
+            touched_cases.add(case_id)
+            existing = current.get((case_id, phone_id))
+            if existing is None:
+                self.write(INSERT_CONTENT_SQL, (case_id, phone_id, chance))
+                self.report.added["case_contents"] += 1
+            elif existing[1] != chance and self.update_existing:
+                self.write(UPDATE_CONTENT_SQL, (chance, existing[0]))
+                self.report.updated["case_contents"] += 1
+            else:
+                self.report.unchanged["case_contents"] += 1
+        if self.update_existing:
+            for key, (content_id, _chance) in current.items():
+                if key[0] in touched_cases and key not in listed:
+                    self.write(DELETE_CONTENT_SQL, (content_id,))
+                    self.report.removed["case_contents"] += 1
+        self.flush()
+        return touched_cases
+
+    def check_chances(self, case_ids):
+        """Сумма шансов кейса после импорта: больше 1 — ошибка, меньше — предупреждение."""
+        names = {case_id: name for case_id, name, _price in self.conn.execute(CURRENT_CASES_SQL)}
+        for case_id, count, total in self.conn.execute(CASE_CHANCES_SQL):
+            if case_id not in case_ids:
+                continue
+            if total > 1 + CHANCE_TOLERANCE:
+                self.error("case_contents", names.get(case_id, case_id), f"сумма шансов {total:.6f} больше 1")
+            elif total < 1 - CHANCE_TOLERANCE:
+                self.report.warnings.append(
+                    f"Кейс {names.get(case_id, case_id)!r}: сумма шансов {total:.6f} из {count} позиций, "
+                    "при розыгрыше они нормализуются")
+
+
+def import_catalog(conn, phones=(), cases=(), contents=(), update_existing=True, dry_run=False,
+                   batch_size=IMPORT_BATCH_SIZE):
+    """Импорт записей (словарей) одной транзакцией BEGIN IMMEDIATE; возвращает ImportReport.
+
+    Телефоны и кейсы ищутся по имени, содержимое — по паре (кейс, телефон).
+    update_existing=False только добавляет недостающее, не трогая существующие
+    строки. Из каталога ничего не удаляется, кроме позиций кейсов, которых нет
+    в импорте содержимого этого кейса. При любой ошибке в данных откатывается
+    всё и поднимается CatalogImportError; dry_run откатывает и удачный импорт.
+    conn — sqlite3-соединение в autocommit (isolation_level=None).
+    """
+    started = time.perf_counter()
+    importer = _Importer(conn, update_existing, batch_size)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        importer.import_phones(phones)
+        importer.import_cases(cases)
+        touched_cases = importer.import_contents(contents)
+        if not importer.error_count:
+            importer.check_chances(touched_cases)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    if importer.error_count:
+        conn.execute("ROLLBACK")
+        raise CatalogImportError(importer.errors, importer.error_count)
+    conn.execute("ROLLBACK" if dry_run else "COMMIT")
+    importer.report.seconds = time.perf_counter() - started
+    return importer.report
+
+
+def connect(path, timeout=5.0):
+    """Отдельное соединение для импорта, с прагмами пулов (utils/schema.py)."""
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def import_catalog_files(path, phones=None, cases=None, contents=None, **options):
+    """import_catalog по файлам (см. read_records) в БД path."""
+    conn = connect(path)
+    try:
+        return import_catalog(
+            conn,
+            phones=read_records(phones) if phones else (),
+            cases=read_records(cases) if cases else (),
+            contents=read_records(contents) if contents else (),
+            **options,
+        )
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Импорт каталога из CSV / JSON Lines")
+    parser.add_argument("--db", default=os.environ.get("DATABASE_PATH", "game_database.db"))
+    parser.add_argument("--phones", help="name, brand, model_code, rarity, value, image_filename")
+    parser.add_argument("--cases", help="name, price_signals")
+    parser.add_argument("--contents", help="case, phone, chance")
+    parser.add_argument("--only-new", action="store_true", help="только добавлять, существующее не менять")
+    parser.add_argument("--dry-run", action="store_true", help="посчитать изменения и откатить")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        report = import_catalog_files(args.db, args.phones, args.cases, args.contents,
+                                      update_existing=not args.only_new, dry_run=args.dry_run)
+    except (ValueError, OSError) as e:
+        raise SystemExit(str(e))
+    for warning in report.warnings:
+        logger.warning(warning)
+    logger.info("%s%s", "Проверка без записи: " if args.dry_run else "", report.summary())
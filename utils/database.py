@@ -1,80 +1,409 @@
-import sqlite3
 import os
 import logging
+import sqlite3
+import threading
+import time
+
+from utils import metrics
+from utils.db_pool import SyncConnectionPool
+from utils.schema import (
+    CREATE_TABLES_SQL, CREATE_INDEXES_SQL, CREATE_TRIGGERS_SQL, ADDED_COLUMNS, ADDED_UNIQUE_INDEXES,
+)
+from utils.catalog import (
+    CATALOG_CASE_CONTENTS_SQL, CATALOG_CASES_SQL, CATALOG_PHONES_SQL, CATALOG_VERSION_SQL,
+    CatalogCache, build_snapshot,
+)
+from utils.users import USER_BY_TELEGRAM_ID_SQL, UserCache
+from utils.inventory import (
+    INVENTORY_PAGE_SIZE, INVENTORY_SUMMARY_SQL, build_inventory_items_query, paginate_inventory_rows,
+    summarize_inventory,
+)
+from utils.case_engine import DEBIT_CASE_PRICE_SQL, MAX_BULK_OPEN, CaseEngine, prize_phone_ids, summarize_draws
+from utils.order_book import ORDER_BOOK_SQL, OrderBook
+from utils.leaderboard import (
+    LEADERBOARD_SIZE, MAX_LEADERBOARD_SIZE, NET_WORTH_DISTRIBUTION_SQL, PLAYER_NET_WORTH_SQL, PLAYERS_ABOVE_SQL,
+    TOP_PLAYERS_SQL, RankCache, build_rank_snapshot, player_rank, rank_top_players,
+)
+from utils.market import (
+    CLAIM_LISTING_SQL, CREDIT_SELLER_SQL, DEBIT_BUYER_SQL, INSERT_LISTING_SQL, LISTING_SELLER_SQL,
+    MARKET_PAGE_SIZE, RECORD_MARKET_EVENT_SQL, RECORD_TRADE_SQL, TRANSFER_ITEM_SQL, USER_EXISTS_SQL,
+    ListingResult, ListingStatus, MarketEvent, PurchaseResult, PurchaseStatus, build_market_listings_query,
+    claim_failure_status, debit_failure_status, listing_added_event, paginate_market_rows,
+)
+from utils.market_feed import (
+    FEED_BATCH_SIZE, FEED_BUFFER_SIZE, FEED_RETENTION, LAST_MARKET_EVENT_SQL, MARKET_EVENTS_SINCE_SQL,
+    TRIM_MARKET_EVENTS_SQL, MarketFeed, build_feed_events,
+)
+from utils.shards import RECORD_SHARD_COUNT_SQL, SHARD_COUNT_SQL, SHARED_PLAYERS_EXIST_SQL, check_shard_count
+from utils.trades import (
+    CANDLES_LIMIT, HOURLY_CANDLES_SINCE_SQL, PHONE_TRADE_STATS_SQL, build_candles_query, candles_payload,
+    stats_since, summarize_trade_stats,
+)
 
 logger = logging.getLogger(__name__)
 
+# Схема проверяется один раз на процесс и путь к БД, а не при каждом GameDatabase()
+_schema_lock = threading.Lock()
+_initialized_paths = set()
+
 class GameDatabase:
     def __init__(self):
+        if int(os.environ.get('DB_SHARDS', '1')) > 1:
+            # Игроки в файлах шардов, а запросы веб-API читают users общего файла
+            raise RuntimeError("Веб-API не поддерживает DB_SHARDS > 1 (см. utils/shards.py)")
         self.db_path = os.environ.get('DATABASE_PATH', '/tmp/game_database.db')
+        self.pool = SyncConnectionPool(self.db_path, readers=int(os.environ.get('DB_POOL_READERS', '8')))
+        self.catalog = CatalogCache()
+        self.users = UserCache(int(os.environ.get('USER_CACHE_SIZE', '10000')))
+        self.case_engine = CaseEngine()
+        self.order_book = OrderBook()
+        self.ranks = RankCache()
+        self.market_feed = None
+        self._feed_lock = threading.Lock()
         self.init_database()
-    
-    def get_db_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        self.warm_order_book()
 
     def init_database(self):
-        with self.get_db_connection() as conn:
-            conn.executescript("""
-                CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, telegram_id INTEGER UNIQUE NOT NULL, signals INTEGER DEFAULT 0, created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
-                CREATE TABLE IF NOT EXISTS phones (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, brand TEXT NOT NULL, model_code TEXT, rarity TEXT DEFAULT 'Common', value INTEGER DEFAULT 10, image_filename TEXT);
-                CREATE TABLE IF NOT EXISTS cases (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, price_signals INTEGER DEFAULT 10);
-                CREATE TABLE IF NOT EXISTS case_contents (id INTEGER PRIMARY KEY, case_id INTEGER, phone_id INTEGER, chance REAL, FOREIGN KEY (case_id) REFERENCES cases (id), FOREIGN KEY (phone_id) REFERENCES phones (id));
-                CREATE TABLE IF NOT EXISTS user_inventory (id INTEGER PRIMARY KEY, user_id INTEGER, phone_id INTEGER, acquired_at DATETIME DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users (id), FOREIGN KEY (phone_id) REFERENCES phones (id));
-                CREATE TABLE IF NOT EXISTS market_listings (id INTEGER PRIMARY KEY, seller_user_id INTEGER, inventory_item_id INTEGER UNIQUE, price_signals INTEGER, listed_at DATETIME DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (seller_user_id) REFERENCES users (id), FOREIGN KEY (inventory_item_id) REFERENCES user_inventory (id));
-            """)
-            conn.commit()
-
-    def get_market_listings(self):
-        with self.get_db_connection() as conn:
-            cursor = conn.execute("""
-                SELECT
-                    ml.id, ml.price_signals, p.name, p.rarity, p.image_filename,
-                    u.telegram_id as seller_id, u.telegram_id as seller_name
-                FROM market_listings ml
-                JOIN users u ON ml.seller_user_id = u.id
-                JOIN user_inventory ui ON ml.inventory_item_id = ui.id
-                JOIN phones p ON ui.phone_id = p.id
-                ORDER BY ml.listed_at DESC
-            """)
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows] if rows else []
+        with _schema_lock:
+            if self.db_path in _initialized_paths:
+                return
+            with self.pool.write() as conn:
+                conn.executescript(CREATE_TABLES_SQL)
+                for table, column, declaration, backfill_sql in ADDED_COLUMNS:
+                    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                    if column not in columns:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+                        conn.execute(backfill_sql)
+                for index, dedupe_sql in ADDED_UNIQUE_INDEXES:
+                    exists = conn.execute(
+                        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index,)).fetchone()
+                    if not exists:
+                        conn.execute(dedupe_sql)
+                conn.executescript(CREATE_INDEXES_SQL)
+                conn.executescript(CREATE_TRIGGERS_SQL)
+            # БД, которую бот разбил на шарды, веб-API прочитал бы без игроков
+            with self.pool.transaction() as conn:
+                stored = conn.execute(SHARD_COUNT_SQL).fetchone()
+                shared_players = conn.execute(SHARED_PLAYERS_EXIST_SQL).fetchone()[0]
+                check_shard_count(stored[0] if stored else None, 1, shared_players)
+                conn.execute(RECORD_SHARD_COUNT_SQL, (1,))
+            _initialized_paths.add(self.db_path)
+
+    def close(self):
+        if self.market_feed is not None:
+            self.market_feed.stop()
+        self.pool.close()
+
+    def get_user_by_telegram_id(self, telegram_id):
+        user = self.users.get(telegram_id)
+        if user is not None:
+            return user
+        generation = self.users.generation()
+        with self.pool.read() as conn:
+            row = conn.execute(USER_BY_TELEGRAM_ID_SQL, (telegram_id,)).fetchone()
+        if not row:
+            return None
+        user = dict(row)
+        self.users.put(user, generation)
+        return user
+
+    def get_catalog(self):
+        """Снимок каталога; между сверками версии (CatalogCache.refresh_seconds) БД не читается."""
+        if not self.catalog.needs_check():
+            return self.catalog.snapshot
+        with self.catalog.lock:
+            # Пока ждали блокировку, снимок мог обновить другой поток
+            if not self.catalog.needs_check():
+                return self.catalog.snapshot
+            with self.pool.read() as conn:
+                conn.execute("BEGIN")
+                try:
+                    version = conn.execute(CATALOG_VERSION_SQL).fetchone()[0]
+                    if self.catalog.is_current(version):
+                        return self.catalog.snapshot
+                    snapshot = build_snapshot(
+                        version,
+                        conn.execute(CATALOG_PHONES_SQL).fetchall(),
+                        conn.execute(CATALOG_CASES_SQL).fetchall(),
+                        conn.execute(CATALOG_CASE_CONTENTS_SQL).fetchall(),
+                    )
+                finally:
+                    conn.execute("COMMIT")
+            logger.info(f"Catalog loaded, version {version}")
+            return self.catalog.install(snapshot)
+
+    def get_cases(self):
+        return [dict(case) for case in self.get_catalog().cases]
+
+    def get_inventory_summary(self, user_id):
+        catalog = self.get_catalog()
+        with self.pool.read() as conn:
+            rows = conn.execute(INVENTORY_SUMMARY_SQL, (user_id,)).fetchall()
+        return summarize_inventory(rows, catalog)
+
+    def get_inventory_items(self, user_id, limit=INVENTORY_PAGE_SIZE, cursor=None, phone_id=None):
+        sql, params, limit = build_inventory_items_query(user_id, limit=limit, cursor=cursor, phone_id=phone_id)
+        catalog = self.get_catalog()
+        with self.pool.read() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return paginate_inventory_rows(rows, limit, catalog)
+
+    def get_market_listings(self, limit=MARKET_PAGE_SIZE, cursor=None, **filters):
+        """Страница рынка с keyset-пагинацией, фильтры — как в build_market_listings_query."""
+        sql, params, limit = build_market_listings_query(limit=limit, cursor=cursor, **filters)
+        catalog = self.get_catalog()
+        with self.pool.read() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return paginate_market_rows(rows, limit, catalog)
 
     def list_item_on_market(self, user_id, inventory_item_id, price):
-        with self.get_db_connection() as conn:
-            cursor = conn.execute(
-                "INSERT INTO market_listings (seller_user_id, inventory_item_id, price_signals) VALUES (?, ?, ?)",
-                (user_id, inventory_item_id, price)
-            )
-            conn.commit()
-            return cursor.lastrowid
+        """Выставляет предмет на рынок: ListingResult со статусом и id лота."""
+        with self.pool.transaction() as conn:
+            try:
+                listing = conn.execute(INSERT_LISTING_SQL, (user_id, price, inventory_item_id, user_id)).fetchone()
+            except sqlite3.IntegrityError:
+                # Повторное выставление отсекает UNIQUE(inventory_item_id)
+                return ListingResult(ListingStatus.ALREADY_LISTED)
+            if not listing:
+                return ListingResult(ListingStatus.NOT_FOUND)
+            conn.execute(RECORD_MARKET_EVENT_SQL, listing_added_event(listing, user_id, price))
+        self.order_book.add(listing['id'], listing['phone_id'], price, listing['listed_at'], user_id)
+        self.wake_market_feed()
+        return ListingResult(ListingStatus.OK, listing['id'])
+
+    def warm_order_book(self):
+        with self.pool.read() as conn:
+            self.order_book.load(conn.execute(ORDER_BOOK_SQL).fetchall())
+
+    def get_market_feed(self):
+        """Лента изменений рынка; опрос market_events запускается при первом обращении."""
+        if self.market_feed is not None:
+            return self.market_feed
+        with self._feed_lock:
+            if self.market_feed is None:
+                with self.pool.read() as conn:
+                    head = conn.execute(LAST_MARKET_EVENT_SQL).fetchone()[0]
+                # Последние события подгружаются сразу: клиент, подключённый до перезапуска
+                # сервера, продолжит по Last-Event-ID без полной перезагрузки рынка
+                feed = MarketFeed(max(0, head - FEED_BUFFER_SIZE))
+                while self.poll_market_events(feed) == FEED_BATCH_SIZE:
+                    pass
+                self.market_feed = feed.start(lambda: self.poll_market_events(feed))
+        return self.market_feed
+
+    def poll_market_events(self, feed):
+        """Публикует в ленте новые события market_events; возвращает их число."""
+        with self.pool.read() as conn:
+            rows = conn.execute(MARKET_EVENTS_SINCE_SQL, (feed.head, FEED_BATCH_SIZE)).fetchall()
+        if rows:
+            # Так в книгу заявок попадают и лоты бота
+            self.order_book.apply_events(rows)
+            feed.publish(build_feed_events(rows, self.get_catalog()))
+        if feed.needs_trim():
+            feed.trimmed_at = time.monotonic()
+            with self.pool.transaction() as conn:
+                conn.execute(TRIM_MARKET_EVENTS_SQL, (feed.head - FEED_RETENTION,))
+        return len(rows)
+
+    def wake_market_feed(self):
+        if self.market_feed is not None:
+            self.market_feed.wake()
 
     def buy_item_from_market(self, listing_id, buyer_id):
-        with self.get_db_connection() as conn:
-            cursor = conn.cursor()
+        """Покупка лота одной транзакцией BEGIN IMMEDIATE, результат — PurchaseResult."""
+        with self.pool.write() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = self._purchase_listing(conn, listing_id, buyer_id)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT" if result.ok else "ROLLBACK")
+        if result.ok:
+            self.users.invalidate(buyer_id, result.seller_user_id)
+            self.wake_market_feed()
+        else:
+            logger.info(f"Failed to buy listing {listing_id}: {result.status.value}")
+        if result.ok or result.status is PurchaseStatus.SOLD_OUT:
+            self.order_book.remove(listing_id)
+        return result
+
+    def buy_cheapest(self, buyer_id, phone_id, count=1):
+        """Покупка до `count` самых дешёвых лотов модели, см. database.buy_cheapest."""
+        purchases, tried, gone = [], set(), []
+        status = PurchaseStatus.OK
+        with self.pool.write() as conn:
+            conn.execute("BEGIN IMMEDIATE")
             try:
-                cursor.execute("BEGIN")
-                cursor.execute("SELECT * FROM market_listings WHERE id = ?", (listing_id,))
-                listing = cursor.fetchone()
-                if not listing: raise Exception("Listing not found")
-                
-                seller_id, price, inventory_item_id = listing['seller_user_id'], listing['price_signals'], listing['inventory_item_id']
-
-                cursor.execute("SELECT * FROM users WHERE id = ?", (buyer_id,))
-                buyer = cursor.fetchone()
-                if not buyer: raise Exception("Buyer not found")
-                
-                if buyer['signals'] < price: raise Exception("Not enough signals")
-
-                new_balance = buyer['signals'] - price
-                cursor.execute("UPDATE users SET signals = ? WHERE id = ?", (new_balance, buyer_id))
-                cursor.execute("UPDATE users SET signals = signals + ? WHERE id = ?", (price, seller_id))
-                cursor.execute("UPDATE user_inventory SET user_id = ? WHERE id = ?", (buyer_id, inventory_item_id))
-                cursor.execute("DELETE FROM market_listings WHERE id = ?", (listing_id,))
-                conn.commit()
-                return new_balance
-            except Exception as e:
-                conn.rollback()
-                logger.error(f"Failed to buy item: {e}")
-                return None
\ No newline at end of file
+                while len(purchases) < count and status is PurchaseStatus.OK:
+                    candidates = [
+                        listing_id
+                        for listing_id in self.order_book.cheapest(
+                            phone_id, count - len(purchases) + len(tried), exclude_seller_id=buyer_id
+                        )
+                        if listing_id not in tried
+                    ]
+                    if not candidates:
+                        status = PurchaseStatus.SOLD_OUT
+                        break
+                    for listing_id in candidates:
+                        tried.add(listing_id)
+                        conn.execute("SAVEPOINT buy_listing")
+                        result = self._purchase_listing(conn, listing_id, buyer_id)
+                        if result.ok:
+                            conn.execute("RELEASE buy_listing")
+                            purchases.append(result)
+                            if len(purchases) == count:
+                                break
+                            continue
+                        conn.execute("ROLLBACK TO buy_listing")
+                        conn.execute("RELEASE buy_listing")
+                        if result.status is PurchaseStatus.SOLD_OUT:
+                            gone.append(listing_id)
+                        elif result.status is not PurchaseStatus.OWN_LISTING:
+                            status = result.status
+                            break
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+        for listing_id in gone:
+            self.order_book.remove(listing_id)
+        for result in purchases:
+            self.order_book.remove(result.listing_id)
+        if purchases:
+            self.users.invalidate(buyer_id, *(result.seller_user_id for result in purchases))
+            self.wake_market_feed()
+        return purchases, status
+
+    def _purchase_listing(self, conn, listing_id, buyer_id):
+        listing = conn.execute(CLAIM_LISTING_SQL, (listing_id, buyer_id)).fetchone()
+        if not listing:
+            listing_row = conn.execute(LISTING_SELLER_SQL, (listing_id,)).fetchone()
+            return PurchaseResult(claim_failure_status(listing_row, buyer_id), listing_id)
+
+        price = listing['price_signals']
+        balance_row = conn.execute(DEBIT_BUYER_SQL, (price, buyer_id, price)).fetchone()
+        if not balance_row:
+            user_row = conn.execute(USER_EXISTS_SQL, (buyer_id,)).fetchone()
+            return PurchaseResult(debit_failure_status(user_row), listing_id, price=price)
+
+        conn.execute(CREDIT_SELLER_SQL, (price, listing['seller_user_id']))
+        conn.execute(TRANSFER_ITEM_SQL, (buyer_id, listing['inventory_item_id']))
+        conn.execute(RECORD_TRADE_SQL, (
+            listing_id, listing['phone_id'], listing['seller_user_id'], buyer_id, listing['inventory_item_id'], price,
+        ))
+        conn.execute(RECORD_MARKET_EVENT_SQL, (
+            MarketEvent.SOLD.value, listing_id, listing['phone_id'], price, listing['seller_user_id'], None,
+        ))
+        return PurchaseResult(
+            PurchaseStatus.OK, listing_id,
+            new_balance=balance_row[0],
+            price=price,
+            seller_user_id=listing['seller_user_id'],
+            inventory_item_id=listing['inventory_item_id'],
+            phone_id=listing['phone_id'],
+        )
+
+    def get_candles(self, phone_id, period="1h", limit=CANDLES_LIMIT, before=None):
+        sql, params = build_candles_query(phone_id, period=period, limit=limit, before=before)
+        with self.pool.read() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return candles_payload(rows)
+
+    def get_trade_stats(self, phone_id):
+        now = time.time()
+        with self.pool.read() as conn:
+            stats_row = conn.execute(PHONE_TRADE_STATS_SQL, (phone_id,)).fetchone()
+            hourly_rows = []
+            if stats_row:
+                hourly_rows = conn.execute(HOURLY_CANDLES_SINCE_SQL, (phone_id, stats_since(now))).fetchall()
+        return summarize_trade_stats(stats_row, hourly_rows, now)
+
+    def get_case_table(self, case_id):
+        catalog = self.get_catalog()
+        self.case_engine.sync_version(catalog.version)
+        case_table = self.case_engine.get(case_id)
+        if case_table is None:
+            case_table = self.case_engine.build_from_catalog(catalog, case_id)
+        return case_table
+
+    def open_case(self, user_id, case_id):
+        case_table = self.get_case_table(case_id)
+        if case_table is None:
+            logger.warning(f"Case {case_id} not found or empty")
+            return None
+
+        phone = case_table.table.draw()
+        with self.pool.transaction() as conn:
+            balance_row = conn.execute(
+                DEBIT_CASE_PRICE_SQL, (case_table.price, prize_phone_ids([phone]), user_id, case_table.price)
+            ).fetchone()
+            if not balance_row:
+                return None
+            cursor = conn.execute(
+                "INSERT INTO user_inventory (user_id, phone_id) VALUES (?, ?)",
+                (user_id, phone['phone_id'])
+            )
+        self.users.invalidate(user_id)
+        return {**phone, "inventory_id": cursor.lastrowid, "new_balance": balance_row[0]}
+
+    def open_cases(self, user_id, case_id, count):
+        if not 1 <= count <= MAX_BULK_OPEN:
+            raise ValueError(f"Можно открыть от 1 до {MAX_BULK_OPEN} кейсов за раз")
+        case_table = self.get_case_table(case_id)
+        if case_table is None:
+            logger.warning(f"Case {case_id} not found or empty")
+            return None
+
+        draws = case_table.table.draw_many(count)
+        total_price = case_table.price * count
+        with self.pool.transaction() as conn:
+            balance_row = conn.execute(
+                DEBIT_CASE_PRICE_SQL, (total_price, prize_phone_ids(draws), user_id, total_price)
+            ).fetchone()
+            if not balance_row:
+                return None
+            conn.executemany(
+                "INSERT INTO user_inventory (user_id, phone_id) VALUES (?, ?)",
+                [(user_id, phone['phone_id']) for phone in draws]
+            )
+        self.users.invalidate(user_id)
+        prizes, rolls = summarize_draws(draws)
+        return {"case_id": case_id, "count": count, "new_balance": balance_row[0], "prizes": prizes, "rolls": rolls}
+
+    def get_leaderboard(self, limit=LEADERBOARD_SIZE):
+        limit = max(1, min(int(limit), MAX_LEADERBOARD_SIZE))
+        with self.pool.read() as conn:
+            rows = conn.execute(TOP_PLAYERS_SQL, (limit,)).fetchall()
+        return rank_top_players(rows)
+
+    def get_player_rank(self, user_id):
+        """Место игрока, см. database.get_player_rank."""
+        with self.pool.read() as conn:
+            player = conn.execute(PLAYER_NET_WORTH_SQL, (user_id,)).fetchone()
+            if not player:
+                return None
+            players_above = conn.execute(PLAYERS_ABOVE_SQL, (player["net_worth"],)).fetchone()[0]
+        return player_rank(player, players_above, self.get_rank_snapshot())
+
+    def get_rank_snapshot(self):
+        if not self.ranks.needs_refresh():
+            return self.ranks.snapshot
+        # Перестраивает один поток, остальные пока отвечают по старому снимку
+        if not self.ranks.lock.acquire(blocking=self.ranks.snapshot is None):
+            return self.ranks.snapshot
+        try:
+            if not self.ranks.needs_refresh():
+                return self.ranks.snapshot
+            with self.pool.read() as conn:
+                rows = conn.execute(NET_WORTH_DISTRIBUTION_SQL).fetchall()
+            snapshot = self.ranks.install(build_rank_snapshot(rows))
+        finally:
+            self.ranks.lock.release()
+        logger.info(f"Net worth distribution rebuilt: {snapshot.total_players} players")
+        return snapshot
+
+
+metrics.instrument_class(GameDatabase, "web", exclude={"init_database", "close", "wake_market_feed"})
@@ -0,0 +1,140 @@
+# utils/db_pool.py
+# Синхронный пул соединений sqlite3 для веб-API (потоки Flask)
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from utils import metrics
+from utils.schema import PRAGMAS
+
+logger = logging.getLogger(__name__)
+
+
+class SyncConnectionPool:
+    """Пул sqlite3 для многопоточного сервера: один писатель и до N читателей.
+
+    Читатель выдаётся потоку на время одного вызова и возвращается в пул,
+    поэтому соединения переживают запросы, даже если сервер создаёт поток
+    на каждый запрос. Писатель один и сериализуется threading.Lock;
+    транзакции открываются явно (BEGIN IMMEDIATE), соединения в autocommit.
+    """
+
+    def __init__(self, path, readers=8, statement_cache=256, timeout=5.0, name="web"):
+        self.path = path
+        self.name = name
+        self.readers = max(1, readers)
+        self.statement_cache = statement_cache
+        self.timeout = timeout
+        self._idle_readers = queue.LifoQueue()
+        self._created_readers = 0
+        self._readers_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self._closed = False
+        self._timed = metrics.ENABLED
+        # Соединение -> metrics.StatementTrace (только при metrics.TRACE_SQL)
+        self._traces = {}
+
+    def _connect(self, readonly=False):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.statement_cache,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if readonly:
+            conn.execute("PRAGMA query_only = ON")
+        if metrics.TRACE_SQL:
+            trace = self._traces[conn] = metrics.StatementTrace(self.name)
+            conn.set_trace_callback(trace)
+        return conn
+
+    def _checked_out(self, conn, mode, started):
+        metrics.CONNECTION_WAIT_SECONDS.observe(time.perf_counter() - started, self.name, mode)
+        trace = self._traces.get(conn)
+        if trace is not None:
+            trace.reset()
+
+    def _checked_in(self, conn):
+        trace = self._traces.get(conn)
+        if trace is None:
+            return
+        for statement, sql, seconds in trace.finish():
+            plan = None
+            if metrics.wants_plan(sql, statement):
+                try:
+                    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+                except sqlite3.Error:
+                    pass
+            metrics.record_slow_query(self.name, statement, sql, seconds, plan)
+
+    @contextmanager
+    def read(self):
+        if self._closed:
+            raise RuntimeError("Пул соединений закрыт")
+        started = time.perf_counter()
+        try:
+            conn = self._idle_readers.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._readers_lock:
+                if self._created_readers < self.readers:
+                    self._created_readers += 1
+                    conn = self._connect(readonly=True)
+            if conn is None:
+                conn = self._idle_readers.get(timeout=self.timeout)
+        if self._timed:
+            self._checked_out(conn, "read", started)
+        try:
+            yield conn
+        finally:
+            if self._traces:
+                self._checked_in(conn)
+            self._idle_readers.put(conn)
+
+    @contextmanager
+    def write(self):
+        """Эксклюзивный доступ к писателю без открытия транзакции."""
+        if self._closed:
+            raise RuntimeError("Пул соединений закрыт")
+        started = time.perf_counter()
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            if self._timed:
+                self._checked_out(self._writer, "write", started)
+            try:
+                yield self._writer
+            finally:
+                if self._traces:
+                    self._checked_in(self._writer)
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT на писателе; при исключении ROLLBACK."""
+        with self.write() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        self._closed = True
+        with self._readers_lock:
+            for _ in range(self._created_readers):
+                self._idle_readers.get(timeout=self.timeout).close()
+            self._created_readers = 0
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
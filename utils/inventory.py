@@ -0,0 +1,91 @@
+# utils/inventory.py
+# Общая логика инвентаря для бота (database.py) и веб-API (utils/database.py)
+import base64
+import json
+
+from utils.catalog import attach_phones
+
+INVENTORY_PAGE_SIZE = 50
+MAX_INVENTORY_PAGE_SIZE = 200
+
+# Оба запроса читают только индекс idx_user_inventory_user_phone (user_id, phone_id):
+# rowid (id) хранится в каждой записи индекса, так что таблица не открывается.
+# id в сводке — экземпляр, который можно выставить: MIN(id) только среди невыставленных
+# (проверка по уникальному индексу market_listings.inventory_item_id); NULL, если
+# на рынке уже все экземпляры модели
+INVENTORY_SUMMARY_SQL = """
+    SELECT phone_id, COUNT(*) AS count,
+           MIN(id) FILTER (WHERE NOT EXISTS (
+               SELECT 1 FROM market_listings ml WHERE ml.inventory_item_id = user_inventory.id
+           )) AS id
+    FROM user_inventory
+    WHERE user_id = ?
+    GROUP BY phone_id
+"""
+
+
+def encode_inventory_cursor(phone_id, item_id):
+    raw = json.dumps([phone_id, item_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_inventory_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        phone_id, item_id = json.loads(base64.urlsafe_b64decode(padded))
+        return int(phone_id), int(item_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Некорректный курсор: {cursor!r}") from e
+
+
+def build_inventory_items_query(user_id, limit=INVENTORY_PAGE_SIZE, cursor=None, phone_id=None):
+    """Keyset-запрос страницы отдельных предметов: (sql, params, limit).
+
+    Порядок — (phone_id, id), то есть порядок индекса: экземпляры одной модели
+    идут подряд, и страница читается без сортировки.
+    """
+    limit = max(1, min(int(limit), MAX_INVENTORY_PAGE_SIZE))
+    conditions, params = ["user_id = ?"], [user_id]
+    if phone_id is not None:
+        conditions.append("phone_id = ?")
+        params.append(phone_id)
+    if cursor:
+        conditions.append("(phone_id, id) > (?, ?)")
+        params.extend(decode_inventory_cursor(cursor))
+    sql = f"""
+        SELECT id, phone_id
+        FROM user_inventory
+        WHERE {' AND '.join(conditions)}
+        ORDER BY phone_id, id
+        LIMIT ?
+    """
+    params.append(limit + 1)
+    return sql, params, limit
+
+
+def paginate_inventory_rows(rows, limit, catalog):
+    items = attach_phones(rows[:limit], catalog)
+    next_cursor = None
+    if len(rows) > limit and items:
+        last = items[-1]
+        next_cursor = encode_inventory_cursor(last["phone_id"], last["id"])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def summarize_inventory(rows, catalog):
+    """Сводка по результату INVENTORY_SUMMARY_SQL.
+
+    {"models": [...], "total_count", "total_value"}; у каждой модели есть count,
+    total_value и id невыставленного экземпляра (его можно выставить на продажу;
+    None, если на рынке уже все).
+    Модели отсортированы по суммарной стоимости.
+    """
+    models = attach_phones(rows, catalog)
+    for model in models:
+        model["total_value"] = (model["value"] or 0) * model["count"]
+    models.sort(key=lambda model: (-model["total_value"], model["phone_id"]))
+    return {
+        "models": models,
+        "total_count": sum(model["count"] for model in models),
+        "total_value": sum(model["total_value"] for model in models),
+    }
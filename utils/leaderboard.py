@@ -0,0 +1,114 @@
+# utils/leaderboard.py
+# Рейтинг игроков по состоянию (сигналы + стоимость телефонов) для бота
+# (database.py) и веб-API (utils/database.py)
+import bisect
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+
+# Совпадает с выражением индекса idx_users_net_worth (utils/schema.py), иначе
+# планировщик его не использует. Как поддерживается inventory_value — там же
+NET_WORTH = "signals + inventory_value"
+
+LEADERBOARD_SIZE = 10
+MAX_LEADERBOARD_SIZE = 100
+# Пока выше игрока меньше стольких игроков, ранг точно считается по индексу
+EXACT_RANK_LIMIT = 1000
+# Как часто перестраивать распределение состояний для остальных рангов
+RANK_REFRESH_SECONDS = 60.0
+
+TOP_PLAYERS_SQL = f"""
+    SELECT id, telegram_id, signals, inventory_value, {NET_WORTH} AS net_worth
+    FROM users
+    ORDER BY {NET_WORTH} DESC, id
+    LIMIT ?
+"""
+PLAYER_NET_WORTH_SQL = f"""
+    SELECT id, telegram_id, signals, inventory_value, {NET_WORTH} AS net_worth
+    FROM users WHERE id = ?
+"""
+# Поиск по индексу, но не дальше EXACT_RANK_LIMIT записей
+PLAYERS_ABOVE_SQL = f"""
+    SELECT COUNT(*) FROM (SELECT 1 FROM users WHERE {NET_WORTH} > ? LIMIT {EXACT_RANK_LIMIT})
+"""
+# Один проход по индексу; одинаковых состояний много (стартовый набор), строк меньше, чем игроков
+NET_WORTH_DISTRIBUTION_SQL = f"""
+    SELECT {NET_WORTH} AS net_worth, COUNT(*) AS players
+    FROM users WHERE {NET_WORTH} IS NOT NULL
+    GROUP BY 1 ORDER BY 1
+"""
+
+
+@dataclass(frozen=True)
+class RankSnapshot:
+    """Распределение состояний: net_worths по возрастанию и накопленное число игроков.
+
+    players_below[i] — сколько игроков беднее net_worths[i]; последний элемент — все
+    игроки. Ранг по нему — бинарный поиск, O(log n) при любом числе игроков.
+    """
+    net_worths: array
+    players_below: array
+    built_at: float
+
+    @property
+    def total_players(self):
+        return self.players_below[-1]
+
+    def players_above(self, net_worth):
+        return self.total_players - self.players_below[bisect.bisect_right(self.net_worths, net_worth)]
+
+
+def build_rank_snapshot(rows):
+    """Снимок из строк NET_WORTH_DISTRIBUTION_SQL."""
+    net_worths, players_below = array("q"), array("q", [0])
+    for net_worth, players in rows:
+        net_worths.append(net_worth)
+        players_below.append(players_below[-1] + players)
+    return RankSnapshot(net_worths, players_below, time.monotonic())
+
+
+def player_rank(player, players_above, snapshot):
+    """Место игрока: {"rank", "exact", "total_players", "net_worth", ...}.
+
+    Одинаковое состояние — одинаковое место. Если точный подсчёт упёрся в
+    EXACT_RANK_LIMIT, место берётся из снимка (устаревшего не больше чем на
+    RANK_REFRESH_SECONDS), но не выше EXACT_RANK_LIMIT + 1.
+    """
+    exact = players_above < EXACT_RANK_LIMIT
+    if not exact:
+        players_above = max(players_above, snapshot.players_above(player["net_worth"]))
+    return {
+        **dict(player),
+        "rank": players_above + 1,
+        "exact": exact,
+        "total_players": max(snapshot.total_players, players_above + 1),
+    }
+
+
+def rank_top_players(rows):
+    """Строки TOP_PLAYERS_SQL с местами; при равном состоянии место общее."""
+    players = []
+    for index, row in enumerate(rows):
+        player = dict(row)
+        tied = players and players[-1]["net_worth"] == player["net_worth"]
+        player["rank"] = players[-1]["rank"] if tied else index + 1
+        players.append(player)
+    return players
+
+
+class RankCache:
+    """Текущий RankSnapshot; перестраивает его вызывающая сторона (async или sync),
+    когда needs_refresh(), и передаёт в install()."""
+
+    def __init__(self, refresh_seconds=RANK_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+    def needs_refresh(self):
+        return self.snapshot is None or time.monotonic() - self.snapshot.built_at >= self.refresh_seconds
+
+    def install(self, snapshot):
+        self.snapshot = snapshot
+        return snapshot
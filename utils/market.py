@@ -0,0 +1,201 @@
+# utils/market.py
+# Общая логика рынка для бота (database.py) и веб-API (utils/database.py)
+import base64
+import json
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional
+
+from utils.catalog import attach_phones
+
+MARKET_PAGE_SIZE = 50
+MAX_MARKET_PAGE_SIZE = 200
+
+
+def encode_cursor(listed_at, listing_id):
+    raw = json.dumps([listed_at, listing_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        listed_at, listing_id = json.loads(base64.urlsafe_b64decode(padded))
+        return str(listed_at), int(listing_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Некорректный курсор: {cursor!r}") from e
+
+
+def build_market_listings_query(limit=MARKET_PAGE_SIZE, cursor=None, rarity=None, brand=None,
+                                phone_id=None, min_price=None, max_price=None,
+                                seller_id=None, exclude_seller_id=None, join_sellers=True):
+    """Собирает keyset-запрос страницы рынка: (sql, params, limit).
+
+    Порядок — listed_at DESC, id DESC; курсор указывает на последний лот
+    предыдущей страницы. Запрашивается limit + 1 строк, чтобы понять,
+    есть ли следующая страница (см. paginate_market_rows).
+    Фильтры по phone_id, продавцу, редкости и бренду (копии из phones в лоте)
+    идут по составным индексам (столбец, listed_at, id); цена и "кроме продавца"
+    проверяются в покрывающем idx_market_listings_listed_covering. Сортировки
+    нет ни в одном сочетании (tests/test_market_plans.py).
+    join_sellers=False — без JOIN users: seller_id остаётся users.id (строки
+    игроков в файлах шардов, telegram_id подставляет вызывающий).
+    """
+    limit = max(1, min(int(limit), MAX_MARKET_PAGE_SIZE))
+    conditions, params = [], []
+
+    if phone_id is not None:
+        conditions.append("ml.phone_id = ?")
+        params.append(phone_id)
+    # Колонки объявлены COLLATE NOCASE, поэтому сравнение без учёта регистра идёт по индексу
+    if rarity:
+        conditions.append("ml.rarity = ?")
+        params.append(rarity)
+    if brand:
+        conditions.append("ml.brand = ?")
+        params.append(brand)
+    if seller_id is not None:
+        conditions.append("ml.seller_user_id = ?")
+        params.append(seller_id)
+    if exclude_seller_id is not None:
+        conditions.append("ml.seller_user_id != ?")
+        params.append(exclude_seller_id)
+    if min_price is not None:
+        conditions.append("ml.price_signals >= ?")
+        params.append(min_price)
+    if max_price is not None:
+        conditions.append("ml.price_signals <= ?")
+        params.append(max_price)
+    if cursor:
+        conditions.append("(ml.listed_at, ml.id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # Поля телефона берутся из снимка каталога (paginate_market_rows), а не JOIN phones.
+    # CROSS JOIN фиксирует порядок соединения: внешним остаётся market_listings
+    seller, sellers_join = "u.telegram_id", "CROSS JOIN users u ON u.id = ml.seller_user_id"
+    if not join_sellers:
+        seller, sellers_join = "ml.seller_user_id", ""
+    sql = f"""
+        SELECT
+            ml.id,
+            ml.phone_id,
+            ml.price_signals,
+            ml.listed_at,
+            {seller} AS seller_id
+        FROM market_listings ml
+        {sellers_join}
+        {where}
+        ORDER BY ml.listed_at DESC, ml.id DESC
+        LIMIT ?
+    """
+    params.append(limit + 1)
+    return sql, params, limit
+
+
+def paginate_market_rows(rows, limit, catalog):
+    items = attach_phones(rows[:limit], catalog)
+    next_cursor = None
+    if len(rows) > limit and items:
+        last = items[-1]
+        next_cursor = encode_cursor(last["listed_at"], last["id"])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+# --- Лента изменений ---
+class MarketEvent(str, Enum):
+    ADDED = "added"
+    REMOVED = "removed"
+    SOLD = "sold"
+
+
+# Пишется в транзакции изменения лота; раздаёт подписчикам utils/market_feed.py
+RECORD_MARKET_EVENT_SQL = """
+    INSERT INTO market_events (kind, listing_id, phone_id, price_signals, seller_user_id, listed_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+INSERT_LISTING_SQL = """
+    INSERT INTO market_listings (seller_user_id, inventory_item_id, phone_id, rarity, brand, price_signals)
+    SELECT ?, ui.id, ui.phone_id, p.rarity, p.brand, ?
+    FROM user_inventory ui LEFT JOIN phones p ON p.id = ui.phone_id
+    WHERE ui.id = ? AND ui.user_id = ?
+    RETURNING id, phone_id, listed_at
+"""
+DELETE_LISTING_SQL = "DELETE FROM market_listings WHERE id = ? RETURNING phone_id, price_signals, seller_user_id"
+
+
+def listing_added_event(listing, user_id, price):
+    """Параметры RECORD_MARKET_EVENT_SQL по строке INSERT_LISTING_SQL."""
+    return (MarketEvent.ADDED.value, listing["id"], listing["phone_id"], price, user_id, listing["listed_at"])
+
+
+# --- Покупка лота ---
+# Лот "забирается" удалением: из двух гонящихся покупателей DELETE ... RETURNING
+# вернёт строку только первому, второй увидит SOLD_OUT
+CLAIM_LISTING_SQL = """
+    DELETE FROM market_listings
+    WHERE id = ? AND seller_user_id != ?
+    RETURNING seller_user_id, inventory_item_id, phone_id, price_signals, listed_at
+"""
+# Баланс проверяется и списывается одним выражением, без арифметики в Python
+DEBIT_BUYER_SQL = "UPDATE users SET signals = signals - ? WHERE id = ? AND signals >= ? RETURNING signals"
+CREDIT_SELLER_SQL = "UPDATE users SET signals = signals + ? WHERE id = ?"
+TRANSFER_ITEM_SQL = "UPDATE user_inventory SET user_id = ? WHERE id = ?"
+# Запись в журнал сделок; свечи и итоги по модели обновляет триггер (utils/schema.py)
+RECORD_TRADE_SQL = """
+    INSERT INTO trades (listing_id, phone_id, seller_user_id, buyer_user_id, inventory_item_id, price_signals)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+LISTING_SELLER_SQL = "SELECT seller_user_id FROM market_listings WHERE id = ?"
+USER_EXISTS_SQL = "SELECT 1 FROM users WHERE id = ?"
+
+
+class PurchaseStatus(Enum):
+    OK = "ok"
+    SOLD_OUT = "sold_out"  # лота нет: продан, снят или не существовал
+    OWN_LISTING = "own_listing"
+    INSUFFICIENT_FUNDS = "insufficient_funds"
+    NOT_FOUND = "not_found"  # покупатель не найден
+
+
+@dataclass(frozen=True)
+class PurchaseResult:
+    status: PurchaseStatus
+    listing_id: int
+    new_balance: Optional[int] = None
+    price: Optional[int] = None
+    seller_user_id: Optional[int] = None
+    inventory_item_id: Optional[int] = None
+    phone_id: Optional[int] = None
+
+    @property
+    def ok(self):
+        return self.status is PurchaseStatus.OK
+
+
+class ListingStatus(Enum):
+    OK = "ok"
+    NOT_FOUND = "not_found"  # предмета нет в инвентаре продавца (или он уже продан)
+    ALREADY_LISTED = "already_listed"
+
+
+@dataclass(frozen=True)
+class ListingResult:
+    status: ListingStatus
+    listing_id: Optional[int] = None
+
+    @property
+    def ok(self):
+        return self.status is ListingStatus.OK
+
+
+def claim_failure_status(listing_row, buyer_id):
+    """Почему не удалось забрать лот: listing_row — результат LISTING_SELLER_SQL."""
+    if listing_row and listing_row[0] == buyer_id:
+        return PurchaseStatus.OWN_LISTING
+    return PurchaseStatus.SOLD_OUT
+
+
+def debit_failure_status(user_row):
+    """Почему не удалось списать сигналы: user_row — результат USER_EXISTS_SQL."""
+    return PurchaseStatus.INSUFFICIENT_FUNDS if user_row else PurchaseStatus.NOT_FOUND
@@ -0,0 +1,150 @@
+# utils/market_feed.py
+# Лента изменений рынка для подписчиков веб-API (index.py: /api/market/events, SSE).
+# События пишут в market_events бот и веб-API в транзакциях лотов (utils/market.py),
+# здесь — чтение новых строк и раздача готовых кадров
+import json
+import logging
+import threading
+import time
+
+from utils.catalog import attach_phones
+
+logger = logging.getLogger(__name__)
+
+# Как часто опрашивать market_events: события бота приходят из другого процесса
+FEED_POLL_SECONDS = 0.5
+FEED_BATCH_SIZE = 1000
+# Сколько последних событий держать в памяти для возобновления по Last-Event-ID
+FEED_BUFFER_SIZE = 10_000
+# Сколько событий хранить в БД и как часто удалять более старые
+FEED_RETENTION = 100_000
+FEED_TRIM_SECONDS = 60.0
+# Комментарий в потоке раз в столько секунд: прокси не закрывают "тихое" соединение
+HEARTBEAT_SECONDS = 15.0
+
+# Поля лота как в /api/market (id — это listing_id), чтобы клиент вставлял added без перезапроса
+MARKET_EVENTS_SINCE_SQL = """
+    SELECT e.seq, e.kind, e.listing_id AS id, e.phone_id, e.price_signals, e.listed_at,
+           e.seller_user_id, u.telegram_id AS seller_id
+    FROM market_events e
+    LEFT JOIN users u ON u.id = e.seller_user_id
+    WHERE e.seq > ?
+    ORDER BY e.seq
+    LIMIT ?
+"""
+LAST_MARKET_EVENT_SQL = "SELECT COALESCE(MAX(seq), 0) FROM market_events"
+TRIM_MARKET_EVENTS_SQL = "DELETE FROM market_events WHERE seq <= ?"
+
+# users.id продавца нужен книге заявок, наружу уходит только telegram_id
+_PRIVATE_FIELDS = ("seller_user_id",)
+
+
+def build_feed_events(rows, catalog):
+    """Строки MARKET_EVENTS_SINCE_SQL с полями телефона из снимка каталога."""
+    events = attach_phones(rows, catalog)
+    for event in events:
+        event["rarity"] = (event["rarity"] or "common").lower()
+        for name in _PRIVATE_FIELDS:
+            event.pop(name, None)
+    return events
+
+
+def format_event(event):
+    """Кадр SSE: id — seq события, тип — kind, данные — JSON в одну строку."""
+    data = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+    return f"id: {event['seq']}\nevent: {event['kind']}\ndata: {data}\n\n"
+
+
+def format_reset(seq):
+    """Клиент отстал больше, чем помнит лента: перечитать рынок и продолжать с seq."""
+    return f"id: {seq}\nevent: reset\ndata: {json.dumps({'seq': seq})}\n\n"
+
+
+class MarketFeed:
+    """Последние события рынка, сериализованные в кадры SSE один раз на процесс.
+
+    Поток опроса публикует новые события и будит всех подписчиков одним
+    notify_all; подписчик только берёт срез готовых кадров после своего seq,
+    так что цена события не зависит от числа подписчиков. seq идут подряд
+    (писатель в SQLite один), поэтому кадр находится по смещению от первого.
+    """
+
+    def __init__(self, head, buffer_size=FEED_BUFFER_SIZE):
+        self.head = head  # seq последнего опубликованного события
+        self.buffer_size = buffer_size
+        self.trimmed_at = time.monotonic()
+        self._first_seq = head + 1  # seq первого кадра в self._frames
+        self._frames = []
+        self._changed = threading.Condition()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def publish(self, events):
+        """events — словари с "seq" и "kind" по возрастанию seq."""
+        if not events:
+            return
+        frames = [format_event(event) for event in events]
+        with self._changed:
+            if events[0]["seq"] != self.head + 1:
+                # Разрыв (строки удалены в обход ленты): старые кадры не продолжают новые
+                self._frames, self._first_seq = [], events[0]["seq"]
+            self._frames.extend(frames)
+            self.head = events[-1]["seq"]
+            # Список обрезается пачками, а не на каждое событие
+            if len(self._frames) > 2 * self.buffer_size:
+                dropped = len(self._frames) - self.buffer_size
+                del self._frames[:dropped]
+                self._first_seq += dropped
+            self._changed.notify_all()
+
+    def frames_after(self, seq):
+        """Кадры событий после seq; None — если они вытеснены из памяти или seq впереди ленты."""
+        with self._changed:
+            return self._frames_after(seq)
+
+    def wait(self, seq, timeout=HEARTBEAT_SECONDS):
+        """Как frames_after, но если новых событий нет — ждёт их до timeout ([] — не дождались)."""
+        with self._changed:
+            if seq == self.head:
+                self._changed.wait(timeout)
+            return self._frames_after(seq)
+
+    def _frames_after(self, seq):
+        # seq впереди ленты: Last-Event-ID от прежней БД или после сброса market_events,
+        # такой клиент не дождался бы своих событий — только reset
+        if seq > self.head:
+            return None
+        if seq == self.head:
+            return []
+        if seq < self._first_seq - 1:
+            return None
+        return self._frames[seq - self._first_seq + 1:]
+
+    def needs_trim(self, trim_seconds=FEED_TRIM_SECONDS):
+        return time.monotonic() - self.trimmed_at >= trim_seconds
+
+    def start(self, poll, interval=FEED_POLL_SECONDS):
+        """Фоновый поток: poll() раз в interval секунд или сразу после wake()."""
+        def run():
+            while not self._stopped:
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+                try:
+                    poll()
+                except Exception:
+                    logger.exception("Ошибка опроса ленты рынка")
+
+        self._thread = threading.Thread(target=run, name="market-feed", daemon=True)
+        self._thread.start()
+        return self
+
+    def wake(self):
+        """Опросить БД сейчас: процесс сам только что закоммитил событие."""
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,344 @@
+# utils/metrics.py
+# Метрики слоя данных и обработчиков: гистограммы задержек и числа строк,
+# ожидание соединений пула, время выражений SQL и медленные запросы с планом.
+# Экспорт — текстовый формат Prometheus (index.py: /metrics, вебхук бота: /metrics)
+import asyncio
+import bisect
+import contextvars
+import functools
+import hmac
+import inspect
+import os
+import re
+import threading
+import time
+from collections import deque
+
+# METRICS_ENABLED=0 выключает всё: функции не оборачиваются, трассировка SQL не ставится
+ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+# Выражение дольше этого попадает в медленные, с EXPLAIN QUERY PLAN. Для этого на
+# соединения ставится trace callback (~1-3 мкс на выражение); 0 — не трассировать SQL
+SLOW_QUERY_SECONDS = float(os.environ.get("METRICS_SLOW_QUERY_MS", "50")) / 1000
+TRACE_SQL = ENABLED and SLOW_QUERY_SECONDS > 0
+SLOW_QUERY_SAMPLES = 50
+# Эндпоинты метрик отдают текст SQL и планы: без токена они закрыты (404),
+# с токеном — только запросам с заголовком "Authorization: Bearer <METRICS_TOKEN>"
+TOKEN = os.environ.get("METRICS_TOKEN", "")
+# План одного и того же выражения снимается не чаще раза в EXPLAIN_INTERVAL секунд
+EXPLAIN_INTERVAL = 60.0
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # значения меток -> [счётчики по корзинам + +Inf, сумма]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for label_values, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {values[-1]:.6f}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, *args, **kwargs):
+        self.metrics.append(Counter(*args, **kwargs))
+        return self.metrics[-1]
+
+    def histogram(self, *args, **kwargs):
+        self.metrics.append(Histogram(*args, **kwargs))
+        return self.metrics[-1]
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+DB_CALL_SECONDS = REGISTRY.histogram(
+    "db_call_seconds", "Время вызова функции слоя данных", ("layer", "function"))
+DB_CALL_ROWS = REGISTRY.histogram(
+    "db_call_rows", "Строк (элементов) в результате функции слоя данных", ("layer", "function"), ROW_BUCKETS)
+DB_CALL_ERRORS = REGISTRY.counter(
+    "db_call_errors_total", "Исключения в функциях слоя данных", ("layer", "function"))
+HANDLER_SECONDS = REGISTRY.histogram(
+    "handler_seconds", "Время обработчика апдейта бота или HTTP-запроса", ("kind", "handler"))
+HANDLER_ERRORS = REGISTRY.counter(
+    "handler_errors_total", "Исключения в обработчиках", ("kind", "handler"))
+CONNECTION_WAIT_SECONDS = REGISTRY.histogram(
+    "db_connection_wait_seconds", "Ожидание соединения из пула", ("pool", "mode"))
+SLOW_QUERIES = REGISTRY.counter(
+    "db_slow_queries_total", "Выражения дольше METRICS_SLOW_QUERY_MS", ("pool", "statement"))
+
+# Последние медленные выражения: {"pool", "statement", "sql", "seconds", "plan", "at"}
+slow_queries = deque(maxlen=SLOW_QUERY_SAMPLES)
+_explained_at = {}
+
+
+def render():
+    return REGISTRY.render()
+
+
+def authorized(authorization):
+    """Проверка заголовка Authorization запроса к эндпоинтам метрик."""
+    if not TOKEN:
+        return False
+    # Байты: compare_digest не сравнивает строки с не-ASCII символами
+    return hmac.compare_digest((authorization or "").encode(), f"Bearer {TOKEN}".encode())
+
+
+# --- SQL ---
+_COMMENT_RE = re.compile(r"--[^\n]*")
+_LITERALS_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_EXPLAINABLE_RE = re.compile(r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    """Выражение без литералов — метка метрики, общая для всех параметров."""
+    statement = _LITERALS_RE.sub("?", _COMMENT_RE.sub("", sql))
+    statement = _IN_LIST_RE.sub("(?, ...)", statement)
+    return " ".join(statement.split())[:200]
+
+
+def wants_plan(sql, statement):
+    if not _EXPLAINABLE_RE.match(sql):
+        return False
+    now = time.monotonic()
+    if now - _explained_at.get(statement, -EXPLAIN_INTERVAL) < EXPLAIN_INTERVAL:
+        return False
+    _explained_at[statement] = now
+    return True
+
+
+def record_slow_query(pool, statement, sql, seconds, plan_rows):
+    slow_queries.append({
+        "pool": pool,
+        "statement": statement,
+        "sql": sql[:2000],
+        "seconds": round(seconds, 6),
+        "plan": [row[-1] for row in plan_rows] if plan_rows is not None else None,
+        "at": time.time(),
+    })
+
+
+class StatementTrace:
+    """trace callback соединения: выражения между выдачей из пула и возвратом.
+
+    SQLite сообщает только начало выражения, поэтому выражение длится до начала
+    следующего или до возврата соединения — вместе с выборкой строк. Получается
+    время с точки зрения вызывающего кода.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._statements = []
+
+    def __call__(self, sql):
+        # Выражения триггеров приходят как "-- имя"; EXPLAIN снимаем сами
+        if not sql.startswith(("--", "EXPLAIN")):
+            self._statements.append((time.perf_counter(), sql))
+
+    def reset(self):
+        self._statements = []
+
+    def finish(self):
+        """Медленные выражения отрезка: [(statement, sql, seconds)].
+
+        Нормализуются (и попадают в метрики) только медленные: разбор каждого
+        выражения регулярками стоил бы больше самих быстрых запросов.
+        """
+        finished = time.perf_counter()
+        statements, self._statements = self._statements, []
+        slow = []
+        for index, (started, sql) in enumerate(statements):
+            ended = statements[index + 1][0] if index + 1 < len(statements) else finished
+            seconds = ended - started
+            if seconds >= SLOW_QUERY_SECONDS:
+                statement = normalize_sql(sql)
+                SLOW_QUERIES.inc(self.pool, statement)
+                slow.append((statement, sql, seconds))
+        return slow
+
+
+# --- Обёртки функций ---
+def count_rows(result):
+    """Сколько строк вернула функция: длина списка или страницы ("items", "models", ...)."""
+    if result is None:
+        return 0
+    if isinstance(result, dict):
+        for key in ("items", "models", "prizes"):
+            if isinstance(result.get(key), (list, tuple)):
+                return len(result[key])
+        return 1
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 1
+
+
+# Функция слоя данных, которая сейчас измеряется (своя у каждого потока и задачи asyncio)
+_measuring = contextvars.ContextVar("metrics_measuring", default=False)
+
+
+def instrument(func, layer, name=None):
+    """Оборачивает функцию слоя данных таймером; при выключенных метриках — как есть.
+
+    Измеряется только внешний вызов: публичные функции, вызванные из другой
+    обёрнутой (get_user_by_telegram_id из create_user_if_not_exists),
+    входят в её время и не считаются второй раз.
+    """
+    if not ENABLED:
+        return func
+    labels = (layer, name or func.__name__)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def timed(*args, **kwargs):
+            if _measuring.get():
+                return await func(*args, **kwargs)
+            token = _measuring.set(True)
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception:
+                DB_CALL_ERRORS.inc(*labels)
+                raise
+            finally:
+                DB_CALL_SECONDS.observe(time.perf_counter() - started, *labels)
+                _measuring.reset(token)
+            DB_CALL_ROWS.observe(count_rows(result), *labels)
+            return result
+    else:
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            if _measuring.get():
+                return func(*args, **kwargs)
+            token = _measuring.set(True)
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                DB_CALL_ERRORS.inc(*labels)
+                raise
+            finally:
+                DB_CALL_SECONDS.observe(time.perf_counter() - started, *labels)
+                _measuring.reset(token)
+            DB_CALL_ROWS.observe(count_rows(result), *labels)
+            return result
+    return timed
+
+
+def background_task(coro):
+    """Фоновая задача asyncio, чьи вызовы слоя данных измеряются сами по себе.
+
+    Задача копирует контекст создавшего её кода; запущенная из обёрнутой функции
+    (warm_order_book -> опрос книги заявок), она унаследовала бы "уже измеряется"
+    и не попала бы в метрики. Здесь флаг в копии контекста сбрасывается.
+    """
+    context = contextvars.copy_context()
+    context.run(_measuring.set, False)
+    return asyncio.get_running_loop().create_task(coro, context=context)
+
+
+def instrument_module(namespace, layer, exclude=()):
+    """Оборачивает публичные функции модуля (передавать globals())."""
+    if not ENABLED:
+        return
+    for name, obj in list(namespace.items()):
+        if (not name.startswith("_") and name not in exclude and inspect.isfunction(obj)
+                and obj.__module__ == namespace["__name__"]):
+            namespace[name] = instrument(obj, layer)
+
+
+def instrument_class(cls, layer, exclude=()):
+    """Оборачивает публичные методы класса."""
+    if not ENABLED:
+        return cls
+    for name, obj in list(vars(cls).items()):
+        if not name.startswith("_") and name not in exclude and inspect.isfunction(obj):
+            setattr(cls, name, instrument(obj, layer))
+    return cls
+
+
+def instrument_handler(handler, kind="bot"):
+    """Таймер для обработчика апдейтов бота."""
+    if not ENABLED:
+        return handler
+    labels = (kind, handler.__name__)
+
+    @functools.wraps(handler)
+    async def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(*labels)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, *labels)
+    return timed
@@ -0,0 +1,154 @@
+# utils/order_book.py
+# Книга заявок на продажу по моделям телефонов (phone_id) в памяти процесса
+import heapq
+import threading
+
+from utils.market import MarketEvent
+
+ORDER_BOOK_SQL = "SELECT id, phone_id, price_signals, listed_at, seller_user_id FROM market_listings"
+# События market_events после seq — изменения рынка, сделанные другими процессами
+ORDER_BOOK_EVENTS_SQL = """
+    SELECT seq, kind, listing_id AS id, phone_id, price_signals, listed_at, seller_user_id
+    FROM market_events
+    WHERE seq > ?
+    ORDER BY seq
+    LIMIT ?
+"""
+
+class OrderBook:
+    """Лоты рынка, упорядоченные по цене внутри каждой модели.
+
+    На каждую модель — куча (цена, listed_at, listing_id, продавец). Удаление ленивое:
+    запись в куче жива, только пока она же лежит в self._live, поэтому
+    повторно выданный SQLite listing_id не "воскрешает" старую цену.
+    БД остаётся источником истины: книга прогревается из неё (load),
+    обновляется после каждого успешного коммита (add / remove) и догоняет
+    чужие коммиты по market_events (apply_events).
+    """
+
+    def __init__(self):
+        self._heaps = {}  # phone_id -> [(price, listed_at, listing_id, seller_user_id)]
+        self._live = {}  # listing_id -> запись из кучи
+        self._depth = {}  # phone_id -> число живых лотов
+        self._lock = threading.Lock()
+
+    def load(self, rows):
+        """Полная перезагрузка из строк (id, phone_id, price_signals, listed_at, seller_user_id)."""
+        heaps, live, depth = {}, {}, {}
+        for row in rows:
+            entry = (row["price_signals"], row["listed_at"], row["id"], row["seller_user_id"])
+            heaps.setdefault(row["phone_id"], []).append(entry)
+            live[row["id"]] = (row["phone_id"], entry)
+            depth[row["phone_id"]] = depth.get(row["phone_id"], 0) + 1
+        for heap in heaps.values():
+            heapq.heapify(heap)
+        with self._lock:
+            self._heaps, self._live, self._depth = heaps, live, depth
+
+    def add(self, listing_id, phone_id, price, listed_at, seller_user_id):
+        entry = (price, listed_at, listing_id, seller_user_id)
+        with self._lock:
+            self._discard(listing_id)
+            heapq.heappush(self._heaps.setdefault(phone_id, []), entry)
+            self._live[listing_id] = (phone_id, entry)
+            self._depth[phone_id] = self._depth.get(phone_id, 0) + 1
+
+    def remove(self, listing_id):
+        with self._lock:
+            return self._discard(listing_id)
+
+    def apply_events(self, rows):
+        """Строки market_events по возрастанию seq (id — listing_id).
+
+        Свои события процесс видит повторно — это безопасно: add заменяет лот, remove идемпотентен.
+        """
+        for row in rows:
+            if row["kind"] == MarketEvent.ADDED.value:
+                self.add(row["id"], row["phone_id"], row["price_signals"], row["listed_at"], row["seller_user_id"])
+            else:
+                self.remove(row["id"])
+
+    def _discard(self, listing_id):
+        record = self._live.pop(listing_id, None)
+        if record is None:
+            return False
+        phone_id = record[0]
+        self._depth[phone_id] -= 1
+        heap = self._heaps[phone_id]
+        # Чистим кучу, когда мёртвых записей становится больше живых
+        if len(heap) > 2 * self._depth[phone_id] + 16:
+            heap[:] = [entry for entry in heap if self._is_live(entry)]
+            heapq.heapify(heap)
+        return True
+
+    def _is_live(self, entry):
+        record = self._live.get(entry[2])
+        return record is not None and record[1] is entry
+
+    def _prune(self, heap):
+        while heap and not self._is_live(heap[0]):
+            heapq.heappop(heap)
+
+    def best_ask(self, phone_id):
+        """Самый дешёвый лот модели: {"listing_id", "price", "listed_at", "seller_user_id"} или None."""
+        with self._lock:
+            heap = self._heaps.get(phone_id)
+            if not heap:
+                return None
+            self._prune(heap)
+            if not heap:
+                return None
+            price, listed_at, listing_id, seller_user_id = heap[0]
+            return {"listing_id": listing_id, "price": price, "listed_at": listed_at,
+                    "seller_user_id": seller_user_id}
+
+    def depth(self, phone_id, levels=5):
+        """Число лотов модели и до `levels` ценовых уровней [(цена, количество)]."""
+        price_levels, taken = [], []
+        with self._lock:
+            heap = self._heaps.get(phone_id, [])
+            # Достаём из кучи только лоты первых `levels` цен, затем возвращаем их обратно
+            while heap:
+                entry = heapq.heappop(heap)
+                if not self._is_live(entry):
+                    continue
+                if price_levels and price_levels[-1][0] == entry[0]:
+                    price_levels[-1][1] += 1
+                elif len(price_levels) < levels:
+                    price_levels.append([entry[0], 1])
+                else:
+                    heapq.heappush(heap, entry)
+                    break
+                taken.append(entry)
+            for entry in taken:
+                heapq.heappush(heap, entry)
+            total = self._depth.get(phone_id, 0)
+        return {"count": total, "levels": [tuple(level) for level in price_levels]}
+
+    def cheapest(self, phone_id, count, exclude_seller_id=None):
+        """Кандидаты на покупку: listing_id самых дешёвых лотов модели (книга не меняется)."""
+        with self._lock:
+            heap = self._heaps.get(phone_id)
+            if not heap:
+                return []
+            taken, result = [], []
+            while heap and len(result) < count:
+                entry = heapq.heappop(heap)
+                if not self._is_live(entry):
+                    continue
+                taken.append(entry)
+                if entry[3] != exclude_seller_id:
+                    result.append(entry[2])
+            for entry in taken:
+                heapq.heappush(heap, entry)
+            return result
+
+    def summary(self):
+        """Лучшая цена и глубина по всем моделям: [(phone_id, best_price, count)], дешёвые первыми."""
+        with self._lock:
+            rows = []
+            for phone_id, heap in self._heaps.items():
+                self._prune(heap)
+                if heap:
+                    rows.append((phone_id, heap[0][0], self._depth[phone_id]))
+        return sorted(rows, key=lambda row: row[1])
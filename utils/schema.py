@@ -0,0 +1,384 @@
+# utils/schema.py
+# Общая схема БД для бота (database.py) и веб-API (utils/database.py)
+
+# Прагмы выставляются один раз на каждое соединение при открытии пула
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",  # в WAL-режиме этого достаточно для надёжности
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",  # ~16 МБ страничного кэша на соединение
+    "PRAGMA mmap_size = 268435456",
+)
+
+CREATE_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    telegram_id INTEGER UNIQUE NOT NULL,
+    signals INTEGER DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    inventory_value INTEGER NOT NULL DEFAULT 0 -- Сумма phones.value по инвентарю, ведут триггеры
+);
+
+-- Таблица с телефонами (их типами, не экземплярами)
+CREATE TABLE IF NOT EXISTS phones (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    brand TEXT NOT NULL, -- 'Apple', 'Samsung', 'Google' etc.
+    model_code TEXT, -- 'iPhone15,2', 'SM-S928B' etc.
+    rarity TEXT DEFAULT 'Common', -- 'Common', 'Rare', 'Epic', 'Legendary'
+    value INTEGER DEFAULT 10, -- Базовая стоимость в сигналах
+    image_filename TEXT -- Имя файла изображения в static/images/phones/
+);
+
+-- Таблица с кейсами
+CREATE TABLE IF NOT EXISTS cases (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    price_signals INTEGER DEFAULT 10
+);
+
+-- Таблица с содержимым кейсов (телефон -> шанс)
+CREATE TABLE IF NOT EXISTS case_contents (
+    id INTEGER PRIMARY KEY,
+    case_id INTEGER,
+    phone_id INTEGER,
+    chance REAL, -- Например, 0.5 для 50%
+    FOREIGN KEY (case_id) REFERENCES cases (id),
+    FOREIGN KEY (phone_id) REFERENCES phones (id)
+);
+
+-- Инвентарь пользователя (его телефоны)
+CREATE TABLE IF NOT EXISTS user_inventory (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    phone_id INTEGER,
+    acquired_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id),
+    FOREIGN KEY (phone_id) REFERENCES phones (id)
+);
+
+-- Версия каталога (phones, cases, case_contents), её поднимают триггеры
+CREATE TABLE IF NOT EXISTS catalog_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO catalog_meta (id, version) VALUES (1, 1);
+
+-- Число файлов шардов игроков (DB_SHARDS, utils/shards.py), записывается при первом запуске
+CREATE TABLE IF NOT EXISTS shard_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    shards INTEGER NOT NULL
+);
+
+-- Таблица с товарами на рынке
+CREATE TABLE IF NOT EXISTS market_listings (
+    id INTEGER PRIMARY KEY,
+    seller_user_id INTEGER,
+    inventory_item_id INTEGER UNIQUE,
+    phone_id INTEGER, -- Денормализовано из user_inventory для фильтров и индексов
+    rarity TEXT COLLATE NOCASE, -- Денормализовано из phones (trg_phones_listing_attributes)
+    brand TEXT COLLATE NOCASE,
+    price_signals INTEGER,
+    listed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (seller_user_id) REFERENCES users (id),
+    FOREIGN KEY (inventory_item_id) REFERENCES user_inventory (id),
+    FOREIGN KEY (phone_id) REFERENCES phones (id)
+);
+
+-- Лента изменений рынка для подписчиков (utils/market_feed.py): строка пишется в той же
+-- транзакции, что выставляет, снимает или продаёт лот. Писатель в SQLite один, поэтому
+-- seq растёт в порядке коммитов; AUTOINCREMENT не выдаёт номера повторно после чистки
+CREATE TABLE IF NOT EXISTS market_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL, -- added / removed / sold (utils.market.MarketEvent)
+    listing_id INTEGER NOT NULL,
+    phone_id INTEGER,
+    price_signals INTEGER,
+    seller_user_id INTEGER,
+    listed_at DATETIME, -- Только у added
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Покупки между шардами в процессе (utils/shards.py): лот уже снят с рынка, стороны
+-- покупателя и продавца применяются в своих файлах, строка удаляется вместе с записью сделки
+CREATE TABLE IF NOT EXISTS pending_trades (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    listing_id INTEGER NOT NULL,
+    seller_user_id INTEGER NOT NULL,
+    buyer_user_id INTEGER NOT NULL,
+    inventory_item_id INTEGER UNIQUE NOT NULL, -- Проданный предмет продавца
+    phone_id INTEGER NOT NULL,
+    price_signals INTEGER NOT NULL,
+    listed_at DATETIME NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Сделки рынка: пишутся в транзакции покупки и больше не меняются
+CREATE TABLE IF NOT EXISTS trades (
+    id INTEGER PRIMARY KEY,
+    listing_id INTEGER NOT NULL, -- Лота уже нет: покупка его удаляет
+    phone_id INTEGER NOT NULL,
+    seller_user_id INTEGER,
+    buyer_user_id INTEGER,
+    inventory_item_id INTEGER,
+    price_signals INTEGER NOT NULL,
+    traded_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (phone_id) REFERENCES phones (id),
+    FOREIGN KEY (seller_user_id) REFERENCES users (id),
+    FOREIGN KEY (buyer_user_id) REFERENCES users (id)
+);
+
+-- Свечи по сделкам модели, их ведёт триггер на trades. period — длина корзины
+-- в секундах (utils.trades.CANDLE_PERIODS), bucket_start — её начало в unix time
+CREATE TABLE IF NOT EXISTS trade_candles (
+    phone_id INTEGER NOT NULL,
+    period INTEGER NOT NULL,
+    bucket_start INTEGER NOT NULL,
+    open_price INTEGER NOT NULL,
+    high_price INTEGER NOT NULL,
+    low_price INTEGER NOT NULL,
+    close_price INTEGER NOT NULL,
+    volume INTEGER NOT NULL, -- Число сделок
+    turnover INTEGER NOT NULL, -- Сумма цен; VWAP = turnover / volume
+    PRIMARY KEY (phone_id, period, bucket_start)
+) WITHOUT ROWID;
+
+-- Итоги по модели за всё время, их ведёт тот же триггер
+CREATE TABLE IF NOT EXISTS phone_trade_stats (
+    phone_id INTEGER PRIMARY KEY,
+    last_price INTEGER NOT NULL,
+    last_traded_at DATETIME NOT NULL,
+    volume INTEGER NOT NULL,
+    turnover INTEGER NOT NULL
+);
+"""
+
+# Индексы по данным игроков; в шардированном режиме они же создаются в файлах шардов (utils/shards.py)
+PLAYER_INDEXES_SQL = """
+-- Инвентарь: сводка по моделям и страницы по (phone_id, id) только из индекса
+CREATE INDEX IF NOT EXISTS idx_user_inventory_user_phone
+    ON user_inventory (user_id, phone_id);
+-- Рейтинг по состоянию: выражение совпадает с utils.leaderboard.NET_WORTH
+CREATE INDEX IF NOT EXISTS idx_users_net_worth
+    ON users (signals + inventory_value DESC);
+"""
+
+# Индексы создаются после миграций: они могут ссылаться на добавленные колонки
+CREATE_INDEXES_SQL = """
+-- Лента рынка: ORDER BY listed_at DESC, id DESC с курсором по (listed_at, id).
+-- Покрывающий: фильтры по цене и "кроме продавца" проверяются в самом индексе,
+-- строки таблицы при упорядоченном обходе не читаются
+DROP INDEX IF EXISTS idx_market_listings_listed;
+CREATE INDEX IF NOT EXISTS idx_market_listings_listed_covering
+    ON market_listings (listed_at, id, price_signals, seller_user_id, phone_id);
+CREATE INDEX IF NOT EXISTS idx_market_listings_phone_listed
+    ON market_listings (phone_id, listed_at, id);
+CREATE INDEX IF NOT EXISTS idx_market_listings_seller_listed
+    ON market_listings (seller_user_id, listed_at, id);
+CREATE INDEX IF NOT EXISTS idx_market_listings_rarity_listed
+    ON market_listings (rarity, listed_at, id);
+CREATE INDEX IF NOT EXISTS idx_market_listings_brand_listed
+    ON market_listings (brand, listed_at, id);
+-- Модель встречается в кейсе один раз: повторная строка исказила бы шансы
+CREATE UNIQUE INDEX IF NOT EXISTS idx_case_contents_case_phone
+    ON case_contents (case_id, phone_id);
+""" + PLAYER_INDEXES_SQL
+
+# Стоимость инвентаря при передаче и удалении предметов. Шаблон: в файлах шардов
+# phones лежит в подключённой общей БД, и там это TEMP-триггеры соединения (utils/shards.py)
+INVENTORY_VALUE_TRIGGERS_SQL = """
+CREATE {temp}TRIGGER IF NOT EXISTS trg_user_inventory_value_update AFTER UPDATE OF user_id, phone_id ON {table}
+BEGIN
+    UPDATE users SET inventory_value = inventory_value - COALESCE((SELECT value FROM phones WHERE id = OLD.phone_id), 0)
+    WHERE id = OLD.user_id;
+    UPDATE users SET inventory_value = inventory_value + COALESCE((SELECT value FROM phones WHERE id = NEW.phone_id), 0)
+    WHERE id = NEW.user_id;
+END;
+CREATE {temp}TRIGGER IF NOT EXISTS trg_user_inventory_value_delete AFTER DELETE ON {table}
+BEGIN
+    UPDATE users SET inventory_value = inventory_value - COALESCE((SELECT value FROM phones WHERE id = OLD.phone_id), 0)
+    WHERE id = OLD.user_id;
+END;
+"""
+
+# Любое изменение каталога поднимает его версию: кэши каталога в процессах
+# бота и веб-API сверяют её и перестраивают снимок.
+# users.inventory_value при передаче и удалении предметов и при переоценке моделей
+# ведут триггеры. Вставки в user_inventory (кейсы, стартовый телефон) прибавляют
+# стоимость сами, тем же UPDATE users, что меняет баланс: триггер на вставку
+# обновлял бы users на каждый приз массового открытия
+CREATE_TRIGGERS_SQL = """
+CREATE TRIGGER IF NOT EXISTS trg_phones_catalog_insert AFTER INSERT ON phones
+BEGIN
+    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_phones_catalog_update AFTER UPDATE ON phones
+BEGIN
+    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_phones_catalog_delete AFTER DELETE ON phones
+BEGIN
+    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_cases_catalog_insert AFTER INSERT ON cases
+BEGIN
+    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_cases_catalog_update AFTER UPDATE ON cases
+BEGIN
+    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_cases_catalog_delete AFTER DELETE ON cases
+BEGIN
+    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_case_contents_catalog_insert AFTER INSERT ON case_contents
+BEGIN
+    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_case_contents_catalog_update AFTER UPDATE ON case_contents
+BEGIN
+    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_case_contents_catalog_delete AFTER DELETE ON case_contents
+BEGIN
+    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+END;
+
+""" + INVENTORY_VALUE_TRIGGERS_SQL.format(temp="", table="user_inventory") + """
+-- Редкость и бренд модели копируются в её лоты: по ним рынок фильтруется через индексы
+CREATE TRIGGER IF NOT EXISTS trg_phones_listing_attributes AFTER UPDATE OF rarity, brand ON phones
+WHEN NEW.rarity IS NOT OLD.rarity OR NEW.brand IS NOT OLD.brand
+BEGIN
+    UPDATE market_listings SET rarity = NEW.rarity, brand = NEW.brand WHERE phone_id = NEW.id;
+END;
+
+-- Переоценка модели проходит по всему инвентарю, но случается только при правке каталога
+CREATE TRIGGER IF NOT EXISTS trg_phones_value_update AFTER UPDATE OF value ON phones
+WHEN NEW.value IS NOT OLD.value
+BEGIN
+    UPDATE users SET inventory_value = inventory_value + (COALESCE(NEW.value, 0) - COALESCE(OLD.value, 0)) * held.count
+    FROM (SELECT user_id, COUNT(*) AS count FROM user_inventory WHERE phone_id = NEW.id GROUP BY user_id) AS held
+    WHERE users.id = held.user_id;
+END;
+
+-- Журнал сделок только пополняется
+CREATE TRIGGER IF NOT EXISTS trg_trades_no_update BEFORE UPDATE ON trades
+BEGIN
+    SELECT RAISE(ABORT, 'trades is append-only');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_trades_no_delete BEFORE DELETE ON trades
+BEGIN
+    SELECT RAISE(ABORT, 'trades is append-only');
+END;
+-- Каждая сделка обновляет три свечи (час, сутки, неделя с понедельника) и итоги модели:
+-- графики и статистика читают готовые корзины, а не сырые сделки.
+-- Периоды совпадают с utils.trades.CANDLE_PERIODS
+CREATE TRIGGER IF NOT EXISTS trg_trades_rollup AFTER INSERT ON trades
+BEGIN
+    INSERT INTO trade_candles (
+        phone_id, period, bucket_start, open_price, high_price, low_price, close_price, volume, turnover
+    )
+    SELECT NEW.phone_id, periods.seconds, traded.epoch - (traded.epoch - periods.shift) % periods.seconds,
+           NEW.price_signals, NEW.price_signals, NEW.price_signals, NEW.price_signals, 1, NEW.price_signals
+    FROM (SELECT CAST(strftime('%s', NEW.traded_at) AS INTEGER) AS epoch) AS traded,
+         (SELECT 3600 AS seconds, 0 AS shift
+          UNION ALL SELECT 86400, 0
+          UNION ALL SELECT 604800, 345600) AS periods -- 1970-01-01 — четверг, сдвиг до понедельника
+    WHERE true
+    ON CONFLICT (phone_id, period, bucket_start) DO UPDATE SET
+        high_price = MAX(high_price, excluded.high_price),
+        low_price = MIN(low_price, excluded.low_price),
+        close_price = excluded.close_price,
+        volume = volume + 1,
+        turnover = turnover + excluded.turnover;
+    INSERT INTO phone_trade_stats (phone_id, last_price, last_traded_at, volume, turnover)
+    VALUES (NEW.phone_id, NEW.price_signals, NEW.traded_at, 1, NEW.price_signals)
+    ON CONFLICT (phone_id) DO UPDATE SET
+        last_price = excluded.last_price,
+        last_traded_at = excluded.last_traded_at,
+        volume = volume + 1,
+        turnover = turnover + excluded.turnover;
+END;
+"""
+
+# Пересчёт users.inventory_value с нуля: миграция и загрузка в обход триггеров
+INVENTORY_VALUE_BACKFILL_SQL = """
+    UPDATE users SET inventory_value = totals.value
+    FROM (
+        SELECT ui.user_id, SUM(COALESCE(p.value, 0)) AS value
+        FROM user_inventory ui JOIN phones p ON p.id = ui.phone_id
+        GROUP BY ui.user_id
+    ) AS totals
+    WHERE users.id = totals.user_id
+"""
+
+# Свечи и итоги по моделям с нуля из trades, для загрузки в обход триггеров
+# (периоды — как в trg_trades_rollup). Открытие и закрытие корзины — первая и последняя сделки по id
+TRADE_ROLLUPS_BACKFILL_SQL = """
+    DELETE FROM trade_candles;
+    INSERT INTO trade_candles (
+        phone_id, period, bucket_start, open_price, high_price, low_price, close_price, volume, turnover
+    )
+    SELECT buckets.phone_id, buckets.period, buckets.bucket_start, first.price_signals, buckets.high_price,
+           buckets.low_price, last.price_signals, buckets.volume, buckets.turnover
+    FROM (
+        SELECT t.phone_id, periods.seconds AS period,
+               t.epoch - (t.epoch - periods.shift) % periods.seconds AS bucket_start,
+               MIN(t.id) AS first_id, MAX(t.id) AS last_id, MAX(t.price_signals) AS high_price,
+               MIN(t.price_signals) AS low_price, COUNT(*) AS volume, SUM(t.price_signals) AS turnover
+        FROM (SELECT id, phone_id, price_signals, CAST(strftime('%s', traded_at) AS INTEGER) AS epoch FROM trades) AS t,
+             (SELECT 3600 AS seconds, 0 AS shift
+              UNION ALL SELECT 86400, 0
+              UNION ALL SELECT 604800, 345600) AS periods
+        GROUP BY 1, 2, 3
+    ) AS buckets
+    JOIN trades first ON first.id = buckets.first_id
+    JOIN trades last ON last.id = buckets.last_id;
+    DELETE FROM phone_trade_stats;
+    INSERT INTO phone_trade_stats (phone_id, last_price, last_traded_at, volume, turnover)
+    SELECT totals.phone_id, last.price_signals, last.traded_at, totals.volume, totals.turnover
+    FROM (
+        SELECT phone_id, MAX(id) AS last_id, COUNT(*) AS volume, SUM(price_signals) AS turnover
+        FROM trades GROUP BY phone_id
+    ) AS totals
+    JOIN trades last ON last.id = totals.last_id;
+"""
+
+# Колонки, добавленные после первого релиза: (таблица, колонка, объявление, SQL дозаполнения)
+ADDED_COLUMNS = [
+    (
+        "market_listings",
+        "phone_id",
+        "INTEGER REFERENCES phones (id)",
+        """UPDATE market_listings SET phone_id = (
+               SELECT phone_id FROM user_inventory WHERE id = market_listings.inventory_item_id
+           )""",
+    ),
+    ("users", "inventory_value", "INTEGER NOT NULL DEFAULT 0", INVENTORY_VALUE_BACKFILL_SQL),
+    (
+        "market_listings",
+        "rarity",
+        "TEXT COLLATE NOCASE",
+        "UPDATE market_listings SET rarity = (SELECT rarity FROM phones WHERE id = market_listings.phone_id)",
+    ),
+    (
+        "market_listings",
+        "brand",
+        "TEXT COLLATE NOCASE",
+        "UPDATE market_listings SET brand = (SELECT brand FROM phones WHERE id = market_listings.phone_id)",
+    ),
+]
+
+# Уникальные индексы, добавленные после первого релиза: (индекс, SQL, убирающий
+# дубликаты до его создания в CREATE_INDEXES_SQL). Из дублей остаётся последняя строка
+ADDED_UNIQUE_INDEXES = [
+    (
+        "idx_case_contents_case_phone",
+        """DELETE FROM case_contents WHERE id NOT IN (
+               SELECT MAX(id) FROM case_contents GROUP BY case_id, phone_id
+           )""",
+    ),
+]
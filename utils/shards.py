@@ -0,0 +1,243 @@
+# utils/shards.py
+# Шардирование данных игроков (DB_SHARDS > 1, только бот — database.py).
+#
+# users и user_inventory делятся по хэшу telegram_id на DB_SHARDS файлов рядом
+# с DATABASE_PATH; каталог, рынок, сделки и лента остаются в общем файле. Каждое
+# соединение шарда подключает общий файл через ATTACH ... AS shared, поэтому
+# запросы к phones и market_listings пишутся так же, как без шардов.
+#
+# Транзакция в WAL атомарна только в пределах одного файла, поэтому ни одна
+# транзакция не пишет в два файла. Покупка, где покупатель и продавец могут
+# жить в разных шардах, идёт в три шага с журналом pending_trades в общем файле:
+#   1. общий файл: лот снимается (CLAIM_LISTING_SQL) и записывается pending_trades;
+#   2. шард покупателя: списание и новый предмет; шард продавца: зачисление и
+#      удаление проданного предмета (в одном шарде — одной транзакцией). Каждая
+#      сторона пишет отметку applied_trades в той же транзакции;
+#   3. общий файл: запись в trades, событие sold и удаление строки pending_trades.
+# Если покупателю не хватило сигналов, лот возвращается на рынок. Прерванные
+# покупки доводит до конца recovery (database._recover_pending_trades) по отметкам:
+# при запуске и затем раз в PENDING_TRADES_RECOVERY_SECONDS, пока бот работает.
+#
+# Покупатель получает предмет с новым id, проданный id больше никому не
+# принадлежит; trades.inventory_item_id — это он. Повторно выставить предмет,
+# пока продавец ещё не увидел продажу, не даёт проверка pending_trades и trades
+# (INSERT_SHARDED_LISTING_SQL).
+#
+# Переоценка модели (trg_phones_value_update) видит только пустую users общего
+# файла. Шард помнит версию каталога, по которой последний раз пересчитан
+# users.inventory_value, и отставший шард пересчитывается INVENTORY_VALUE_BACKFILL_SQL
+# (database._sync_inventory_values, вместе с recovery).
+#
+# Число шардов записано в общем файле (shard_meta): запуск с другим DB_SHARDS,
+# в том числе переход с одного файла на шарды, останавливается с ошибкой.
+# Веб-API (utils/database.py) шарды не читает, поэтому их включает только явный
+# DB_SHARDS_BOT_ONLY=1.
+#
+# Когда включать. Режим только для бота и окупается только при нескольких
+# процессах бота на нескольких ядрах, которые упираются в блокировку записи
+# одного файла. На одном ядре шарды медленнее: каждая покупка пишет в несколько
+# файлов, а параллелить записи некому. benchmarks/bench_shards.py на 1 CPU:
+# x0.54 с 2 шардами и x0.68 с 4 относительно одного файла. Перед включением
+# прогоните его на целевой машине; при os.cpu_count() < 2 init_db предупреждает.
+import heapq
+import json
+import os
+import zlib
+from itertools import islice
+
+from utils.schema import INVENTORY_VALUE_TRIGGERS_SQL, PLAYER_INDEXES_SQL, PRAGMAS
+
+MAX_SHARDS = 64
+# id игроков и предметов шарда k начинаются с k << SHARD_ID_SHIFT: шард виден по id,
+# а id предметов уникальны между шардами (на них ссылается market_listings)
+SHARD_ID_SHIFT = 40
+SHARED_SCHEMA = "shared"
+# Незавершённую покупку моложе этого recovery не трогает: её, возможно, ещё ведёт другой процесс
+PENDING_TRADE_TIMEOUT_SECONDS = 300
+PENDING_TRADES_RECOVERY_SECONDS = 60
+
+# Внешние ключи между файлами не проверяются, а users общего файла пуста
+SHARDED_PRAGMAS = tuple(
+    "PRAGMA foreign_keys = OFF" if pragma.startswith("PRAGMA foreign_keys") else pragma for pragma in PRAGMAS
+)
+
+
+def shard_paths(path, count):
+    """Файлы шардов: game_database.db -> game_database.shard0.db, ..."""
+    root, ext = os.path.splitext(path)
+    return [f"{root}.shard{shard}{ext or '.db'}" for shard in range(count)]
+
+
+def shard_for_telegram_id(telegram_id, count):
+    # crc32, а не hash(): номер шарда не должен зависеть от процесса и PYTHONHASHSEED
+    return zlib.crc32(str(telegram_id).encode()) % count
+
+
+def shard_of(row_id):
+    """Шард по users.id или user_inventory.id."""
+    return row_id >> SHARD_ID_SHIFT
+
+
+# Колонки users — как в CREATE_TABLES_SQL (SELECT * отдаёт те же поля).
+# AUTOINCREMENT: счётчик в sqlite_sequence, с которого начинаются id шарда
+SHARD_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_id INTEGER UNIQUE NOT NULL,
+    signals INTEGER DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    inventory_value INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS user_inventory (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    phone_id INTEGER, -- phones в общем файле
+    acquired_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+-- Стороны покупок, уже применённые в этом шарде (side: buyer / seller)
+CREATE TABLE IF NOT EXISTS applied_trades (
+    pending_id INTEGER NOT NULL,
+    side TEXT NOT NULL,
+    inventory_item_id INTEGER, -- У покупателя — id нового предмета
+    PRIMARY KEY (pending_id, side)
+) WITHOUT ROWID;
+-- Версия каталога (catalog_meta общего файла), по которой пересчитан users.inventory_value
+CREATE TABLE IF NOT EXISTS shard_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    values_version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO shard_state (id, values_version) VALUES (1, 0);
+""" + PLAYER_INDEXES_SQL
+SHARD_ID_TABLES = ("users", "user_inventory")
+# Постоянный триггер шарда не видит phones подключённого файла, TEMP-триггер соединения — видит
+SHARD_TEMP_TRIGGERS_SQL = INVENTORY_VALUE_TRIGGERS_SQL.format(temp="TEMP ", table="main.user_inventory")
+
+
+def shard_writer_sql(shard):
+    """Скрипт писателя шарда при подключении: схема, начало id шарда и TEMP-триггеры."""
+    seeds = "".join(
+        f"INSERT INTO sqlite_sequence (name, seq) SELECT '{table}', {shard << SHARD_ID_SHIFT}"
+        f" WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = '{table}');\n"
+        for table in SHARD_ID_TABLES
+    )
+    return SHARD_TABLES_SQL + seeds + SHARD_TEMP_TRIGGERS_SQL
+
+
+# --- Число шардов ---
+SHARD_COUNT_SQL = "SELECT shards FROM shard_meta WHERE id = 1"
+RECORD_SHARD_COUNT_SQL = "INSERT OR IGNORE INTO shard_meta (id, shards) VALUES (1, ?)"
+SHARED_PLAYERS_EXIST_SQL = "SELECT EXISTS (SELECT 1 FROM users)"
+
+
+def check_shard_count(stored, configured, shared_players):
+    """Ошибка, если БД разбита не на configured файлов (stored — из shard_meta, None — не записано).
+
+    Игроки не переносятся между файлами: с другим числом шардов они остались бы
+    там, где их уже никто не ищет.
+    """
+    if stored is None:
+        if configured > 1 and shared_players:
+            raise RuntimeError(
+                f"В общем файле уже есть игроки без шардов: DB_SHARDS={configured} "
+                "для этой БД не поддерживается"
+            )
+    elif stored != configured:
+        raise RuntimeError(
+            f"Число шардов БД — {stored}, а DB_SHARDS={configured}: перенос игроков между шардами "
+            "не поддерживается"
+        )
+
+
+# Индексы общего файла для проверки повторного выставления
+SHARED_INDEXES_SQL = """
+CREATE INDEX IF NOT EXISTS idx_trades_inventory_item ON trades (inventory_item_id);
+"""
+
+
+# --- Рынок ---
+OWNED_ITEM_SQL = "SELECT phone_id FROM user_inventory WHERE id = ? AND user_id = ?"
+INSERT_SHARDED_LISTING_SQL = """
+    INSERT INTO market_listings (seller_user_id, inventory_item_id, phone_id, rarity, brand, price_signals)
+    SELECT ?1, ?2, listing.phone_id, p.rarity, p.brand, ?4
+    FROM (SELECT ?3 AS phone_id) AS listing LEFT JOIN phones p ON p.id = listing.phone_id
+    WHERE NOT EXISTS (SELECT 1 FROM pending_trades WHERE inventory_item_id = ?2)
+      AND NOT EXISTS (SELECT 1 FROM trades WHERE inventory_item_id = ?2)
+    RETURNING id, phone_id, listed_at
+"""
+SELLER_TELEGRAM_IDS_SQL = "SELECT id, telegram_id FROM users WHERE id IN ({})"
+
+# --- Покупка между шардами ---
+INSERT_PENDING_TRADE_SQL = """
+    INSERT INTO pending_trades (
+        listing_id, seller_user_id, buyer_user_id, inventory_item_id, phone_id, price_signals, listed_at
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    RETURNING *
+"""
+# Удаление строки — право завершить или откатить покупку: второй процесс удалит 0 строк
+CLOSE_PENDING_TRADE_SQL = "DELETE FROM pending_trades WHERE id = ?"
+# Лот возвращается под прежним id, если его ещё не занял новый лот (id без AUTOINCREMENT)
+RESTORE_LISTING_SQL = """
+    INSERT INTO market_listings (
+        id, seller_user_id, inventory_item_id, phone_id, rarity, brand, price_signals, listed_at
+    )
+    SELECT CASE WHEN EXISTS (SELECT 1 FROM market_listings WHERE id = ?1) THEN NULL ELSE ?1 END,
+           ?2, ?3, listing.phone_id, p.rarity, p.brand, ?5, ?6
+    FROM (SELECT ?4 AS phone_id) AS listing LEFT JOIN phones p ON p.id = listing.phone_id
+    RETURNING id, phone_id, listed_at
+"""
+STALE_PENDING_TRADES_SQL = f"""
+    SELECT * FROM pending_trades
+    WHERE created_at <= datetime('now', '-{PENDING_TRADE_TIMEOUT_SECONDS} seconds')
+    ORDER BY id
+"""
+# Все покупки с меньшим id закрыты: либо это самая старая открытая, либо следующий id
+PENDING_TRADES_FLOOR_SQL = """
+    SELECT COALESCE(
+        (SELECT MIN(id) FROM pending_trades),
+        (SELECT seq + 1 FROM sqlite_sequence WHERE name = 'pending_trades'),
+        0
+    )
+"""
+INSERT_BOUGHT_ITEM_SQL = "INSERT INTO user_inventory (user_id, phone_id) VALUES (?, ?)"
+DELETE_SOLD_ITEM_SQL = "DELETE FROM user_inventory WHERE id = ? AND user_id = ?"
+# rowcount 0 — сторона уже применена
+MARK_APPLIED_SQL = """
+    INSERT INTO applied_trades (pending_id, side, inventory_item_id) VALUES (?, ?, ?)
+    ON CONFLICT DO NOTHING
+"""
+APPLIED_SIDE_SQL = "SELECT inventory_item_id FROM applied_trades WHERE pending_id = ? AND side = ?"
+# Отметки нужны, только пока строка pending_trades жива
+PRUNE_APPLIED_SQL = "DELETE FROM applied_trades WHERE pending_id < ?"
+BUYER, SELLER = "buyer", "seller"
+
+# --- Переоценка ---
+# Версия каталога, если шард по ней ещё не пересчитан; запись первой — блокировка шарда
+# берётся до чтения общего файла, и пересчёт видит цены этой версии
+CLAIM_VALUES_VERSION_SQL = """
+    UPDATE shard_state SET values_version = (SELECT version FROM catalog_meta WHERE id = 1)
+    WHERE id = 1 AND values_version < (SELECT version FROM catalog_meta WHERE id = 1)
+    RETURNING values_version
+"""
+
+
+def bought_phone_ids(phone_id):
+    """Параметр json_each в DEBIT_CASE_PRICE_SQL: стоимость купленного телефона."""
+    return json.dumps([phone_id])
+
+
+# --- Рейтинг ---
+def merge_top_players(row_lists, limit):
+    """Строки TOP_PLAYERS_SQL со всех шардов в общем порядке (net_worth DESC, id)."""
+    merged = heapq.merge(*row_lists, key=lambda row: (-row["net_worth"], row["id"]))
+    return list(islice(merged, limit))
+
+
+def merge_net_worth_distributions(row_lists):
+    """Строки NET_WORTH_DISTRIBUTION_SQL со всех шардов по возрастанию net_worth.
+
+    Одинаковые net_worth разных шардов остаются отдельными строками:
+    build_rank_snapshot считает их так же, как одну.
+    """
+    return list(heapq.merge(*row_lists, key=lambda row: row[0]))
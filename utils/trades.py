@@ -0,0 +1,91 @@
+# utils/trades.py
+# История цен по сделкам рынка для бота (database.py) и веб-API (utils/database.py).
+# Свечи и итоги по моделям ведёт триггер на trades (utils/schema.py), здесь только чтение
+import time
+
+# Название периода -> длина корзины в секундах; те же периоды в триггере trg_trades_rollup
+CANDLE_PERIODS = {"1h": 3600, "24h": 86400, "7d": 604800}
+CANDLES_LIMIT = 48
+MAX_CANDLES_LIMIT = 500
+# Окна статистики в часовых свечах: 1h — текущий час, 24h — он и 23 предыдущих
+STATS_WINDOW_HOURS = {"1h": 1, "24h": 24, "7d": 168}
+HOUR = CANDLE_PERIODS["1h"]
+
+# Свечи отдаются от новых к старым по первичному ключу (phone_id, period, bucket_start)
+CANDLES_SQL = """
+    SELECT bucket_start, open_price, high_price, low_price, close_price, volume, turnover
+    FROM trade_candles
+    WHERE phone_id = ? AND period = ? AND bucket_start < ?
+    ORDER BY bucket_start DESC
+    LIMIT ?
+"""
+HOURLY_CANDLES_SINCE_SQL = f"""
+    SELECT bucket_start, low_price, high_price, volume, turnover
+    FROM trade_candles
+    WHERE phone_id = ? AND period = {HOUR} AND bucket_start >= ?
+"""
+PHONE_TRADE_STATS_SQL = """
+    SELECT last_price, last_traded_at, volume, turnover FROM phone_trade_stats WHERE phone_id = ?
+"""
+
+
+def vwap(turnover, volume):
+    return round(turnover / volume, 2) if volume else None
+
+
+def build_candles_query(phone_id, period="1h", limit=CANDLES_LIMIT, before=None):
+    """(sql, params) для свечей модели: period — ключ CANDLE_PERIODS, before — unix time.
+
+    Корзины без сделок не хранятся: в ответе между свечами бывают пропуски.
+    """
+    if period not in CANDLE_PERIODS:
+        raise ValueError(f"period должен быть одним из: {', '.join(CANDLE_PERIODS)}")
+    limit = max(1, min(int(limit), MAX_CANDLES_LIMIT))
+    before = int(before) if before is not None else 2 ** 62
+    return CANDLES_SQL, (phone_id, CANDLE_PERIODS[period], before, limit)
+
+
+def candles_payload(rows):
+    """Строки CANDLES_SQL в хронологическом порядке, для графика."""
+    return [
+        {
+            "time": row["bucket_start"],
+            "open": row["open_price"],
+            "high": row["high_price"],
+            "low": row["low_price"],
+            "close": row["close_price"],
+            "volume": row["volume"],
+            "vwap": vwap(row["turnover"], row["volume"]),
+        }
+        for row in reversed(rows)
+    ]
+
+
+def stats_since(now=None):
+    """Начало самой ранней часовой свечи, нужной для STATS_WINDOW_HOURS."""
+    now = int(time.time() if now is None else now)
+    return now - now % HOUR - (max(STATS_WINDOW_HOURS.values()) - 1) * HOUR
+
+
+def summarize_trade_stats(stats_row, hourly_rows, now=None):
+    """Последняя сделка, итоги за всё время и окна STATS_WINDOW_HOURS по часовым свечам."""
+    now = int(time.time() if now is None else now)
+    current_hour = now - now % HOUR
+    windows = {}
+    for name, hours in STATS_WINDOW_HOURS.items():
+        since = current_hour - (hours - 1) * HOUR
+        rows = [row for row in hourly_rows if row["bucket_start"] >= since]
+        volume = sum(row["volume"] for row in rows)
+        windows[name] = {
+            "volume": volume,
+            "vwap": vwap(sum(row["turnover"] for row in rows), volume),
+            "min": min((row["low_price"] for row in rows), default=None),
+            "max": max((row["high_price"] for row in rows), default=None),
+        }
+    return {
+        "last_price": stats_row["last_price"] if stats_row else None,
+        "last_traded_at": stats_row["last_traded_at"] if stats_row else None,
+        "volume": stats_row["volume"] if stats_row else 0,
+        "vwap": vwap(stats_row["turnover"], stats_row["volume"]) if stats_row else None,
+        "windows": windows,
+    }
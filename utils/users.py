@@ -0,0 +1,105 @@
+# utils/users.py
+# Общая логика пользователей для бота (database.py) и веб-API (utils/database.py)
+import threading
+import time
+from collections import OrderedDict
+
+# Стартовый набор нового игрока
+STARTER_PHONE_NAME = "Samsung Galaxy A01"
+STARTING_SIGNALS = 50
+
+# Создание пользователя со стартовым балансом и стоимостью стартового телефона
+# (параметры: telegram_id, signals, phone_id); строка возвращается только
+# если пользователь действительно новый
+UPSERT_USER_SQL = """
+    INSERT INTO users (telegram_id, signals, inventory_value)
+    VALUES (?, ?, COALESCE((SELECT value FROM phones WHERE id = ?), 0))
+    ON CONFLICT (telegram_id) DO NOTHING
+    RETURNING *
+"""
+# Стартовый набор существующему игроку (параметры: signals, phone_id, users.id)
+GRANT_STARTING_ITEMS_SQL = """
+    UPDATE users SET
+        signals = signals + ?,
+        inventory_value = inventory_value + COALESCE((SELECT value FROM phones WHERE id = ?), 0)
+    WHERE id = ?
+"""
+USER_BY_TELEGRAM_ID_SQL = "SELECT * FROM users WHERE telegram_id = ?"
+
+# Предел устаревания записи: баланс могли изменить в другом процессе
+USER_CACHE_TTL_SECONDS = 30.0
+
+
+class UserCache:
+    """Ограниченный LRU-кэш строк users по telegram_id.
+
+    Строка содержит баланс, поэтому все места, где меняется signals, вызывают
+    invalidate(users.id). Изменения из другого процесса (бот и веб-API живут
+    отдельно) видны не позже чем через ttl секунд.
+
+    Чтение из БД и put не атомарны: между ними запись могла изменить баланс
+    и вызвать invalidate, пока строки ещё нет в кэше. Поэтому перед чтением
+    берётся generation(), и put отбрасывает строку, если с тех пор был
+    хоть один invalidate.
+    """
+
+    def __init__(self, capacity=10_000, ttl=USER_CACHE_TTL_SECONDS):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._users = OrderedDict()  # telegram_id -> (время записи, строка)
+        self._telegram_ids = {}  # users.id -> telegram_id
+        self._lock = threading.Lock()
+        self._generation = 0  # растёт при каждом invalidate и clear
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def get(self, telegram_id):
+        with self._lock:
+            entry = self._users.get(telegram_id)
+            if entry is None:
+                return None
+            stored_at, user = entry
+            if time.monotonic() - stored_at >= self.ttl:
+                self._drop(telegram_id)
+                return None
+            self._users.move_to_end(telegram_id)
+            return dict(user)
+
+    def put(self, user, generation):
+        """Кладёт строку, прочитанную после generation(); устаревшая отбрасывается."""
+        if not self.capacity:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            telegram_id = user["telegram_id"]
+            self._users[telegram_id] = (time.monotonic(), dict(user))
+            self._users.move_to_end(telegram_id)
+            self._telegram_ids[user["id"]] = telegram_id
+            while len(self._users) > self.capacity:
+                self._drop(next(iter(self._users)))
+
+    def invalidate(self, *user_ids):
+        """Сбрасывает записи по users.id (после изменения баланса)."""
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                telegram_id = self._telegram_ids.get(user_id)
+                if telegram_id is not None:
+                    self._drop(telegram_id)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._users.clear()
+            self._telegram_ids.clear()
+
+    def _drop(self, telegram_id):
+        entry = self._users.pop(telegram_id, None)
+        if entry is not None:
+            self._telegram_ids.pop(entry[1]["id"], None)
+
+    def __len__(self):
+        return len(self._users)
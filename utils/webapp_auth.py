@@ -0,0 +1,51 @@
+# utils/webapp_auth.py
+# Проверка initData Telegram Mini App: веб-API узнаёт игрока только из подписанных
+# Telegram данных, а не из userId, который может подставить любой клиент.
+# https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import parse_qsl, urlencode
+
+# Заголовок, в котором фронтенд передаёт Telegram.WebApp.initData
+INIT_DATA_HEADER = "X-Telegram-Init-Data"
+# initData старше этого не принимается: перехваченная строка не живёт вечно
+INIT_DATA_MAX_AGE_SECONDS = 24 * 60 * 60
+
+
+def _secret_key(bot_token):
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+
+
+def _data_check_string(fields):
+    return "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+
+
+def verify_init_data(init_data, bot_token, max_age=INIT_DATA_MAX_AGE_SECONDS, now=None):
+    """telegram_id из проверенной initData или None, если подпись неверна или устарела."""
+    if not init_data or not bot_token:
+        return None
+    try:
+        fields = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
+    except ValueError:
+        return None
+    received = fields.pop("hash", "")
+    expected = hmac.new(_secret_key(bot_token), _data_check_string(fields).encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(received.encode(), expected.encode()):
+        return None
+    try:
+        auth_date = int(fields["auth_date"])
+        telegram_id = int(json.loads(fields["user"])["id"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if max_age and (now if now is not None else time.time()) - auth_date > max_age:
+        return None
+    return telegram_id
+
+
+def sign_init_data(fields, bot_token):
+    """initData с подписью, как её формирует Telegram (для тестов и нагрузочных скриптов)."""
+    signed = dict(fields)
+    signed["hash"] = hmac.new(_secret_key(bot_token), _data_check_string(fields).encode(), hashlib.sha256).hexdigest()
+    return urlencode(signed)
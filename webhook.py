@@ -0,0 +1,198 @@
+# webhook.py
+# Приём апдейтов Telegram через вебхук: небольшой HTTP-сервер на asyncio
+# и параллельная обработка апдейтов с сохранением порядка для каждого пользователя
+import asyncio
+import hmac
+import json
+import logging
+from http import HTTPStatus
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Бот обрабатывает только сообщения и нажатия кнопок — остальное Telegram не присылает
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+SECRET_TOKEN_HEADER = "x-telegram-bot-api-secret-token"
+MAX_BODY_SIZE = 1 << 20  # апдейт Telegram заведомо меньше
+# Метрики бота (utils/metrics.py) для Prometheus. Reverse proxy должен пробрасывать
+# наружу только путь вебхука; кроме того, /metrics требует METRICS_TOKEN, как и в index.py
+METRICS_PATH = "/metrics"
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Апдейты разных пользователей обрабатываются параллельно, одного — по очереди.
+
+    Общий предел параллельности задаёт max_concurrent_updates (семафор базового
+    класса); на каждого пользователя с апдейтами в работе заводится asyncio.Lock,
+    который честно (FIFO) пропускает его апдейты в порядке поступления.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # ключ -> [asyncio.Lock, сколько апдейтов его ждут или держат]
+
+    async def process_update(self, update, coroutine):
+        # Очередь пользователя проходится до общего семафора: иначе апдейты одного
+        # активного пользователя занимали бы слоты, ожидая друг друга
+        key = ordering_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def ordering_key(update):
+    """Чьи апдейты должны идти по очереди: пользователь, иначе чат."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return ("user", update.effective_user.id)
+    if update.effective_chat is not None:
+        return ("chat", update.effective_chat.id)
+    return None
+
+
+# --- Минимальный HTTP/1.1 ---
+async def read_http_request(reader):
+    """(method, path, headers, body) или None, если клиент закрыл соединение.
+
+    Поддерживается только тело с Content-Length — так шлёт Telegram.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, version = request_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+    headers = {"_version": version}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0"))
+    if length > MAX_BODY_SIZE:
+        raise ValueError(f"Слишком большое тело запроса: {length} байт")
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def wants_keep_alive(headers):
+    connection = headers.get("connection", "").lower()
+    if headers.get("_version") == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+
+def write_http_response(writer, status, body=b"", keep_alive=True, content_type="application/json"):
+    head = (
+        f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    writer.write(head.encode("latin-1") + body)
+
+
+class WebhookServer:
+    """HTTP-приёмник вебхука: POST на path с JSON апдейта.
+
+    Апдейт кладётся в application.update_queue, и Telegram сразу получает 200:
+    обработка идёт в фоне через update processor приложения. Соединения
+    keep-alive, поэтому Telegram переиспользует их между апдейтами.
+    Апдейт без заголовка с secret_token (его Telegram получил в set_webhook)
+    отклоняется. GET METRICS_PATH отдаёт метрики процесса бота.
+    """
+
+    def __init__(self, application, listen, port, path, secret_token):
+        if not secret_token:
+            raise ValueError("Вебхуку нужен secret_token")
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve_connection, self.listen, self.port)
+        # Порт 0 — выбрать свободный; узнаём, какой достался
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Вебхук слушает http://%s:%s%s", self.listen, self.port, self.path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_http_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    write_http_response(writer, 400, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = wants_keep_alive(headers)
+                if (method == "GET" and path.split("?", 1)[0] == METRICS_PATH and metrics.ENABLED
+                        and metrics.authorized(headers.get("authorization"))):
+                    write_http_response(writer, 200, metrics.render().encode(), keep_alive,
+                                        content_type=metrics.PROMETHEUS_CONTENT_TYPE)
+                else:
+                    write_http_response(writer, self._handle(method, path, headers, body), keep_alive=keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def _handle(self, method, path, headers, body):
+        if path.split("?", 1)[0] != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        # Байты, а не str: заголовки декодированы как latin-1, и для не-ASCII
+        # значения compare_digest со строками бросил бы TypeError вместо ответа 403
+        if not hmac.compare_digest(headers.get(SECRET_TOKEN_HEADER, "").encode(), self.secret_token.encode()):
+            logger.warning("Запрос к вебхуку с неверным секретом")
+            return 403
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            logger.warning("Не удалось разобрать апдейт из вебхука")
+            return 400
+        self.application.update_queue.put_nowait(update)
+        return 200
@@ -0,0 +1,134 @@
+# write_batcher.py
+# Групповой коммит: мелкие записи из разных апдейтов применяются одной транзакцией
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBatcher:
+    """Очередь записей с одним фоновым писателем.
+
+    submit(op) кладёт операцию в очередь и ждёт её результата. op — корутинная
+    функция op(db), выполняется на соединении-писателе пула внутри общей
+    транзакции. Ошибка одной операции не затрагивает остальные: пачка
+    откатывается и применяется заново, уже с SAVEPOINT на каждую операцию,
+    поэтому op не должна иметь побочных эффектов вне БД. Результаты и исключения
+    отдаются вызывающим после COMMIT, так что действия после await submit()
+    видят уже сохранённые данные.
+
+    В пачку попадает всё, что накопилось в очереди, пока коммитилась предыдущая
+    (до max_batch), плюс то, что придёт за max_delay секунд после первой операции.
+    Операции применяются в порядке постановки в очередь — в частности, записи
+    одного пользователя не переставляются. Очередь ограничена max_pending:
+    при переполнении submit() ждёт места.
+    """
+
+    def __init__(self, pool, max_batch=64, max_delay=0.0, max_pending=1024):
+        self.pool = pool
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self._queue = asyncio.Queue(max_pending)
+        self._writer = None
+        self._closing = False
+        self.batches = 0
+        self.operations = 0
+
+    def start(self):
+        if self._writer is None:
+            self._writer = asyncio.ensure_future(self._run())
+        return self
+
+    async def submit(self, op):
+        if self._closing:
+            raise RuntimeError("Очередь записей закрыта")
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, future))
+        return await future
+
+    async def close(self):
+        """Применяет всё, что уже в очереди, и останавливает писателя."""
+        self._closing = True
+        if self._writer is None:
+            return
+        await self._queue.put(None)
+        await self._writer
+        self._writer = None
+
+    async def _collect(self):
+        """Следующая пачка [(op, future)] и признак, что пора остановиться."""
+        first = await self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = asyncio.get_running_loop().time() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._collect()
+            if batch:
+                await self._apply(batch)
+
+    async def _apply(self, batch):
+        try:
+            try:
+                outcomes = await self._run_batch(batch, isolated=False)
+            except _OperationFailed as failed:
+                # Обычно ошибок нет и SAVEPOINT на каждую операцию — лишние обращения
+                # к БД; только если что-то упало, пачка повторяется с ними
+                if len(batch) == 1:
+                    outcomes = [(False, failed.__cause__)]
+                else:
+                    outcomes = await self._run_batch(batch, isolated=True)
+        except Exception as e:
+            logger.exception("Не удалось применить пачку из %s записей", len(batch))
+            outcomes = [(False, e)] * len(batch)
+        self.batches += 1
+        self.operations += len(batch)
+        for (_op, future), (ok, value) in zip(batch, outcomes):
+            if future.done():  # вызывающий перестал ждать (отмена)
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    async def _run_batch(self, batch, isolated):
+        outcomes = []
+        async with self.pool.transaction() as db:
+            for op, _future in batch:
+                if not isolated:
+                    try:
+                        outcomes.append((True, await op(db)))
+                    except Exception as e:
+                        raise _OperationFailed from e
+                    continue
+                await db.execute("SAVEPOINT batched_write")
+                try:
+                    outcomes.append((True, await op(db)))
+                except Exception as e:
+                    await db.execute("ROLLBACK TO batched_write")
+                    outcomes.append((False, e))
+                await db.execute("RELEASE batched_write")
+        return outcomes
+
+
+class _OperationFailed(Exception):
+    """Операция пачки упала без SAVEPOINT: пачку нужно откатить и повторить."""